@@ -0,0 +1,152 @@
+""" Benchmarks:
+generate a synthetic election (ga.synthetic) or reuse one, then time and memory-profile each stage of a validation
+ - xml: SOS detail xml -> ElectionResult
+ - xlsx: tabulator tapes -> Tabulators
+ - fields: Fields / Name resolution of race, candidate and precinct names
+ - tally: Race.tally of every candidate, and per precinct totals
+ - validate, save_xlsx: the Report
+Results are saved as json, --compare prints the change from a previous result file.
+
+ex: python bench.py --size county -o bench.json --compare old.json
+"""
+import json
+import logging
+import platform
+import subprocess
+import sys
+from argparse import ArgumentParser
+from datetime import datetime
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from profiling import Profiler
+
+VERSION = 1     # of the result file
+
+
+def _git_revision() -> str or None:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=Path(__file__).parent, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(data: Path, output: Path, profile: Profiler, jobs: int = 1):
+    """ run each stage on the election in data (a directory with an SOS xml and tapes) """
+    from validate import Report
+    from race import races
+
+    ap = ArgumentParser()
+    Report.get_args(ap)
+    report = Report(ap.parse_args(['-x', str(data), '--no-cache', '-o', str(output)]), load=False)
+    with profile.stage('xml') as counts:
+        report.load_results()
+        counts['results'] = len(set(report.results.values()))
+    with profile.stage('xlsx') as counts:
+        report.load_tabulators(jobs=jobs)
+        counts['tabulators'] = len(report.tabulators)
+
+    results = set(report.results.values())
+    contests = {er: er.contests() for er in results}
+    with profile.stage('fields') as counts:
+        queries = 0
+        for er in results:
+            for contest in contests[er]:
+                for name in (contest.name, contest.name.upper()):
+                    races.search(name)
+                race = races[contest.name]
+                for candidate in contest.candidates:
+                    race.candidates.search(candidate)
+                queries += 2 + len(contest.candidates)
+            for precinct in er._precincts:
+                er._precincts.search(precinct.lower())
+            queries += len(er._precincts)
+        counts['queries'] = queries
+    with profile.stage('tally') as counts:
+        tallies = 0
+        for er in results:
+            for contest in contests[er]:
+                race = races[contest.name]
+                for candidate in contest.candidates:
+                    race.tally(source=er.source, candidate=candidate)
+                race.tally_by('precinct', source=er.source)
+                tallies += len(contest.candidates) + 1
+        counts['tallies'] = tallies
+    with profile.stage('validate') as counts:
+        counts['findings'] = sum(1 for _ in report.validate())
+    with profile.stage('save_xlsx'):
+        report.save_xlsx(filename=output)
+
+
+def compare(current: dict, previous: dict = None) -> str:
+    """ :returns a table of each stage's time (and peak memory) relative to previous """
+    before = {s['stage']: s for s in (previous or {}).get('stages', ())}
+    lines = [f"{'stage':12} {'wall_s':>10} {'was':>10} {'ratio':>7} {'peak_mb':>9} {'was':>9}"]
+    for s in current['stages']:
+        old = before.get(s['stage'], {})
+        ratio = s['wall_s'] / old['wall_s'] if old.get('wall_s') else float('nan')
+        lines.append(f"{s['stage']:12} {s['wall_s']:10.3f} {old.get('wall_s', float('nan')):10.3f} {ratio:7.2f} "
+                     f"{s.get('peak_mb', float('nan')):9.1f} {old.get('peak_mb', float('nan')):9.1f}")
+    return '\n'.join(lines)
+
+
+def get_args():
+    from ga.synthetic import SIZES
+    ap = ArgumentParser(prog=__file__, description='time and memory-profile each stage of a validation')
+    ap.add_argument('--size', '-s', choices=sorted(SIZES), default='county', help='synthetic election size')
+    ap.add_argument('--seed', type=int, default=0, help='synthetic election random seed')
+    ap.add_argument('--data', '-d', type=str, default=None,
+                    help='benchmark an existing election directory (xml and tapes) instead of generating one')
+    ap.add_argument('--keep', '-k', type=str, default=None, help='generate the election here, and keep it')
+    ap.add_argument('--output', '-o', type=str, default='bench.json', help='results json file')
+    ap.add_argument('--compare', '-c', type=str, default=None, help='a previous results json file')
+    ap.add_argument('--jobs', '-j', type=int, default=1, help='processes loading tabulator files (0: one per cpu)')
+    ap.add_argument('--columnar', action='store_true', help='store votes in numpy arrays (Race.columnar)')
+    ap.add_argument('--lazy', action='store_true',
+                    help='build SOS contests on first use (ElectionResult.lazy), xml then only times the scan')
+    ap.add_argument('--no_memory', '--no-memory', action='store_true',
+                    help="don't trace memory (tracemalloc slows everything down)")
+    return ap.parse_args()
+
+
+def main():
+    from ga.synthetic import SIZES, generate
+    from race import Race
+    from ga.contest import ElectionResult
+    args = get_args()
+    logging.basicConfig(level=logging.CRITICAL)    # findings are counted, not printed
+    # stages aren't counted (count=False): the wrapped hot paths would skew the times
+    profile = Profiler(memory=not args.no_memory, count=False)
+    Race.columnar = args.columnar
+    ElectionResult.lazy = args.lazy
+    with TemporaryDirectory() as tmp:
+        manifest = None
+        if args.data:
+            data = Path(args.data).expanduser()
+        else:
+            with profile.stage('generate'):
+                manifest = generate(Path(args.keep or tmp), seed=args.seed, **SIZES[args.size])
+            data = Path(manifest['path'])
+        run(data, output=Path(tmp, 'report.xlsx'), profile=profile, jobs=args.jobs)
+
+    rv = {'version': VERSION, 'timestamp': datetime.now().isoformat(timespec='seconds'), 'revision': _git_revision(),
+          'python': sys.version.split()[0], 'platform': platform.platform(), 'size': None if args.data else args.size,
+          'columnar': args.columnar, 'lazy': args.lazy, 'jobs': args.jobs, 'memory': not args.no_memory, 'data': str(data),
+          'manifest': manifest and {k: v for k, v in manifest.items() if k != 'errors'} | {'errors': len(manifest['errors'])},
+          'stages': profile.stages}
+    try:
+        import resource
+        rv['maxrss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10, 1)
+    except ImportError:
+        pass
+    with open(args.output, 'w') as f:
+        json.dump(rv, f, indent=1)
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+    print(compare(rv, previous))
+
+
+if __name__ == '__main__':
+    main()
@@ -2,11 +2,15 @@
 """
 
 import re
+import threading
 import yaml
 from pathlib import Path
-from typing import Any, Iterable
+from typing import Any, Hashable, Iterable
 from util import first, longest, LogSelf, dict_sum, dict_diff
 from collections import namedtuple
+from db.index import FieldIndex
+from db.cache import SearchCache, CacheInfo
+from registry import DEFAULT, Registry, Scoped
 
 SearchResult = namedtuple('SearchResult', field_names=('name', 'value'), defaults=(None, None))
 SearchResult.__bool__ = lambda t: bool(t[0])
@@ -16,24 +20,31 @@ NOT_FOUND = SearchResult('', None)
 class Fields(dict):
     """ a Dictionary that uses Name for keys instead of str
     ex: print(Fields({Name('Joe Biden', r'.*\b(brandon|biden)\b.*'): 'y.k.t.t.' })['biden'] == 'y.k.t.t.')
+    Fields registered at import (vote types, Names) are searched by every thread, so the index and search cache are
+    only used holding the Fields' lock.  Its index is rebuilt when a Name of its Registry (or a parent) changes pattern
     """
-    _all: 'Fields' = None
+    _all: 'Fields' = Scoped('Fields', lambda: Fields())     # named Fields of the current Registry
+    cache_size: int = 1024      # default number of search results each Fields remembers
+    _watchers: tuple = ()       # ((dirty set, key), ...) see watch()
 
-    def __new__(cls, fields: Any = (), key: str = None, **kwargs):
-        if cls._all and key is not None:
+    def __new__(cls, fields: Any = (), key: str = None, cache_size: int = None, **kwargs):
+        if key is not None and cls._all:
             rv = cls._all.search(key)
             if rv:
                 return rv.value
-        return super().__new__(cls, fields, key, **kwargs)
+        rv = super().__new__(cls, fields, key, **kwargs)
+        rv._registry = Registry.current()
+        rv._lock = threading.RLock()
+        rv._index = FieldIndex(epoch=rv._registry.epochs())
+        rv._cache = SearchCache(cls.cache_size if cache_size is None else cache_size)
+        return rv
 
-    def __init__(self, fields: Any = (), key: str = None, filename: Path or str = None):
+    def __init__(self, fields: Any = (), key: str = None, filename: Path or str = None, cache_size: int = None):
         """ create a 'fields' dict with Names for keys, allowing field['string'] to return as if field['THE_STRING']
             keys can be non strings - especially tuples, but lookups of non-string keys require exact matches
+            cache_size: how many string searches to remember (0 disables), see cache_info()
         """
         self.name = key
-        if key and Fields._all is None:
-            Fields._all = Fields()
-
         super().__init__()
         self.add_all(fields)
         if filename:
@@ -48,13 +59,22 @@ class Fields(dict):
         best = NOT_FOUND
         if isinstance(key, str):
             key = key.strip()
-            for k, v in self.items():
-                if k == key:
-                    if len(k) > len(best[0]):
-                        best = SearchResult(k, v)
-                    if not best_match:
-                        break
-            return best
+            with self._lock:
+                epoch = self._registry.epochs()
+                if self._index.epoch != epoch:
+                    self._reindex(epoch)
+                best = self._cache.get((key, best_match))
+                if best is not SearchCache.MISSING:
+                    return best
+                best = NOT_FOUND
+                for k in self._candidates(key):
+                    if k == key:
+                        if len(k) > len(best[0]):
+                            best = SearchResult(k, super().__getitem__(k))
+                        if not best_match:
+                            break
+                self._cache.put((key, best_match), best)
+                return best
         elif type(key) is re.Pattern:
             for k, v in self.items():
                 if key.match(str(k)):
@@ -107,6 +127,43 @@ class Fields(dict):
                 self.add(*f)
         return len(fields)
 
+    def _candidates(self, key: str) -> Iterable:
+        """ keys which might == key, in dict order (see db.index) """
+        rv = self._index.candidates(key)
+        return self.keys() if rv is None else rv
+
+    def _reindex(self, epoch: int):
+        self._index = FieldIndex(self.keys(), epoch=epoch)
+        self._cache.invalidate()
+
+    def _store(self, key: Any, value):
+        with self._lock:
+            super().__setitem__(key, value)
+            self._index.add(key)
+            self._changed()
+
+    def _changed(self):
+        self._cache.invalidate()
+        for dirty, key in self._watchers:
+            dirty.add(key)
+
+    def watch(self, dirty: set, key: Hashable):
+        """ key is added to dirty whenever self changes (see db.index.CandidateIndex) """
+        if not any(d is dirty and k is key for d, k in self._watchers):
+            self._watchers = self._watchers + ((dirty, key),)
+
+    def unwatch(self, dirty: set, key: Hashable = None):
+        """ stop adding key (None: any key) to dirty """
+        self._watchers = tuple((d, k) for d, k in self._watchers if d is not dirty or (key is not None and k is not key))
+
+    def cache_info(self) -> CacheInfo:
+        """ :returns (hits, misses, evictions, invalidations, maxsize, currsize) of the search cache """
+        return self._cache.info()
+
+    def cache_resize(self, cache_size: int):
+        with self._lock:
+            self._cache.resize(cache_size)
+
     def _get(self, other: Any, default=None):
         try:
             return super().get(other, default=default)
@@ -118,7 +175,7 @@ class Fields(dict):
         rv = self.search(key, best_match=best_match)
         if not rv:
             rv = (key, rv[1]) if isinstance(key, Name) or type(key) is tuple else (Name(key, pattern), None)
-        super().__setitem__(rv[0], value if value is not None else rv[1])
+        self._store(rv[0], value if value is not None else rv[1])
         return rv[0]
 
     def append(self, key, pattern: re.Pattern or str = '', value=None, best_match: bool = True):
@@ -135,7 +192,50 @@ class Fields(dict):
     def __setitem__(self, item: str, value):
         if type(item) is str:
             item = Name.add(item)
-        super().__setitem__(item, value)
+        self._store(item, value)
+
+    def __delitem__(self, item):
+        with self._lock:
+            super().__delitem__(item)
+            self._index.remove(item)
+            self._changed()
+
+    def pop(self, item, *default):
+        with self._lock:
+            if item not in self.keys():
+                if default:
+                    return default[0]
+                raise KeyError(repr(item))
+            self._index.remove(item)
+            self._changed()
+            return super().pop(item)
+
+    def popitem(self):
+        with self._lock:
+            k, v = super().popitem()
+            self._index.remove(k)
+            self._changed()
+            return k, v
+
+    def clear(self):
+        with self._lock:
+            super().clear()
+            self._index.clear()
+            self._changed()
+
+    def setdefault(self, item, default=None):
+        if item not in self.keys():
+            self._store(item, default)
+        return super().__getitem__(item)
+
+    def update(self, *args, **kwargs):
+        # like dict.update, keys are stored as-is (no Name.add)
+        for k, v in dict(*args, **kwargs).items():
+            self._store(k, v)
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
 
     def __getitem__(self, item):
         try:
@@ -154,9 +254,14 @@ class Fields(dict):
         return bool(self.search(item, best_match=False)[0])
 
     def __class_getitem__(cls, item: str) -> 'Fields':
+        """ the named Fields of the current Registry, or else of its parents """
         if not item:
             raise ValueError(f"{item} isn't valid")
-        return Fields._all[item]
+        for registry in Registry.current().chain():
+            named = registry.get('Fields')
+            if named is not None and item in named:
+                return named[item]
+        raise KeyError(repr(item))
 
 
 class Name(str):
@@ -169,7 +274,10 @@ class Name(str):
     print(Name('Trump') == 'Donald Trump')
     """
     __slots__ = ['_pattern']
-    _all = Fields()
+    _all = Scoped('Name', lambda: Fields())  # Names of the current Registry, that Name.add() matches
+    # every Name created is interned in the current Registry (Registry.names), so equal strings share one Name: the
+    # one of the Registry or of a parent.  Changing the pattern of a Name bumps the epoch of its Registry and of DEFAULT
+    DEFAULT = ''    # _pattern of a Name using the default pattern (.*\bNAME\b.*), compiled on first use
 
     @classmethod
     def add(cls, name: str or tuple, pattern: re.Pattern = None):
@@ -179,61 +287,99 @@ class Name(str):
         if type(name) is Name:
             raise ValueError(f"{name} is already a name")
         name = name.strip() if name else None
+        rv = _interned(name)[0]
+        if rv is not None and dict.__contains__(cls._all(), rv):
+            return rv
         rv = cls.search(name, best_match=True)
         if rv:
-            return rv
+            return rv.name
         rv = Name(name, pattern=pattern)
         cls._all[rv] = None
         return rv
 
     def __new__(cls, name: str, pattern: re.Pattern = None, flags: re.RegexFlag = re.IGNORECASE):
-        """ create a name as long as the_exact_string doesn't already exist """
+        """ :returns the Name of the_exact_string if it already exists (updating its pattern if one is given)
+            a pattern for a Name of a parent Registry makes a new Name, the parent's is left as it is
+        """
         name = name.strip() if type(name) is str else name
-        rv = cls._all.get(name)
-        if rv is not None:
+        rv, registry = _interned(name)
+        current = Registry.current()
+        if rv is not None and (not pattern or registry is current):
             if pattern:
-                rv.set_pattern(pattern)
+                rv.set_pattern(pattern, flags)
             return rv
-        return super().__new__(cls, name)
+        rv = super().__new__(cls, name)
+        if isinstance(name, str):
+            current.names[str(rv)] = rv
+        return rv
 
     def __init__(self, name: str, pattern: str or re.Pattern = '', flags: re.RegexFlag = re.IGNORECASE):
-        self.set_pattern(pattern, flags)
+        if not hasattr(self, '_pattern'):       # an interned Name was already set up by __new__
+            self.set_pattern(pattern, flags)
 
     def set_pattern(self, pattern: str or None, flags: re.RegexFlag = re.IGNORECASE):
+        if hasattr(self, '_pattern'):
+            # a Name can be a key of any Fields, those of DEFAULT too (vocabularies): DEFAULT's epoch, which every
+            # Registry's epochs() counts, is bumped as well
+            interned, registry = _interned(str(self))
+            if interned is self and registry is not DEFAULT:
+                registry.epoch += 1
+            DEFAULT.epoch += 1
         if pattern is None:
             self._pattern = pattern             # None is allowed: it prevents fancy matching
             return
-        if not pattern:                         # other False values get the default pattern
+        if not pattern and flags == re.IGNORECASE:
+            self._pattern = Name.DEFAULT        # other False values get the default pattern, when it's needed
+            return
+        if not pattern:
             pattern = fr'.*\b{str(self)}\b.*'
         self._pattern = pattern if type(pattern) is re.Pattern else re.compile(pattern, flags)
 
+    @property
+    def pattern(self) -> re.Pattern or None:
+        """ the compiled pattern (None: exact matches only) """
+        pattern = self._pattern
+        if type(pattern) is str:
+            pattern = self._pattern = _default_pattern(str(self))
+        return pattern
+
     def __eq__(self, other: str) -> bool:
-        other = str(other)
-        if other == str(self):
+        if self is other:
+            return True
+        if not isinstance(other, str):
+            other = str(other)
+        if str.__eq__(self, other):
             return True
-        if not self._pattern:
+        if self._pattern is None:
             return False
-        return bool(self._pattern.fullmatch(other))
+        return bool(self.pattern.fullmatch(other))
 
     def __ne__(self, other):
         return not self.__eq__(other)
 
     def __hash__(self):
         # hash the string. ignore the pattern
-        return hash(str(self))
+        return str.__hash__(self)
 
     @classmethod
     def search(cls, item, best_match: bool = True) -> ('Name', Any):
-        return cls._all.search(item, best_match=best_match)
+        """ the Names of the current Registry, then those of its parents (ex: Names added at import) """
+        rv = NOT_FOUND
+        for registry in Registry.current().chain():
+            names = registry.get('Name')
+            rv = names.search(item, best_match=best_match) if names is not None else NOT_FOUND
+            if rv:
+                return rv
+        return rv
 
     def __class_getitem__(cls, item) -> Any:
-        return cls._all.search(item)[1]
+        return cls.search(item)[1]
 
     def match(self, item) -> re.Match:
-        return self._pattern.fullmatch(str(item))
+        return self.pattern.fullmatch(str(item))
 
     def _match_str(self, item: str) -> re.Match:
-        return self._pattern.fullmatch(item)
+        return self.pattern.fullmatch(item)
 
     def __repr__(self):
         return str(self)
@@ -274,6 +420,22 @@ class Name(str):
             return None
 
 
+def _interned(name: str) -> tuple:
+    """ :returns (Name, its Registry) interned as name in the current Registry or a parent, (None, None) if none is """
+    for registry in Registry.current().chain():
+        rv = registry.names.get(name)
+        if rv is not None:
+            return rv, registry
+    return None, None
+
+
+def _default_pattern(name: str) -> re.Pattern:
+    try:
+        return re.compile(fr'.*\b{name}\b.*', re.IGNORECASE)
+    except re.error:        # ex: 'Smith (Rep' - match it literally
+        return re.compile(fr'.*\b{re.escape(name)}\b.*', re.IGNORECASE)
+
+
 if __name__ == "__main__":
     import timeit
     print('main')
@@ -0,0 +1,61 @@
+""" Bounded memo for db.Fields searches:
+the same strings (vote types, 'Total Votes', candidates, precincts) are searched over and over, so each Fields remembers
+its most recent results until the Fields changes.
+"""
+from collections import OrderedDict
+from typing import Any, NamedTuple, Hashable
+
+
+class CacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    evictions: int
+    invalidations: int
+    maxsize: int
+    currsize: int
+
+
+class SearchCache:
+    """ least recently used {(query, best_match): SearchResult}, maxsize 0 disables caching """
+    __slots__ = ['_data', 'maxsize', 'hits', 'misses', 'evictions', 'invalidations']
+    MISSING = object()
+
+    def __init__(self, maxsize: int = 1024):
+        self._data = OrderedDict()
+        self.maxsize = maxsize
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key: Hashable) -> Any:
+        """ :returns the cached value or SearchCache.MISSING """
+        rv = self._data.get(key, self.MISSING)
+        if rv is self.MISSING:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._data.move_to_end(key)
+        return rv
+
+    def put(self, key: Hashable, value: Any):
+        if self.maxsize <= 0:
+            return
+        self._data[key] = value
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self):
+        if self._data:
+            self._data.clear()
+            self.invalidations += 1
+
+    def resize(self, maxsize: int):
+        self.maxsize = maxsize
+        while len(self._data) > max(maxsize, 0):
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def info(self) -> CacheInfo:
+        return CacheInfo(self.hits, self.misses, self.evictions, self.invalidations, self.maxsize, len(self._data))
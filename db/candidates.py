@@ -0,0 +1,111 @@
+""" Candidate index:
+Race.find_candidate and Contest.candidate look a candidate up without knowing its race, which used to mean a fuzzy
+search of every race's candidates.  CandidateIndex files every candidate of every race (or contest) under its words,
+with one FieldIndex for all of them, and remembers which owners hold each candidate:
+ - owners(query) returns just the races that have a candidate equal to query, a few dict lookups however many races
+ - the owners Fields and each owner's candidates are watched (Fields.watch), and changes are indexed on the next search
+ - like FieldIndex it only filters, the owners found still search their own candidates, so the results and their
+   ranking (the longest match) are the same as searching every owner
+"""
+from typing import Callable, Hashable
+from db import Fields
+from db.index import FieldIndex
+from registry import Registry
+
+_OWNERS = object()      # dirty key: owners were added or removed
+
+
+class CandidateIndex:
+    """ CandidateIndex(races(), lambda race: race.candidates).owners('Biden') -> [Race, ...] """
+    __slots__ = ['_owners', '_candidates', '_registry', '_keys', '_names', '_by_key', '_indexed', '_order', '_scan', '_dirty']
+
+    def __init__(self, owners: Fields, candidates: Callable):
+        self._owners = owners           # {owner key: owner}
+        self._candidates = candidates   # owner -> Fields of its candidates
+        self._registry = Registry.current()     # whose Names' epochs (see Registry.epochs) the index was built for
+        self._keys = FieldIndex(epoch=self._registry.epochs())     # every candidate, once
+        self._names = {}                # {str(candidate): the candidate key filed in _keys}
+        self._by_key = {}               # {candidate key: {owner key: None}}
+        self._indexed = {}              # {owner key: (owner, candidates, [candidate keys filed for it])}
+        self._order = {}                # {owner key: position in owners}
+        self._scan = {}                 # {owner key: None} owners with a candidate _keys can't stand in for
+        self._dirty = {_OWNERS}         # owner keys (or _OWNERS) changed since the last search
+        owners.watch(self._dirty, _OWNERS)
+
+    def __len__(self):
+        """ number of distinct candidates """
+        return len(self._by_key)
+
+    def owners(self, query: str) -> list or None:
+        """ :returns [owner, ...] in owners' order that have a candidate which might equal query,
+            None when every owner has to be searched (a non ascii query, see FieldIndex.candidates)
+        """
+        self._update()
+        query = query.strip()
+        keys = self._keys.candidates(query)
+        if keys is None:
+            return None
+        found = dict(self._scan)
+        for key in keys:
+            if key == query:
+                found.update(self._by_key[key])
+        return [self._indexed[key][0] for key in sorted(found, key=self._order.__getitem__)]
+
+    def _update(self):
+        epoch = self._registry.epochs()
+        if self._keys.epoch != epoch:
+            self._keys = FieldIndex(self._by_key, epoch=epoch)
+        if not self._dirty:
+            return
+        dirty = set(self._dirty)
+        self._dirty.clear()     # the watched Fields hold this set, so it is emptied rather than replaced
+        if _OWNERS in dirty:
+            dirty.discard(_OWNERS)
+            current = dict(dict.items(self._owners))
+            for key in [k for k, v in self._indexed.items() if current.get(k) is not v[0]]:
+                self._drop(key)
+            for key, owner in current.items():
+                if key not in self._indexed:
+                    candidates = self._candidates(owner)
+                    candidates.watch(self._dirty, key)
+                    self._indexed[key] = (owner, candidates, [])
+                    dirty.add(key)
+            self._order = {key: n for n, key in enumerate(current)}
+        for key in dirty:
+            if key in self._indexed:
+                self._index(key)
+
+    def _index(self, owner_key: Hashable):
+        owner, candidates, filed = self._indexed[owner_key]
+        self._unfile(owner_key, filed)
+        self._scan.pop(owner_key, None)
+        for candidate in dict.keys(candidates):
+            if not isinstance(candidate, str):
+                continue        # only equals itself, never a query string
+            key = self._names.get(str(candidate))
+            if key is None:
+                key = self._names[str(candidate)] = candidate
+                self._keys.add(key)
+                self._by_key[key] = {}
+            elif key is not candidate and getattr(key, '_pattern', None) != getattr(candidate, '_pattern', None):
+                self._scan[owner_key] = None    # the same name with another pattern, search this owner every time
+            self._by_key[key][owner_key] = None
+            filed.append(key)
+
+    def _unfile(self, owner_key: Hashable, filed: list):
+        for key in filed:
+            owners = self._by_key.get(key)
+            if owners is None:
+                continue
+            owners.pop(owner_key, None)
+            if not owners:
+                del self._by_key[key]
+                del self._names[str(key)]
+                self._keys.remove(key)
+        filed.clear()
+
+    def _drop(self, owner_key: Hashable):
+        owner, candidates, filed = self._indexed.pop(owner_key)
+        self._unfile(owner_key, filed)
+        self._scan.pop(owner_key, None)
+        candidates.unwatch(self._dirty, owner_key)
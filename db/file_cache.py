@@ -0,0 +1,189 @@
+""" On disk cache of parsed files:
+Parsing SOS xml and tape xlsx files is the slow part of a run, so the parsed (plain python) data is saved as a gzip stream
+of pickles and replayed on the next run.  Objects are still built from that data, so registries fill the same way.
+A cache file is valid while its source has the same path, size and mtime - or the same content hash if only mtime changed
+The records end with an End(count): a file cut short (or damaged) is found when it's read, it is deleted and the source
+parsed again, also when the records were already being replayed (those replayed are skipped)
+"""
+import gzip
+import hashlib
+import os
+import pickle
+from itertools import chain, islice
+from pathlib import Path
+from typing import Any, Callable, Iterable, Iterator, NamedTuple
+from util import LogSelf
+
+DEFAULT_DIR = Path('~/.cache/voterga')
+
+
+class End(NamedTuple):
+    """ the last pickle of a cache file """
+    count: int      # records before it
+
+
+def file_digest(path: Path, chunk_size: int = 1 << 20) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class FileCache(LogSelf):
+    """ cache.value(path, parse) -> parse(path) (or the cached result)
+        cache.stream_dict(path, parse, stream_key) -> the same for a dict whose stream_key is an iterator (ex: stream_xml)
+        rebuild: ignore existing cache files (they are overwritten)
+    """
+    VERSION = 2     # bump when parsers change what they return (or the file format does)
+
+    def __init__(self, directory: Path or str = DEFAULT_DIR, rebuild: bool = False, compresslevel: int = 1):
+        self.directory = Path(directory).expanduser().absolute()
+        self.rebuild = rebuild
+        self.compresslevel = compresslevel
+        self.hits = self.misses = 0
+
+    def _cache_file(self, source: Path, kind: str) -> Path:
+        key = hashlib.blake2b(f"{kind}:{Path(source).absolute()}".encode(), digest_size=16).hexdigest()
+        return self.directory.joinpath(f"{key}.pkl.gz")
+
+    def _header(self, source: Path, kind: str, digest: str = None) -> dict:
+        stat = os.stat(source)
+        return {'version': self.VERSION, 'kind': kind, 'path': str(Path(source).absolute()),
+                'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'digest': digest or file_digest(source)}
+
+    def _is_valid(self, cached: dict, source: Path, kind: str) -> bool:
+        stat = os.stat(source)
+        if (cached.get('version'), cached.get('kind'), cached.get('path'), cached.get('size')) != \
+                (self.VERSION, kind, str(Path(source).absolute()), stat.st_size):
+            return False
+        return cached.get('mtime_ns') == stat.st_mtime_ns or cached.get('digest') == file_digest(source)
+
+    def _read(self, source: Path, kind: str) -> Iterator or None:
+        """ :returns an iterator of the cached records, or None on a miss """
+        if self.rebuild:
+            return None
+        cache_file = self._cache_file(source, kind)
+        f = None
+        try:
+            f = gzip.open(cache_file, 'rb')
+            if self._is_valid(pickle.load(f), source, kind):
+                rv, f = self._records(f), None      # closed by the records
+                return rv
+        except FileNotFoundError:
+            pass
+        except Exception as e:      # unpickling raises about anything (ex: a class that moved), it's a miss
+            self.warning(f"ignoring unreadable cache {cache_file} for {source}: {e}", why='bad cache', who=str(source))
+        finally:
+            if f is not None:
+                f.close()
+        return None
+
+    @staticmethod
+    def _records(f) -> Iterator:
+        """ the records of an open cache file, raises (EOFError, pickle.UnpicklingError, ...) if it's damaged """
+        with f:
+            count = 0
+            while True:
+                record = pickle.load(f)     # EOFError: cut short, before its End
+                if type(record) is End:
+                    if record.count != count:
+                        raise EOFError(f"{count} records of {record.count}")
+                    return
+                yield record
+                count += 1
+
+    def _damaged(self, source: Path, kind: str, e: Exception):
+        cache_file = self._cache_file(source, kind)
+        self.warning(f"ignoring damaged cache {cache_file} for {source}: {type(e).__name__} {e}", why='bad cache',
+                     who=str(source))
+        cache_file.unlink(missing_ok=True)
+
+    def _write(self, source: Path, kind: str, records: Iterable) -> Iterator:
+        """ yield each record while saving it, the cache file only appears once every record was written """
+        self.directory.mkdir(mode=0o770, parents=True, exist_ok=True)
+        cache_file = self._cache_file(source, kind)
+        tmp = cache_file.with_name(f"{cache_file.name}.{os.getpid()}.tmp")
+        header = self._header(source, kind)
+        try:
+            with gzip.open(tmp, 'wb', compresslevel=self.compresslevel) as f:
+                pickle.dump(header, f, protocol=pickle.HIGHEST_PROTOCOL)
+                count = 0
+                for record in records:
+                    pickle.dump(record, f, protocol=pickle.HIGHEST_PROTOCOL)
+                    count += 1
+                    yield record
+                pickle.dump(End(count), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, cache_file)
+        finally:
+            if tmp.exists():
+                tmp.unlink()
+
+    def has(self, source: Path, kind: str) -> bool:
+        """ :returns True if value() / stream_dict() of source would replay the cache, without reading the records """
+        if self.rebuild:
+            return False
+        try:
+            with gzip.open(self._cache_file(source, kind), 'rb') as f:
+                return self._is_valid(pickle.load(f), source, kind)
+        except Exception:
+            return False
+
+    def value(self, source: Path, parse: Callable[[Path], Any], kind: str = None) -> Any:
+        """ :returns parse(source), from the cache if it is valid """
+        kind = kind or getattr(parse, '__qualname__', str(parse))
+        records = self._read(source, kind)
+        if records is not None:
+            try:
+                rv, = records       # exactly one record
+                self.hits += 1
+                return rv
+            except Exception as e:
+                self._damaged(source, kind, e)
+            finally:
+                records.close()
+        self.misses += 1
+        return list(self._write(source, kind, [parse(source)]))[0]
+
+    def stream_dict(self, source: Path, parse: Callable[[Path], dict], stream_key: str, kind: str = None) -> dict:
+        """ parse returns a dict where dict[stream_key] is an iterator (see ga.stream_xml)
+            :returns the same dict, where stream_key iterates the cached records if the cache is valid
+        """
+        kind = kind or f"{getattr(parse, '__qualname__', str(parse))}:{stream_key}"
+        records = self._read(source, kind)
+        if records is not None:
+            try:
+                rv = next(records)
+            except Exception as e:      # StopIteration: not even the head
+                records.close()
+                self._damaged(source, kind, e)
+            else:
+                self.hits += 1
+                rv[stream_key] = self._replay(source, kind, records, parse, stream_key)
+                return rv
+        self.misses += 1
+        return self._parse_dict(source, kind, parse, stream_key)
+
+    def _parse_dict(self, source: Path, kind: str, parse: Callable[[Path], dict], stream_key: str,
+                    skip: int = 0) -> dict:
+        """ parse(source), its stream written to the cache as it's iterated, without the first skip records """
+        rv = parse(source)
+        stream = rv.pop(stream_key)
+        head = dict(rv)
+        rv[stream_key] = islice(self._write(source, kind, chain([head], stream)), 1 + skip, None)
+        return rv
+
+    def _replay(self, source: Path, kind: str, records: Iterator, parse: Callable[[Path], dict],
+                stream_key: str) -> Iterator:
+        """ the cached records, then if the cache file turns out damaged, those of parsing source after them """
+        count = 0
+        try:
+            for record in records:
+                yield record
+                count += 1
+            return
+        except Exception as e:
+            self._damaged(source, kind, e)
+        self.hits -= 1
+        self.misses += 1
+        yield from self._parse_dict(source, kind, parse, stream_key, skip=count)[stream_key]
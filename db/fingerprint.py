@@ -0,0 +1,109 @@
+""" Tape fingerprints:
+A tape scanned twice (or a column copied into another file) adds its votes to its location twice.  Each tape gets a
+Fingerprint: digests of its normalized vote vector, whole and race by race, and its metadata (tabulator ID, protective
+counter, total scanned).  duplicates() finds the tapes that repeat an earlier one through hash tables, about linear time
+in the number of tapes, rather than comparing every pair:
+ - DUPLICATE: the same votes and metadata, the same tape scanned again
+ - RESCAN: the same metadata but other votes, the same tape read differently
+ - IDENTICAL: the same votes as the tape of another tabulator
+ - NEAR: most races (similarity) the same as another tape, found through a bucket per race digest.  A bucket of more
+   than max_bucket tapes (a race that many tapes counted the same) is too common to tell anything and isn't searched
+Tapes with fewer than min_votes votes only match by metadata, small tapes have the same votes by chance.
+"""
+from collections import Counter
+from hashlib import blake2b
+from operator import attrgetter
+from typing import Any, Callable, Iterable, NamedTuple
+
+DUPLICATE, RESCAN, IDENTICAL, NEAR = 'duplicate tape', 'rescanned tape', 'identical votes', 'near duplicate tape'
+
+
+def normalize(value) -> str:
+    """ ' Total  Votes' -> 'total votes' """
+    return ' '.join(str(value).lower().split())
+
+
+def _digest(value) -> bytes:
+    return blake2b(repr(value).encode(), digest_size=12).digest()
+
+
+class Fingerprint(NamedTuple):
+    votes: bytes            # digest of every (race, candidate, count)
+    races: frozenset        # digest of each race with votes
+    meta: tuple or None     # normalized metadata, None if some is missing
+    total: int              # votes
+
+    @classmethod
+    def of(cls, votes: Iterable[tuple], meta: tuple = None) -> 'Fingerprint':
+        """ votes: (race, candidate, count), ...  meta: the values which identify a tape """
+        races = {}
+        for race, candidate, count in votes:
+            races.setdefault(normalize(race), {})[normalize(candidate)] = count
+        vector = sorted((race, tuple(sorted(counts.items()))) for race, counts in races.items())
+        if meta is not None and any(m is None or normalize(m) == '' for m in meta):
+            meta = None
+        return cls(votes=_digest(vector),
+                   races=frozenset(_digest(race) for race in vector if any(c for _, c in race[1])),
+                   meta=None if meta is None else tuple(normalize(m) for m in meta),
+                   total=sum(sum(counts.values()) for counts in races.values()))
+
+    def similarity(self, other: 'Fingerprint') -> float:
+        """ the share of races with the same votes """
+        if self.votes == other.votes:
+            return 1.0
+        return len(self.races & other.races) / (max(len(self.races), len(other.races)) or 1)
+
+
+class Duplicate(NamedTuple):
+    kind: str               # DUPLICATE, RESCAN, IDENTICAL or NEAR
+    item: Any               # the later item
+    of: Any                 # the earlier item it repeats
+    similarity: float
+
+
+def duplicates(items: Iterable, fingerprint: Callable = attrgetter('fingerprint'), min_votes: int = 10,
+               similarity: float = 0.8, max_bucket: int = 32) -> list:
+    """ :returns [Duplicate, ...] of each item that repeats an earlier one (of items' order)
+        fingerprint: item -> Fingerprint
+    """
+    rv = []
+    found, by_votes, by_meta, by_race = [], {}, {}, {}     # [(item, Fingerprint)], {key: index in found}
+    for item in items:
+        fp = fingerprint(item)
+        match = _match(fp, found, by_votes, by_meta, by_race, min_votes, similarity, max_bucket)
+        if match is not None:
+            kind, n = match
+            rv.append(Duplicate(kind, item, found[n][0], fp.similarity(found[n][1])))
+        n = len(found)
+        found.append((item, fp))
+        by_votes.setdefault(fp.votes, n)
+        if fp.meta is not None:
+            by_meta.setdefault(fp.meta, n)
+        for race in fp.races:
+            by_race.setdefault(race, []).append(n)
+    return rv
+
+
+def _match(fp: Fingerprint, found: list, by_votes: dict, by_meta: dict, by_race: dict, min_votes: int,
+           similarity: float, max_bucket: int) -> tuple or None:
+    """ :returns (kind, index in found) of the earlier tape fp repeats, None if there isn't one """
+    same_votes = by_votes.get(fp.votes)
+    if fp.meta is not None:
+        if same_votes is not None and found[same_votes][1].meta == fp.meta:
+            return DUPLICATE, same_votes
+        same_meta = by_meta.get(fp.meta)
+        if same_meta is not None:
+            return (DUPLICATE if found[same_meta][1].votes == fp.votes else RESCAN), same_meta
+    if fp.total < min_votes:
+        return None
+    if same_votes is not None:
+        return IDENTICAL, same_votes
+    shared = Counter()
+    for race in fp.races:
+        bucket = by_race.get(race, ())
+        if len(bucket) <= max_bucket:
+            shared.update(bucket)
+    best = max(shared, key=lambda n: (shared[n], -n), default=None)
+    if best is not None and fp.similarity(found[best][1]) >= similarity and found[best][1].total >= min_votes:
+        return NEAR, best
+    return None
@@ -0,0 +1,94 @@
+""" Location groups:
+A tape can count several precincts ('SS15A-SS15B'), and another tape can count one of those and a third precinct, so
+the precincts whose votes can only be compared together form connected groups.  LocationGroups is a union-find:
+add() / union() are near constant time, and every precinct of a group maps to one key:
+ - a precinct counted alone keeps its own name as the key ('01A')
+ - a group of precincts is keyed by the sorted tuple of its members (('SS15A', 'SS15B'))
+"""
+from typing import Hashable, Iterable, Iterator
+
+
+class LocationGroups:
+    """ groups.add(('01A', '01B')); groups.key('01B') -> ('01A', '01B'); '01C' in groups -> False """
+    __slots__ = ['_parent', '_size', '_keys']
+
+    def __init__(self, locations: Iterable = ()):
+        self._parent = {}       # {location: parent location}, roots are their own parent
+        self._size = {}         # {root: number of members}
+        self._keys = None       # {location: group key}, built on demand after add()/union()
+        for location in locations:
+            self.add(location)
+
+    def __len__(self):
+        """ number of locations (not groups) """
+        return len(self._parent)
+
+    def __contains__(self, location: Hashable) -> bool:
+        return location in self._parent
+
+    def __iter__(self) -> Iterator:
+        """ every location """
+        return iter(self._parent)
+
+    def add(self, locations: Hashable or tuple) -> Hashable:
+        """ add a location, or a tuple of locations that are counted together :returns the root of their group """
+        if type(locations) is not tuple:
+            locations = (locations,)
+        root = None
+        for location in locations:
+            if location not in self._parent:
+                self._parent[location] = location
+                self._size[location] = 1
+                self._keys = None
+            root = location if root is None else self.union(root, location)
+        return root
+
+    def find(self, location: Hashable) -> Hashable:
+        """ :returns the root of location's group (KeyError if location was never added) """
+        parent = self._parent
+        while parent[location] is not location:     # identity: precinct Names compare by regex
+            parent[location] = parent[parent[location]]     # path halving
+            location = parent[location]
+        return location
+
+    def union(self, a: Hashable, b: Hashable) -> Hashable:
+        a, b = self.find(a), self.find(b)
+        if a is b:
+            return a
+        if self._size[a] < self._size[b]:
+            a, b = b, a
+        self._parent[b] = a
+        self._size[a] += self._size.pop(b)
+        self._keys = None
+        return a
+
+    def _build_keys(self) -> dict:
+        members = {}
+        for location in self._parent:
+            members.setdefault(self.find(location), []).append(location)
+        keys = {}
+        for group in members.values():
+            key = group[0] if len(group) == 1 else tuple(sorted(group, key=str))
+            keys.update(dict.fromkeys(group, key))
+        self._keys = keys
+        return keys
+
+    def key(self, location: Hashable, default=None) -> Hashable:
+        """ :returns the key of location's group, a tuple of locations is looked up by its first member """
+        if type(location) is tuple:
+            location = location[0] if location else None
+        keys = self._keys if self._keys is not None else self._build_keys()
+        return keys.get(location, default)
+
+    def groups(self) -> dict:
+        """ :returns {group key: (member, ...)} """
+        keys = self._keys if self._keys is not None else self._build_keys()
+        rv = {}
+        for location, key in keys.items():
+            rv.setdefault(key, []).append(location)
+        return {key: tuple(members) for key, members in rv.items()}
+
+    @staticmethod
+    def members(key: Hashable) -> tuple:
+        """ the locations of a group key """
+        return key if type(key) is tuple else (key,)
@@ -0,0 +1,137 @@
+""" Lookup index behind db.Fields:
+Fields keys are Names which compare by regex, so a plain dict lookup only finds exact strings.  Rather than run every
+key's regex against every query, FieldIndex narrows a search down to the few keys that could possibly match:
+ - exact strings: hashed
+ - default patterns (.*\\bWORDS\\b.*): a match requires every word of WORDS to be a whole word of the query,
+   so each key is filed under its rarest word, and crowded words are re-filed as the key count grows
+ - anything else (custom regex, non-ascii, ...): always a candidate (scanned)
+The index only filters, Fields still calls Name.__eq__ on each candidate so results are identical to a full scan.
+"""
+import re
+from typing import Any, Iterable
+
+_TOKEN_RE = re.compile(r'\w+', re.ASCII)
+_DEFAULT_FORM_RE = re.compile(r'\.\*\\b(?P<literal>.+)\\b\.\*', re.DOTALL)
+_REGEX_META = set(r'.^$*+?{}[]\|()')
+
+
+def pattern_literal(pattern: re.Pattern or None) -> str or None:
+    """ :returns the literal WORDS of a '.*\\bWORDS\\b.*' pattern, or None if the pattern does anything fancier """
+    if type(pattern) is not re.Pattern or not isinstance(pattern.pattern, str) or pattern.flags & re.VERBOSE:
+        return None
+    m = _DEFAULT_FORM_RE.fullmatch(pattern.pattern)
+    return default_literal(m['literal']) if m else None
+
+
+def default_literal(name: str) -> str or None:
+    """ :returns the literal WORDS of a Name's default pattern ('.*\\bNAME\\b.*' - not compiled yet) if it is one """
+    if not name.isascii() or _REGEX_META.intersection(name):
+        return None
+    return name
+
+
+def tokens(text: str) -> list:
+    """ lower case ascii words of text """
+    return _TOKEN_RE.findall(text.lower())
+
+
+class FieldIndex:
+    """ Candidate keys for a string search of a Fields, in the Fields' (dict) order """
+    __slots__ = ['_seq', '_order', '_exact', '_tokens', '_filed', '_words', '_df', '_limits', '_scan', 'epoch']
+    BUCKET_LIMIT = 16       # a word holding more keys than this gets its keys re-filed under rarer words
+
+    def __init__(self, keys: Iterable = (), epoch: int = 0):
+        self.epoch = epoch
+        self.clear()
+        for key in keys:
+            self.add(key)
+
+    def clear(self):
+        self._seq = 0
+        self._order = {}        # {key: insertion sequence} mirrors the dict order of Fields
+        self._exact = {}        # {str(key): key}
+        self._tokens = {}       # {token: {sequence: key}}
+        self._filed = {}        # {sequence: token} where each key was filed
+        self._words = {}        # {sequence: {tokens}} of each filed key
+        self._df = {}           # {token: number of keys using it}
+        self._limits = {}       # {token: bucket size that triggers re-filing}
+        self._scan = {}         # {sequence: key} keys that must always be tested
+
+    def __len__(self):
+        return len(self._order)
+
+    def add(self, key: Any):
+        if key in self._order:
+            return      # dict keeps the original key (and its position) when an equal key is assigned
+        seq = self._seq = self._seq + 1
+        self._order[key] = seq
+        if type(key) is tuple:
+            return      # tuples only match exactly, and a string never equals a tuple
+        if not isinstance(key, str):
+            self._scan[seq] = key
+            return
+        self._exact[str(key)] = key
+        try:
+            pattern = key._pattern
+        except AttributeError:
+            return      # plain str: only matches exactly
+        if pattern is None:
+            return      # None prevents fancy matching
+        literal = default_literal(str(key)) if type(pattern) is str else pattern_literal(pattern)
+        words = tokens(literal) if literal else None
+        if not words:
+            self._scan[seq] = key
+            return
+        words = self._words[seq] = set(words)
+        for word in words:
+            self._df[word] = self._df.get(word, 0) + 1
+        self._file(seq, key)
+
+    def _rarity(self, token: str):
+        return self._df[token], -len(token)
+
+    def _file(self, seq: int, key: str):
+        token = self._filed[seq] = min(self._words[seq], key=self._rarity)
+        bucket = self._tokens.setdefault(token, {})
+        bucket[seq] = key
+        if len(bucket) > self._limits.get(token, self.BUCKET_LIMIT):
+            self._limits[token] = 2 * len(bucket)
+            for _seq, _key in list(bucket.items()):
+                rarest = min(self._words[_seq], key=self._rarity)
+                if rarest != token:
+                    del bucket[_seq]
+                    self._filed[_seq] = rarest
+                    self._tokens.setdefault(rarest, {})[_seq] = _key
+
+    def remove(self, key: Any):
+        seq = self._order.pop(key, None)
+        if seq is None:
+            return
+        if isinstance(key, str):
+            self._exact.pop(str(key), None)
+        self._scan.pop(seq, None)
+        token = self._filed.pop(seq, None)
+        if token is None:
+            return
+        bucket = self._tokens[token]
+        del bucket[seq]
+        if not bucket:
+            del self._tokens[token]
+        for word in self._words.pop(seq):
+            self._df[word] -= 1
+            if not self._df[word]:
+                del self._df[word]
+
+    def candidates(self, query: str) -> list or None:
+        """ :returns keys which might equal query (in dict order), or None when a full scan is required """
+        if not query.isascii():
+            return None     # unicode case folding and word boundaries are left to the regex
+        found = dict(self._scan)
+        exact = self._exact.get(query)
+        if exact is not None:
+            found[self._order[exact]] = exact
+        for token in set(tokens(query)):
+            bucket = self._tokens.get(token)
+            if bucket:
+                found.update(bucket)
+        return [found[seq] for seq in sorted(found)]
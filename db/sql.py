@@ -0,0 +1,414 @@
+""" SQLite archive:
+Elections, contests, candidates, precincts, tapes and every vote can be kept in a local SQLite file (stdlib sqlite3),
+so results outlive a run and years of them can be queried without loading them into memory.
+ - votes are one indexed table:  (race, source, location, candidate, vote_type) -> count,  a location is a precinct
+   or the tuple of precincts a tape counts (location_members lists its precincts)
+ - SqlVotes is the vote store of a Race (like db.votes.VoteStore):  set() queues rows which are written with
+   executemany, a batch at a time in one transaction, and tally(), tally_by(), get_precinct(), records() are
+   GROUP BY queries over the indexes
+ - group_tallies() sums votes by location group for reconcile, in SQL
+
+    archive = Archive('results.sqlite')
+    Race.store = archive.votes          # races created from now on keep their votes in the archive
+    ...
+    archive.races()                     # the races of an archive (in a new run), their votes stay in the file
+"""
+import json
+import sqlite3
+from pathlib import Path
+from typing import Callable, Hashable, Iterable
+import numpy as np
+from db import Fields, Name
+from db.votes import Records
+
+BATCH = 10000       # votes queued before they're written
+TIMEOUT = 60        # seconds a write waits for another process's (statewide workers share an archive)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS elections (id INTEGER PRIMARY KEY, source TEXT UNIQUE NOT NULL, name TEXT, date TEXT,
+    region TEXT, timestamp TEXT);
+CREATE TABLE IF NOT EXISTS contests (id INTEGER PRIMARY KEY,
+    election INTEGER NOT NULL REFERENCES elections(id) ON DELETE CASCADE, name TEXT NOT NULL, key INTEGER,
+    precincts_reported INTEGER);
+CREATE INDEX IF NOT EXISTS contests_election ON contests(election, name);
+CREATE TABLE IF NOT EXISTS candidates (contest INTEGER NOT NULL REFERENCES contests(id) ON DELETE CASCADE,
+    name TEXT NOT NULL, total INTEGER);
+CREATE INDEX IF NOT EXISTS candidates_contest ON candidates(contest);
+CREATE TABLE IF NOT EXISTS precincts (election INTEGER NOT NULL REFERENCES elections(id) ON DELETE CASCADE,
+    name TEXT NOT NULL, total_voters INTEGER, ballots_cast INTEGER, voter_turnout REAL, percent_reporting REAL);
+CREATE INDEX IF NOT EXISTS precincts_election ON precincts(election, name);
+CREATE TABLE IF NOT EXISTS tapes (source INTEGER PRIMARY KEY REFERENCES sources(id), name TEXT, tabulator TEXT,
+    county TEXT, vote_type TEXT, locations TEXT, total_scanned TEXT, protective_counter TEXT);
+CREATE TABLE IF NOT EXISTS races (id INTEGER PRIMARY KEY, seat TEXT UNIQUE NOT NULL, district TEXT);
+CREATE TABLE IF NOT EXISTS sources (id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL);
+CREATE TABLE IF NOT EXISTS labels (id INTEGER PRIMARY KEY, name TEXT UNIQUE);
+CREATE TABLE IF NOT EXISTS locations (id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL);
+CREATE TABLE IF NOT EXISTS location_members (precinct TEXT NOT NULL, location INTEGER NOT NULL,
+    PRIMARY KEY (precinct, location)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS votes (race INTEGER NOT NULL, source INTEGER NOT NULL, location INTEGER NOT NULL,
+    candidate INTEGER NOT NULL, vote_type INTEGER NOT NULL, count INTEGER NOT NULL,
+    PRIMARY KEY (race, source, location, candidate, vote_type)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS votes_race_candidate ON votes(race, candidate);
+CREATE INDEX IF NOT EXISTS votes_source ON votes(source, location);
+INSERT OR IGNORE INTO labels (id, name) VALUES (0, NULL);
+"""
+_DIMENSIONS = {'candidate': 'candidate', 'source': 'source', 'precinct': 'location', 'vote_type': 'vote_type'}
+
+
+def _text(key: Hashable) -> str:
+    """ a key as stored: tuples as json lists """
+    if isinstance(key, tuple):
+        return json.dumps([_text(k) for k in key])
+    return str(key)
+
+
+def _key(text: str) -> Hashable:
+    """ a stored key as read from an archive that didn't store it (in another run) """
+    if text.startswith('['):
+        try:
+            return tuple(_key(k) for k in json.loads(text))
+        except ValueError:
+            pass
+    return Name(text)
+
+
+class _Table:
+    """ {text: id} and {id: key} of one interned table (see Archive._id, Archive._keys) """
+    __slots__ = ['name', 'ids', 'keys']
+
+    def __init__(self, name: str):
+        self.name = name
+        self.ids = {}       # {text: id}
+        self.keys = {}      # {id: key}
+
+
+class Archive:
+    """ Archive(filename): the archive in a SQLite file (':memory:' for a temporary one) """
+    def __init__(self, filename: Path or str = ':memory:'):
+        self.filename = filename if filename == ':memory:' else Path(filename).expanduser()
+        self.db = sqlite3.connect(str(self.filename), timeout=TIMEOUT)
+        self.db.execute('PRAGMA foreign_keys = ON')
+        self.db.execute('PRAGMA journal_mode = WAL')
+        self.db.execute('PRAGMA synchronous = NORMAL')
+        self.db.executescript(_SCHEMA)
+        self._tables = {name: _Table(name) for name in ('races', 'sources', 'labels', 'locations')}
+        self._tables['labels'].ids[None], self._tables['labels'].keys[0] = 0, None
+        self._pending = []          # votes waiting for flush()
+        self._reloaded = set()      # source ids whose old votes have been deleted by this Archive
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+    def _id(self, table: str, key: Hashable, add: bool = True) -> int or None:
+        """ the id of key in table (races, sources, labels or locations), added if it's new """
+        t = self._tables[table]
+        text = None if key is None else _text(key)
+        rv = t.ids.get(text)
+        if rv is None:
+            column = 'seat' if table == 'races' else 'name'
+            select = f'SELECT id FROM {t.name} WHERE {column} IS ?'
+            row = self.db.execute(select, (text,)).fetchone()
+            if row is None and not add:
+                return None
+            if row is None:
+                with self.db:       # another process may add it meanwhile: whichever is first, both get its id
+                    self.db.execute(f'INSERT OR IGNORE INTO {t.name} ({column}) VALUES (?)', (text,))
+                    row = self.db.execute(select, (text,)).fetchone()
+                    if table == 'locations':
+                        members = key if isinstance(key, tuple) else (key,)
+                        self.db.executemany('INSERT OR IGNORE INTO location_members (precinct, location) '
+                                            'VALUES (?, ?)', [(_text(m), row[0]) for m in members])
+            rv = t.ids[text] = row[0]
+        t.keys.setdefault(rv, key)
+        return rv
+
+    def _keys(self, table: str, ids: Iterable[int]) -> list:
+        """ the keys of ids, as given to _id() or else read back from the archive """
+        t = self._tables[table]
+        missing = [i for i in set(ids) if i not in t.keys]
+        if missing:
+            column = 'seat' if table == 'races' else 'name'
+            for i, text in self.db.execute(f'SELECT id, {column} FROM {t.name} WHERE id IN '
+                                           f'({",".join("?" * len(missing))})', missing):
+                t.keys[i] = None if text is None else _key(text)
+                t.ids.setdefault(text, i)
+        return [t.keys[i] for i in ids]
+
+    def queue(self, race: int, source: Hashable, location: Hashable, candidate: Hashable, vote_type: Hashable,
+              count: int):
+        """ a vote to write at the next flush() (queued votes are flushed before any query) """
+        s = self._source(source)
+        self._pending.append((race, s, self._id('locations', location), self._id('labels', candidate),
+                              self._id('labels', vote_type), int(count)))
+        if len(self._pending) >= BATCH:
+            self.flush()
+
+    def _source(self, source: Hashable) -> int:
+        """ the id of source, whose votes from an earlier run are deleted the first time it's used """
+        s = self._id('sources', source)
+        if s not in self._reloaded:
+            self._reloaded.add(s)
+            self.flush()
+            with self.db:
+                self.db.execute('DELETE FROM votes WHERE source = ?', (s,))
+        return s
+
+    def queue_many(self, rows: list):
+        self._pending.extend(rows)
+        if len(self._pending) >= BATCH:
+            self.flush()
+
+    def flush(self):
+        """ write the queued votes, one transaction """
+        if self._pending:
+            with self.db:
+                self.db.executemany('INSERT OR REPLACE INTO votes (race, source, location, candidate, vote_type, count) '
+                                    'VALUES (?, ?, ?, ?, ?, ?)', self._pending)
+            self._pending.clear()
+
+    def query(self, sql: str, args: Iterable = ()) -> sqlite3.Cursor:
+        self.flush()
+        return self.db.execute(sql, tuple(args))
+
+    def votes(self, seat: Hashable, candidates: Fields = None, district: Hashable = None) -> 'SqlVotes':
+        """ the vote store of a race, see Race.store """
+        race = self._id('races', seat)
+        if district is not None:
+            with self.db:
+                self.db.execute('UPDATE races SET district = ? WHERE id = ?', (_text(district), race))
+        return SqlVotes(self, race, candidates)
+
+    def races(self, sources: Iterable = None) -> list:
+        """ add the races of the archive (with votes from sources, default: any) to the current Registry
+            :returns [Race, ...] their votes are read from the archive when they are tallied
+        """
+        from race import Race
+        sql = 'SELECT id, seat, district FROM races'
+        args = []
+        if sources is not None:
+            ids = [self._id('sources', s, add=False) for s in sources]
+            ids = [i for i in ids if i is not None]
+            sql += f' WHERE id IN (SELECT DISTINCT race FROM votes WHERE source IN ({",".join("?" * len(ids))}))'
+            args = ids
+        rv = []
+        for race, seat, district in self.query(sql, args).fetchall():
+            seat = self._keys('races', [race])[0]
+            votes = SqlVotes(self, race)
+            votes.candidates.update(dict.fromkeys(votes.keys('candidate')))
+            rv.append(Race.add(district=None if district is None else Name(district), seat=seat,
+                               sources=set(votes.keys('source')), candidates=votes.candidates, votes=votes))
+        return rv
+
+    def save_election(self, er: 'ElectionResult') -> int:
+        """ store an ElectionResult's contests, their candidates and its precincts (turnout), replacing any earlier
+            version of its source :returns its id
+        """
+        contests = er.contests()
+        with self.db:
+            self.db.execute('DELETE FROM elections WHERE source = ?', (_text(er.source),))
+            election = self.db.execute('INSERT INTO elections (source, name, date, region, timestamp) '
+                                       'VALUES (?, ?, ?, ?, ?)',
+                                       (_text(er.source), str(er.ElectionName), er.ElectionDate.isoformat(),
+                                        er.Region, er.Timestamp.isoformat())).lastrowid
+            self.db.executemany('INSERT INTO precincts (election, name, total_voters, ballots_cast, voter_turnout, '
+                                'percent_reporting) VALUES (?, ?, ?, ?, ?, ?)',
+                                [(election, _text(p.name), p.totalVoters, p.ballotsCast, p.voterTurnout,
+                                  p.percentReporting) for p in er._precincts.values() if hasattr(p, 'ballotsCast')])
+            for c in contests:
+                contest = self.db.execute('INSERT INTO contests (election, name, key, precincts_reported) '
+                                          'VALUES (?, ?, ?, ?)',
+                                          (election, str(c.name), c._key, int(c.precinctsReported))).lastrowid
+                self.db.executemany('INSERT INTO candidates (contest, name, total) VALUES (?, ?, ?)',
+                                    [(contest, str(name), total) for name, total in c.totals.items()])
+        return election
+
+    def save_tabulators(self, tabulators: Iterable['Tabulator']) -> int:
+        """ store tapes (their votes are in the races) :returns how many """
+        rows = [(self._id('sources', tab.source), tab.name, None if tab.id is None else str(tab.id),
+                 None if tab.county is None else str(tab.county), _text(tab.vote_type), _text(tab.locations),
+                 None if tab.total_scanned is None else str(tab.total_scanned),
+                 None if tab.protective_counter is None else str(tab.protective_counter)) for tab in tabulators]
+        with self.db:
+            self.db.executemany('INSERT OR REPLACE INTO tapes (source, name, tabulator, county, vote_type, locations, '
+                                'total_scanned, protective_counter) VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        return len(rows)
+
+    def elections(self) -> list:
+        """ [{id, source, name, date, region, timestamp, contests, precincts}, ...] """
+        cursor = self.query('SELECT e.*, (SELECT COUNT(*) FROM contests c WHERE c.election = e.id), '
+                            '(SELECT COUNT(*) FROM precincts p WHERE p.election = e.id) FROM elections e ORDER BY date')
+        names = [d[0] for d in cursor.description[:-2]] + ['contests', 'precincts']
+        return [dict(zip(names, row)) for row in cursor]
+
+    def group_tallies(self, races: Iterable, sources: Iterable, vote_types: Iterable, group: Callable,
+                      by_candidate: bool = True, exclude: Hashable = None) -> dict:
+        """ votes summed by location group in SQL:  {(group, race seat, candidate, vote_type): votes}
+            races: Race, ...  group(location) -> a group (None: skip the votes of location)
+            by_candidate: False sums the candidates (except exclude) {(group, seat, vote_type): votes}
+        """
+        race_ids = {r.votes.race: r.seat for r in races if isinstance(r.votes, SqlVotes) and r.votes.archive is self}
+        source_ids = [i for i in (self._id('sources', s, add=False) for s in sources) if i is not None]
+        vote_type_ids = [i for i in (self._id('labels', v, add=False) for v in vote_types) if i is not None]
+        if not race_ids or not source_ids or not vote_type_ids:
+            return {}
+        marks = lambda li: ','.join('?' * len(li))
+        where = f'v.race IN ({marks(race_ids)}) AND v.source IN ({marks(source_ids)}) ' \
+                f'AND v.vote_type IN ({marks(vote_type_ids)}) AND v.candidate != 0'
+        args = [*race_ids, *source_ids, *vote_type_ids]
+        locations = [row[0] for row in self.query(f'SELECT DISTINCT v.location FROM votes v WHERE {where}', args)]
+        groups = {}
+        for location, key in zip(locations, self._keys('locations', locations)):
+            g = group(key)
+            if g is not None:
+                groups[location] = g
+        index = {g: n for n, g in enumerate(dict.fromkeys(groups.values()))}
+        self.db.execute('CREATE TEMP TABLE IF NOT EXISTS location_groups (location INTEGER PRIMARY KEY, grp INTEGER)')
+        with self.db:
+            self.db.execute('DELETE FROM location_groups')
+            self.db.executemany('INSERT INTO location_groups VALUES (?, ?)',
+                                [(location, index[g]) for location, g in groups.items()])
+        if exclude is not None:
+            excluded = self._id('labels', exclude, add=False)
+            if excluded is not None:
+                where += ' AND v.candidate != ?'
+                args.append(excluded)
+        columns = 'g.grp, v.race, v.candidate, v.vote_type' if by_candidate else 'g.grp, v.race, v.vote_type'
+        rows = self.query(f'SELECT {columns}, SUM(v.count) FROM votes v JOIN location_groups g '
+                          f'ON g.location = v.location WHERE {where} GROUP BY {columns}', args).fetchall()
+        keys = list(index)
+        rv = {}
+        for *key, votes in rows:
+            g, race, *labels = key
+            rv[(keys[g], race_ids[race], *self._keys('labels', labels))] = votes
+        return rv
+
+
+class SqlVotes:
+    """ the votes of one race in an Archive, the same interface as db.votes.VoteStore """
+    def __init__(self, archive: Archive, race: int, candidates: Fields = None):
+        self.archive = archive
+        self.race = race
+        self.candidates = Fields() if candidates is None else candidates
+
+    def __len__(self):
+        return self.archive.query('SELECT COUNT(*) FROM votes WHERE race = ?', (self.race,)).fetchone()[0]
+
+    def _candidate(self, candidate, add: bool = False) -> Hashable:
+        """ the candidate key, found like Fields.__getitem__ and added to candidates if needed """
+        if candidate is None or dict.__contains__(self.candidates, candidate):
+            return candidate
+        found = self.candidates.search(candidate, best_match=False)[0] if isinstance(candidate, str) else None
+        if found or not add:
+            return found or None
+        key = Name.add(candidate) if type(candidate) is str else candidate
+        self.candidates[key] = None
+        return key
+
+    def set(self, candidate, source, precinct, vote_type, count: int):
+        self.archive.queue(self.race, source, precinct, self._candidate(candidate, add=True), vote_type, count)
+        return count
+
+    def set_records(self, source, records: Records) -> int:
+        archive = self.archive
+        s = archive._source(source)
+        candidate = np.array([archive._id('labels', self._candidate(c, add=True)) for c in records.candidates])
+        location = np.array([archive._id('locations', p) for p in records.precincts])
+        vote_type = np.array([archive._id('labels', v) for v in records.vote_types])
+        if len(records.count):
+            archive.queue_many([(self.race, s, *row) for row in zip(
+                location[records.precinct].tolist(), candidate[records.candidate].tolist(),
+                vote_type[records.vote_type].tolist(), records.count.tolist())])
+        return len(records.count)
+
+    def remove_source(self, source) -> int:
+        s = self.archive._id('sources', source, add=False)
+        if s is None:
+            return 0
+        self.archive.flush()
+        with self.archive.db:
+            return self.archive.db.execute('DELETE FROM votes WHERE race = ? AND source = ?', (self.race, s)).rowcount
+
+    def _where(self, candidate=None, source=None, precinct=None, vote_type=None) -> tuple or None:
+        """ :returns (sql, args) selecting the votes, None: nothing matches """
+        archive = self.archive
+        sql, args = ['race = ?'], [self.race]
+        for column, table, key in (('candidate', 'labels', self._candidate(candidate)),
+                                   ('source', 'sources', source), ('vote_type', 'labels', vote_type)):
+            if key is None:
+                if column == 'candidate' and candidate is not None:
+                    return None
+                continue
+            i = archive._id(table, key, add=False)
+            if i is None:
+                return None
+            sql.append(f'{column} = ?')
+            args.append(i)
+        if precinct is not None:
+            exact = archive._id('locations', precinct, add=False)
+            if isinstance(precinct, tuple):
+                if exact is None:
+                    return None
+                sql.append('location = ?')
+                args.append(exact)
+            else:
+                # the precinct, or else (in a source without it) the tuple of precincts it belongs to
+                sql.append('location IN (SELECT location FROM location_members WHERE precinct = ?) AND (location = ? '
+                           'OR NOT EXISTS (SELECT 1 FROM votes x WHERE x.race = votes.race AND x.source = votes.source '
+                           'AND x.location = ?))')
+                args.extend((_text(precinct), exact or -1, exact or -1))
+        return ' AND '.join(sql), args
+
+    def tally(self, source=None, candidate=None, precinct=None, vote_type=None) -> int:
+        where = self._where(candidate=candidate, source=source, precinct=precinct, vote_type=vote_type)
+        if where is None:
+            return 0
+        return self.archive.query(f'SELECT COALESCE(SUM(count), 0) FROM votes WHERE {where[0]}', where[1]).fetchone()[0]
+
+    def tally_by(self, by: str, source=None, candidate=None, precinct=None, vote_type=None) -> dict:
+        if by not in _DIMENSIONS:
+            raise ValueError(f"tally_by: {by} is not one of {tuple(_DIMENSIONS)}")
+        where = self._where(candidate=candidate, source=source, precinct=precinct, vote_type=vote_type)
+        if where is None:
+            return {}
+        column = _DIMENSIONS[by]
+        rows = self.archive.query(f'SELECT {column}, SUM(count) FROM votes WHERE {where[0]} GROUP BY {column}',
+                                  where[1]).fetchall()
+        table = {'candidate': 'labels', 'source': 'sources', 'precinct': 'locations', 'vote_type': 'labels'}[by]
+        return dict(zip(self.archive._keys(table, [r[0] for r in rows]), (r[1] for r in rows)))
+
+    def get(self, candidate, source, precinct) -> dict:
+        return self.tally_by('vote_type', source=source, candidate=candidate, precinct=precinct)
+
+    def get_precinct(self, source, precinct) -> dict:
+        where = self._where(source=source, precinct=precinct)
+        if where is None:
+            return {}
+        rows = self.archive.query(f'SELECT candidate, vote_type, SUM(count) FROM votes WHERE {where[0]} '
+                                  f'GROUP BY candidate, vote_type', where[1]).fetchall()
+        rv = {}
+        for candidate, vote_type, count in zip(self.archive._keys('labels', [r[0] for r in rows]),
+                                               self.archive._keys('labels', [r[1] for r in rows]),
+                                               (r[2] for r in rows)):
+            rv.setdefault(candidate, {})[vote_type] = count
+        return rv
+
+    def records(self, sources: Iterable) -> Records:
+        archive = self.archive
+        ids = [i for i in (archive._id('sources', s, add=False) for s in sources) if i is not None]
+        rows = archive.query(f'SELECT candidate, location, vote_type, SUM(count) FROM votes WHERE race = ? AND '
+                             f'source IN ({",".join("?" * len(ids))}) GROUP BY candidate, location, vote_type',
+                             [self.race, *ids]).fetchall() if ids else []
+        rows = np.array(rows, dtype=np.int64).reshape(-1, 4)
+        codes, keys = [], []
+        for column, table in zip(rows.T[:3], ('labels', 'locations', 'labels')):
+            unique, inverse = np.unique(column, return_inverse=True)
+            keys.append(archive._keys(table, unique.tolist()))
+            codes.append(inverse.reshape(-1))
+        return Records(*keys, *codes, rows[:, 3])
+
+    def keys(self, dimension: str) -> Iterable:
+        column = _DIMENSIONS[dimension]
+        table = {'candidate': 'labels', 'source': 'sources', 'precinct': 'locations', 'vote_type': 'labels'}[dimension]
+        ids = [r[0] for r in self.archive.query(f'SELECT DISTINCT {column} FROM votes WHERE race = ?', (self.race,))]
+        return self.archive._keys(table, ids)
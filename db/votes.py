@@ -0,0 +1,280 @@
+""" Columnar vote storage for race.Race:
+Rather than nesting {candidate: {source: {precinct: {vote_type: count}}}} dicts, each dimension is interned to an integer
+and counts live in one numpy array:  counts[row, candidate, vote_type]  where a row is a (source, precinct)
+ - a row costs 5 bytes per (candidate, vote_type): an int32 count and a bool 'present'
+ - tallies and group-bys are array reductions instead of recursive dict walks
+"""
+import numpy as np
+from typing import Hashable, Iterable, NamedTuple
+from db import Fields, Name
+
+_DIMENSIONS = ('candidate', 'source', 'precinct', 'vote_type')
+
+
+class Records(NamedTuple):
+    """ flat votes, summed over the requested sources:
+        count[i] votes for candidates[candidate[i]] in precincts[precinct[i]] of vote_types[vote_type[i]]
+    """
+    candidates: list
+    precincts: list
+    vote_types: list
+    candidate: np.ndarray
+    precinct: np.ndarray
+    vote_type: np.ndarray
+    count: np.ndarray
+
+    @classmethod
+    def from_tuples(cls, records: Iterable[tuple]) -> 'Records':
+        """ records: (candidate, precinct, vote_type, count), ... """
+        dims = Interned(), Interned(), Interned()
+        codes, counts = [], []
+        for *keys, count in records:
+            codes.append([d.get(k, add=True) for d, k in zip(dims, keys)])
+            counts.append(count)
+        codes = np.array(codes, dtype=np.int32).reshape(-1, 3)
+        return cls(*(d.keys for d in dims), *codes.T, np.array(counts, dtype=np.int64))
+
+
+class Interned:
+    """ {key: int} plus the reverse list, keys are exact (hash) matches """
+    __slots__ = ['index', 'keys']
+
+    def __init__(self):
+        self.index = {}
+        self.keys = []
+
+    def __len__(self):
+        return len(self.keys)
+
+    def get(self, key: Hashable, add: bool = False) -> int or None:
+        rv = self.index.get(key)
+        if rv is None and add:
+            rv = self.index[key] = len(self.keys)
+            self.keys.append(key)
+        return rv
+
+
+class VoteStore:
+    """ votes for one race:  store.set(candidate, source, precinct, vote_type, count), store.tally(...) ...
+        candidates are looked up like Fields keys (fuzzy), sources, precincts and vote_types must match exactly.
+        A precinct tuple (a tape covering several precincts) is one row, which a member precinct finds when it has no
+        row of its own (like race._precinct), a member precinct's own counts never go in the tuple's row.
+    """
+    dtype = np.int32
+
+    def __init__(self, candidates: Fields = None):
+        self.candidates = Fields() if candidates is None else candidates
+        self._candidates = Interned()
+        self._sources = Interned()
+        self._precincts = Interned()
+        self._vote_types = Interned()
+        self._rows = {}                                 # {(source index, precinct index): its own row}
+        self._members = {}                              # {(source index, member precinct index): row of its tuple}
+        self._row_source = np.zeros(0, dtype=np.int32)      # the source index of each row
+        self._row_precinct = np.zeros(0, dtype=np.int32)    # the precinct index of each row (tuple, not members)
+        self._n_rows = 0
+        self._counts = np.zeros((0, 0, 0), dtype=self.dtype)
+        self._present = np.zeros((0, 0, 0), dtype=bool)
+
+    def __len__(self):
+        """ number of counts stored """
+        return int(self._present.sum())
+
+    @property
+    def nbytes(self) -> int:
+        return self._counts.nbytes + self._present.nbytes + self._row_source.nbytes + self._row_precinct.nbytes
+
+    def _candidate(self, candidate, add: bool = False) -> int or None:
+        """ find the candidate like Fields.__getitem__ (exact, then first match), add it to candidates if needed """
+        rv = self._candidates.get(candidate)
+        if rv is not None:
+            return rv
+        found = self.candidates.search(candidate, best_match=False)[0] if isinstance(candidate, str) else None
+        if found:
+            rv = self._candidates.get(found)
+            if rv is not None or not add:
+                return rv
+            key = found
+        elif not add:
+            return None
+        else:
+            key = Name.add(candidate) if type(candidate) is str else candidate
+            self.candidates[key] = None
+        return self._candidates.get(key, add=True)
+
+    def _row(self, source: int, precinct: Hashable) -> int:
+        """ precinct's own row, added if it's missing """
+        p = self._precincts.get(precinct, add=True)
+        row = self._rows.get((source, p))
+        if row is not None:
+            return row
+        row = self._rows[(source, p)] = self._n_rows
+        self._n_rows += 1
+        self._grow(rows=self._n_rows)
+        self._row_source[row], self._row_precinct[row] = source, p
+        if isinstance(precinct, tuple):
+            for member in precinct:
+                self._members.setdefault((source, self._precincts.get(member, add=True)), row)
+        return row
+
+    def _rows_of(self, source: int, precinct: Hashable) -> list:
+        """ [(row, candidates to count or None: all)] of precinct: its own row, and that of the tuple it belongs to for
+            the candidates without counts of their own (like race._precinct, candidate by candidate)
+        """
+        p = self._precincts.get(precinct)
+        own = None if p is None else self._rows.get((source, p))
+        tape = None if p is None or isinstance(precinct, tuple) else self._members.get((source, p))
+        if tape is None or own is None:
+            return [(row, None) for row in (own, tape) if row is not None]
+        return [(own, None), (tape, ~self._present[own].any(axis=1))]
+
+    def _grow(self, rows: int = 0, candidates: int = 0, vote_types: int = 0):
+        """ make room, doubling any dimension that's too small """
+        shape = self._counts.shape
+        if rows <= shape[0] and candidates <= shape[1] and vote_types <= shape[2]:
+            return
+        new_shape = tuple(max(need, 2 * have, 4) if need > have else have
+                          for have, need in zip(shape, (rows, candidates, vote_types)))
+        counts, present = np.zeros(new_shape, dtype=self.dtype), np.zeros(new_shape, dtype=bool)
+        counts[:shape[0], :shape[1], :shape[2]] = self._counts
+        present[:shape[0], :shape[1], :shape[2]] = self._present
+        self._counts, self._present = counts, present
+        if new_shape[0] > shape[0]:
+            self._row_source = np.resize(self._row_source, new_shape[0])
+            self._row_precinct = np.resize(self._row_precinct, new_shape[0])
+
+    def set(self, candidate, source, precinct, vote_type, count: int):
+        """ the columnar equivalent of deep_set(candidates, (candidate, source, precinct, vote_type), count) """
+        c = self._candidate(candidate, add=True)
+        row = self._row(self._sources.get(source, add=True), precinct)
+        v = self._vote_types.get(vote_type, add=True)
+        self._grow(candidates=len(self._candidates), vote_types=len(self._vote_types))
+        self._counts[row, c, v] = count
+        self._present[row, c, v] = True
+        return count
+
+    def set_records(self, source, records: Records) -> int:
+        """ set() every count of records, all from source, with array assignments :returns the number of counts """
+        s = self._sources.get(source, add=True)
+        candidate = np.array([self._candidate(c, add=True) for c in records.candidates], dtype=np.int64)
+        row = np.array([self._row(s, p) for p in records.precincts], dtype=np.int64)
+        vote_type = np.array([self._vote_types.get(v, add=True) for v in records.vote_types], dtype=np.int64)
+        self._grow(candidates=len(self._candidates), vote_types=len(self._vote_types))
+        if len(records.count):
+            index = row[records.precinct], candidate[records.candidate], vote_type[records.vote_type]
+            self._counts[index] = records.count
+            self._present[index] = True
+        return len(records.count)
+
+    def remove_source(self, source) -> int:
+        """ forget every count from source (rows are kept for when it's loaded again) :returns counts removed """
+        s = self._sources.get(source)
+        if s is None:
+            return 0
+        rows = np.flatnonzero(self._row_source[:self._n_rows] == s)
+        removed = int(self._present[rows].sum())
+        self._counts[rows] = 0
+        self._present[rows] = False
+        return removed
+
+    def records(self, sources: Iterable) -> Records:
+        """ every count stored from sources (a precinct tuple is reported once, not once per member) """
+        s = [i for i in (self._sources.get(source) for source in sources) if i is not None]
+        rows = np.flatnonzero(np.isin(self._row_source[:self._n_rows], s))
+        r, c, v = np.nonzero(self._present[rows])
+        return Records(self._candidates.keys, self._precincts.keys, self._vote_types.keys, c,
+                       self._row_precinct[rows][r], v, self._counts[rows][r, c, v].astype(np.int64))
+
+    def _select(self, candidate=None, source=None, precinct=None, vote_type=None) -> tuple or None:
+        """ :returns (rows, candidates, vote_types, keep) indexes for numpy, None: nothing matches
+            keep: None, or which candidates count in each row (a precinct's tape counts those the precinct hasn't)
+        """
+        n, keep = self._n_rows, None
+        if precinct is not None:
+            s = range(len(self._sources)) if source is None else [self._sources.get(source)]
+            found = [rk for i in s if i is not None for rk in self._rows_of(i, precinct)]
+            if not found:
+                return None
+            rows = [row for row, _ in found]
+            if any(k is not None for _, k in found):
+                every = np.ones(self._counts.shape[1], dtype=bool)
+                keep = np.array([every if k is None else k for _, k in found])
+        elif source is not None:
+            s = self._sources.get(source)
+            if s is None:
+                return None
+            rows = np.flatnonzero(self._row_source[:n] == s)
+        else:
+            rows = slice(0, n)
+        c = slice(0, len(self._candidates)) if candidate is None else self._candidate(candidate)
+        v = slice(0, len(self._vote_types)) if vote_type is None else self._vote_types.get(vote_type)
+        if c is None or v is None:
+            return None
+        return rows, c, v, keep
+
+    def _block(self, sel: tuple or None) -> np.ndarray:
+        """ the _select()ed counts as a (rows, candidates, vote_types) array """
+        if sel is None:
+            return np.zeros((0, 0, 0), dtype=self.dtype)
+        rows, c, v, keep = sel
+        block = self._counts[rows] if keep is None else self._counts[rows] * keep[:, :, None]
+        block = block[:, c:c + 1] if type(c) is int else block[:, c]
+        return block[:, :, v:v + 1] if type(v) is int else block[:, :, v]
+
+    def tally(self, source=None, candidate=None, precinct=None, vote_type=None) -> int:
+        """ sum of the counts matching every given (not None) dimension """
+        return int(self._block(self._select(candidate=candidate, source=source, precinct=precinct,
+                                            vote_type=vote_type)).sum())
+
+    def tally_by(self, by: str, source=None, candidate=None, precinct=None, vote_type=None) -> dict:
+        """ :returns {key: sum} for each key of dimension 'by' (candidate, source, precinct or vote_type)
+            e.g. tally_by('candidate', source=xml) -> {candidate: votes, ...}
+        """
+        if by not in _DIMENSIONS:
+            raise ValueError(f"tally_by: {by} is not one of {_DIMENSIONS}")
+        sel = self._select(candidate=candidate, source=source, precinct=precinct, vote_type=vote_type)
+        if sel is None:
+            return {}
+        rows, c, v, keep = sel
+        block = self._block(sel)
+        if by == 'candidate':
+            keys = self._candidates.keys if candidate is None else [self._candidates.keys[c]]
+            return dict(zip(keys, block.sum(axis=(0, 2)).tolist()))
+        if by == 'vote_type':
+            keys = self._vote_types.keys if vote_type is None else [self._vote_types.keys[v]]
+            return dict(zip(keys, block.sum(axis=(0, 1)).tolist()))
+        row_ids = np.arange(self._n_rows)[rows]
+        row_sums = block.sum(axis=(1, 2))
+        if by == 'source':
+            group, interned = self._row_source[row_ids], self._sources
+        else:
+            group, interned = self._row_precinct[row_ids], self._precincts
+        sums = np.bincount(group, weights=row_sums, minlength=len(interned)).astype(np.int64)
+        present = self._present[row_ids] if keep is None else self._present[row_ids] & keep[:, :, None]
+        present = np.bincount(group, weights=present.any(axis=(1, 2)), minlength=len(interned)) > 0
+        return {interned.keys[i]: int(sums[i]) for i in np.flatnonzero(present)}
+
+    def get(self, candidate, source, precinct) -> dict:
+        """ :returns {vote_type: count} of one candidate in one precinct """
+        c = self._candidate(candidate)
+        s = self._sources.get(source)
+        rows = [] if s is None or c is None else [r for r, _ in self._rows_of(s, precinct) if self._present[r, c].any()]
+        if not rows:
+            return {}
+        row = rows[0]
+        return {self._vote_types.keys[v]: int(self._counts[row, c, v]) for v in np.flatnonzero(self._present[row, c])}
+
+    def get_precinct(self, source, precinct) -> dict:
+        """ :returns {candidate: {vote_type: count}} of one precinct """
+        s = self._sources.get(source)
+        rv = {}
+        for row, keep in [] if s is None else self._rows_of(s, precinct):
+            present = self._present[row] if keep is None else self._present[row] & keep[:, None]
+            for c, v in zip(*np.nonzero(present)):
+                rv.setdefault(self._candidates.keys[c], {})[self._vote_types.keys[v]] = int(self._counts[row, c, v])
+        return rv
+
+    def keys(self, dimension: str) -> Iterable:
+        """ the interned keys of a dimension (candidate, source, precinct or vote_type) """
+        return {'candidate': self._candidates, 'source': self._sources,
+                'precinct': self._precincts, 'vote_type': self._vote_types}[dimension].keys
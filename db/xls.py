@@ -1,5 +1,6 @@
 # handle importing precinct data from the sos website
-import logging
+from io import BytesIO
+from itertools import zip_longest
 from pathlib import Path
 from util import LogSelf
 from db import Name
@@ -13,23 +14,39 @@ from openpyxl.utils.exceptions import InvalidFileException
 
 class Xlsx(LogSelf):
     """ Handle loading xls and generate objects
+    The active sheet is read once (read-only, values only) and kept as columns of plain values
     """
-    def __init__(self, filename: Path, read_only: bool = False):
+    def __init__(self, filename: Path, read_only: bool = True, data: bytes = None):
+        """ data: the file's bytes, if they were already read """
         self._filename = filename
         self._max_column = None
         self._row_names = []
-        self.wb: Workbook = load_workbook(filename=filename, read_only=read_only)
+        wb: Workbook = load_workbook(filename=filename if data is None else BytesIO(data), read_only=read_only)
+        try:
+            ws: Worksheet = wb.active
+            if read_only:
+                ws.reset_dimensions()   # don't trust the stored dimensions, rows are as long as they really are
+            self.columns = list(zip_longest(*ws.iter_rows(values_only=True)))
+        finally:
+            if read_only:
+                wb.close()
+
+    def cell(self, row: int, column: int):
+        """ value of a cell, 1 based like openpyxl """
+        try:
+            return self.columns[column - 1][row - 1]
+        except IndexError:
+            return None
 
     @property
     def max_column(self) -> int:
-        """ return the name of valid columns """
+        """ return the number of the last valid column (columns end at the 2nd blank header) """
         if self._max_column is not None:
             return self._max_column
-        ws = self.wb.active
-        stop = False
-        for n, c in enumerate(next(ws.iter_rows())):
-            if c and c.value:
-                self._max_column, stop = n, False
+        self._max_column, stop = 0, False
+        for n, column in enumerate(self.columns):
+            if column[0]:
+                self._max_column, stop = n + 1, False
                 continue
             elif stop:
                 break
@@ -39,15 +56,10 @@ class Xlsx(LogSelf):
     @property
     def row_names(self) -> list:
         """ return a list of values from the first column """
-        if self._row_names:
+        if self._row_names or not self.columns:
             return self._row_names
-        ws = self.wb.active
         stop = False
-        for n, v in enumerate(next(ws.iter_cols())):
-            if not v:
-                logging.error(f"cell is invalid! {n}:{v}")
-                continue
-            row, col, value = v.row, v.column, v.value
+        for value in self.columns[0]:
             self._row_names.append(value)
             if value:
                 stop = False
@@ -57,6 +69,21 @@ class Xlsx(LogSelf):
             stop = True
         return self._row_names
 
+    def column_kwargs(self) -> list:
+        """ :returns [{'_file': FILENAME, '_column': int(column), 'row:name': value, ...}, ...] one dict per column
+            plain data (no openpyxl objects) so it can be pickled, see load_columns()
+        """
+        row_names = [(n, f"{n}:{v}") for n, v in enumerate(self.row_names) if v]
+
+        def column(col: int) -> dict:
+            vals = {'_file': self._filename, '_column': col}
+            values = self.columns[col - 1]
+            for n, name in row_names:
+                vals[name] = values[n] if n < len(values) else None
+            return vals
+
+        return [column(col) for col in range(2, self.max_column + 1)]
+
     def load_columns(self, obj: callable, *args, **kwargs) -> list:
         """ Generate an object for each column where each row is a (potential) parameter:
         name    foo     bar
@@ -66,17 +93,4 @@ class Xlsx(LogSelf):
         obj(**{name: foo, color: red, flavor: cherry}, _file=FILENAME, _column=int(column)),
         obj(**{name: bar, color: black, flavor: raspberry}, _file=FILENAME, _column=int(column)),
         """
-
-        # load the 1st column using names (or Name)
-        ws: Worksheet = self.wb.active
-
-        def build_object(col: int, obj: callable):
-            vals = {'_file': self._filename, '_column': col}
-            for n, v in enumerate(self.row_names):
-                if not v:
-                    continue
-                vals[f"{n}:{v}"] = ws.cell(row=n+1, column=col).value
-            return obj(*args, **kwargs, **vals)
-
-        return [build_object(col, obj=obj) for col in range(2, self.max_column)]
-
+        return [obj(*args, **kwargs, **vals) for vals in self.column_kwargs()]
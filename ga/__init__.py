@@ -1,6 +1,12 @@
 # this module handles data from the Georgia Secretary of State website(s)
 # 1 - the official xml detailed election results
 # 2 ...
+import re
+from itertools import chain
+from mmap import mmap, ACCESS_READ
+from pathlib import Path
+from typing import BinaryIO, Iterator, NamedTuple
+from xml.etree.ElementTree import Element, fromstring, iterparse
 
 
 def property_dict(**kwargs):
@@ -14,4 +20,112 @@ def property_dict(**kwargs):
     for k, v in kwargs.items():
         if k.startswith('@'):
             rv[k[1:]] = v
-    return rv
\ No newline at end of file
+    return rv
+
+
+def _add_child(rv: dict, tag: str, value):
+    """ xmltodict style: a repeated tag becomes a list """
+    if tag not in rv:
+        rv[tag] = value
+    elif type(rv[tag]) is list:
+        rv[tag].append(value)
+    else:
+        rv[tag] = [rv[tag], value]
+
+
+def element_dict(element: Element) -> dict or str or None:
+    """ convert an ElementTree element to the same structure xmltodict.parse() builds:
+        <Precinct name="01A" votes="12"/> -> {"@name": "01A", "@votes": "12"}
+        <Region>Fulton</Region> -> "Fulton"
+    """
+    rv = {f"@{k}": v for k, v in element.attrib.items()}
+    for child in element:
+        _add_child(rv, child.tag, element_dict(child))
+    text = element.text.strip() if element.text else None
+    if not rv:
+        return text or None
+    if text:
+        rv['#text'] = text
+    return rv
+
+
+class RawElement(NamedTuple):
+    """ where an element is in its file, to be parsed by raw_dict() only if it's needed """
+    attrib: dict        # its attributes, without the '@'
+    filename: str
+    start: int          # byte offsets of <tag .. </tag>
+    end: int
+
+
+def raw_bytes(raw: RawElement) -> bytes:
+    """ the xml text of a RawElement """
+    with open(raw.filename, 'rb') as f:
+        f.seek(raw.start)
+        return f.read(raw.end - raw.start)
+
+
+def raw_dict(raw: RawElement or dict) -> dict:
+    """ the element_dict of a RawElement (a dict is returned as is) """
+    if type(raw) is not RawElement:
+        return raw
+    return element_dict(fromstring(raw_bytes(raw)))
+
+
+def scan_xml(filename: Path or str, tag: str) -> Iterator[RawElement]:
+    """ find the tag elements of a file without parsing them: a byte scan of the memory mapped file,
+        only each start tag is parsed (for its attributes).  tag elements must not nest, or be in comments / CDATA
+    """
+    start_re = re.compile(rb'<' + tag.encode() + rb'(?=[\s/>])(?:[^>"\']|"[^"]*"|\'[^\']*\')*>')
+    close = b'</' + tag.encode() + b'>'
+    with open(filename, 'rb') as f, mmap(f.fileno(), 0, access=ACCESS_READ) as data:
+        m = start_re.search(data)
+        while m:
+            head = m.group()
+            if head.endswith(b'/>'):
+                end = m.end()
+            else:
+                end = data.find(close, m.end())
+                if end < 0:
+                    raise ValueError(f"{filename}: <{tag}> at byte {m.start()} isn't closed")
+                end += len(close)
+                head = head[:-1] + b'/>'
+            yield RawElement(dict(fromstring(head).attrib), str(filename), m.start(), end)
+            m = start_re.search(data, end)
+
+
+def iter_xml(filename: Path or str or BinaryIO, stop_tag: str = None) -> Iterator[tuple]:
+    """ incrementally parse xml, yielding (tag, element_dict) for each child of the root as soon as it closes.
+        Each child is dropped from the tree once yielded, so memory is bound by the largest child, not the file.
+        filename: or a binary file object (ex: BytesIO of bytes already read)
+        stop_tag: stop when a child with this tag starts
+    """
+    root, depth = None, 0
+    source = filename if hasattr(filename, 'read') else str(filename)
+    for event, element in iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            root = element if root is None else root
+            depth += 1
+            if depth == 2 and element.tag == stop_tag:
+                return
+            continue
+        depth -= 1
+        if depth == 1:
+            yield element.tag, element_dict(element)
+            root.remove(element)
+
+
+def stream_xml(filename: Path or str, stream_tag: str, raw: bool = False) -> dict:
+    """ like xmltodict.parse(f)[root] but the stream_tag children are a generator which parses as it is consumed:
+        { child_tag: element_dict, ..., stream_tag: Iterator[element_dict] }
+        children of any other tag that follow the first stream_tag are skipped
+        raw: the stream_tag children are RawElements (see scan_xml), parsed by raw_dict() when they're needed
+    """
+    children = iter_xml(filename, stop_tag=stream_tag if raw else None)
+    rv = {}
+    for tag, value in children:
+        if tag == stream_tag:
+            rv[tag] = chain([value], (v for t, v in children if t == stream_tag))
+            return rv
+        _add_child(rv, tag, value)
+    rv[stream_tag] = scan_xml(filename, stream_tag) if raw else iter(())
+    return rv
@@ -0,0 +1,369 @@
+""" Columnar election files:
+An SOS detail xml is converted once into a binary file of flat arrays, which is memory-mapped when it is opened:
+ - string tables (contests, candidates, precincts, vote types): utf-8 text and offsets
+ - precinct turnout columns, and contest columns with the offsets of each contest's choices, totals and votes
+ - votes: fixed width int32 columns (candidate, precinct, vote type, count) ordered by contest
+Opening one reads the header and the turnout only, so it takes milliseconds however big the election is, and the
+pages are shared by every process that maps the same file (statewide workers).  ColumnarResult is an ElectionResult:
+contests are built when they are asked for, their votes go into the Race (a VoteStore) with array assignments straight
+from the mapping.  Precinct.contests isn't filled, the votes are in the races.
+Report uses FILE.gacol instead of FILE.xml when it was converted from the xml as it is now: the header has the xml's
+size, mtime and digest, checked like a FileCache entry.
+
+ex: python -m ga.columnar 2020/fulton/detail.xml          (writes 2020/fulton/detail.gacol)
+"""
+import json
+import mmap
+import struct
+from hashlib import blake2b
+import numpy as np
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import Iterable
+from db import Fields, Name
+from db.file_cache import file_digest
+from db.votes import Records
+from race import Race, races
+from registry import Registry
+from .contest import Contest, ElectionResult
+
+MAGIC = b'GACOL\x00\x00\x00'
+VERSION = 2
+SUFFIX = '.gacol'
+_ALIGN = 64
+_HEADER = struct.Struct('<8sQ')     # magic, header length
+_CONTEST_ROWS = {'contest_choices': ('choice_candidate', 'choice_total'),       # {offsets: the columns they span}
+                 'contest_totals': ('total_candidate', 'total_vote_type', 'total_votes'),
+                 'contest_votes': ('vote_candidate', 'vote_precinct', 'vote_type', 'vote_count')}
+
+
+class Strings:
+    """ a string table: text (utf-8 bytes) and offsets (n + 1), decoded when an item is read """
+    __slots__ = ['_text', '_offsets', '_names']
+
+    def __init__(self, text: np.ndarray, offsets: np.ndarray):
+        self._text = text
+        self._offsets = offsets
+        self._names = {}
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        return self._text[self._offsets[i]:self._offsets[i + 1]].tobytes().decode('utf-8')
+
+    def name(self, i: int) -> Name:
+        """ the Name of item i (made once) """
+        rv = self._names.get(i)
+        if rv is None:
+            rv = self._names[i] = Name(self[i])
+        return rv
+
+    @staticmethod
+    def columns(strings: Iterable[str]) -> tuple:
+        """ :returns (text, offsets) arrays of strings """
+        encoded = [s.encode('utf-8') for s in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(e) for e in encoded])
+        return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+class _Interned(dict):
+    """ {str: index} in order of first use """
+    def __call__(self, key) -> int:
+        if key is None:
+            return -1
+        return self.setdefault(str(key), len(self))
+
+
+def columns(er: ElectionResult) -> tuple:
+    """ :returns (header, {name: array}) of an ElectionResult, its contests are all built """
+    tables = {name: _Interned() for name in ('contests', 'candidates', 'precincts', 'vote_types')}
+    contest, candidate, precinct, vote_type = tables.values()
+    turnout = [p for p in er._precincts.values() if hasattr(p, 'ballotsCast')]
+    arrays = {'turnout_precinct': np.array([precinct(p.name) for p in turnout], dtype=np.int32),
+              'turnout_total_voters': np.array([p.totalVoters for p in turnout], dtype=np.int64),
+              'turnout_ballots_cast': np.array([p.ballotsCast for p in turnout], dtype=np.int64),
+              'turnout_voter_turnout': np.array([p.voterTurnout for p in turnout], dtype=np.float64),
+              'turnout_percent_reporting': np.array([p.percentReporting for p in turnout], dtype=np.float64)}
+    rows = {k: [] for k in ('contest', 'contest_key', 'contest_reported', 'choice_candidate', 'choice_total',
+                            'total_candidate', 'total_vote_type', 'total_votes', 'vote_candidate', 'vote_precinct',
+                            'vote_type', 'vote_count')}
+    offsets = {'contest_choices': [0], 'contest_totals': [0], 'contest_votes': [0]}
+    for c in er.contests():
+        rows['contest'].append(contest(c.name))
+        rows['contest_key'].append(c._key)
+        rows['contest_reported'].append(int(c.precinctsReported))
+        for name, total in c.totals.items():
+            rows['choice_candidate'].append(candidate(name))
+            rows['choice_total'].append(total)
+        for (name, vt), votes in c.vote_totals.items():
+            rows['total_candidate'].append(candidate(name))
+            rows['total_vote_type'].append(vote_type(vt))
+            rows['total_votes'].append(votes)
+        records = races[c.name].records({er.source})
+        for key, codes, keys, interned in (('vote_candidate', records.candidate, records.candidates, candidate),
+                                           ('vote_precinct', records.precinct, records.precincts, precinct),
+                                           ('vote_type', records.vote_type, records.vote_types, vote_type)):
+            rows[key].append(np.array([interned(k) for k in keys], dtype=np.int32)[codes] if len(codes) else [])
+        rows['vote_count'].append(records.count)
+        offsets['contest_choices'].append(len(rows['choice_candidate']))
+        offsets['contest_totals'].append(len(rows['total_candidate']))
+        offsets['contest_votes'].append(offsets['contest_votes'][-1] + len(records.count))
+    for key in ('vote_candidate', 'vote_precinct', 'vote_type', 'vote_count'):
+        rows[key] = np.concatenate(rows[key]) if rows[key] else []
+    arrays.update((k, np.array(v, dtype=np.int64 if k in ('choice_total', 'total_votes') else np.int32))
+                  for k, v in rows.items())
+    arrays.update((k, np.array(v, dtype=np.int64)) for k, v in offsets.items())
+    for name, table in tables.items():
+        arrays[f'{name}_text'], arrays[f'{name}_offsets'] = Strings.columns(table)
+    header = {'version': VERSION, 'Timestamp': er.Timestamp.isoformat(), 'ElectionName': str(er.ElectionName),
+              'ElectionDate': er.ElectionDate.isoformat(), 'Region': er.Region, 'xml': str(er.source)}
+    return header, arrays
+
+
+def write(filename: Path, header: dict, arrays: dict) -> Path:
+    """ write header and arrays (each aligned to _ALIGN bytes) into filename """
+    layout, offset = {}, 0
+    for name, a in arrays.items():
+        a = np.ascontiguousarray(a)
+        layout[name] = {'offset': offset, 'dtype': a.dtype.str, 'shape': a.shape}
+        offset += -(-a.nbytes // _ALIGN) * _ALIGN
+    head = json.dumps(dict(header, arrays=layout)).encode('utf-8')
+    start = -(-(_HEADER.size + len(head)) // _ALIGN) * _ALIGN
+    filename = Path(filename)
+    with open(filename, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, len(head)) + head)
+        for name, a in arrays.items():
+            f.seek(start + layout[name]['offset'])
+            f.write(np.ascontiguousarray(a).tobytes())
+        f.truncate(start + offset)
+    return filename
+
+
+def convert(xml_file: Path, output: Path = None) -> Path:
+    """ convert an SOS detail xml into a columnar file (default: the xml's name with SUFFIX) :returns its path """
+    xml_file = Path(xml_file).expanduser()
+    registry = Registry(f'convert {xml_file}')
+    try:
+        xml = _xml_stat(xml_file)       # before reading it, a later change of the xml makes the columnar file stale
+        with registry:
+            er = ElectionResult.load_from_xml(xml_file, lazy=False)
+            header, arrays = columns(er)
+            return write(xml_file.with_suffix(SUFFIX) if output is None else output, dict(header, **xml), arrays)
+    finally:
+        registry.clear()
+
+
+class ElectionColumns:
+    """ a memory-mapped columnar file:  columns['vote_count'] is a read only view of the mapping """
+    def __init__(self, filename: Path):
+        self.filename = Path(filename).expanduser()
+        with open(self.filename, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, size = _HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            raise ValueError(f"{self.filename} isn't a columnar election file")
+        self.header = json.loads(self._map[_HEADER.size:_HEADER.size + size].decode('utf-8'))
+        if self.header['version'] != VERSION:
+            raise ValueError(f"{self.filename} is version {self.header['version']}, not {VERSION}")
+        self._start = -(-(_HEADER.size + size) // _ALIGN) * _ALIGN
+        self._arrays = {}
+        self.contests, self.candidates, self.precincts, self.vote_types = \
+            (Strings(self[f'{name}_text'], self[f'{name}_offsets'])
+             for name in ('contests', 'candidates', 'precincts', 'vote_types'))
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        rv = self._arrays.get(name)
+        if rv is None:
+            layout = self.header['arrays'][name]
+            dtype, shape = np.dtype(layout['dtype']), tuple(layout['shape'])
+            count = int(np.prod(shape))
+            rv = self._arrays[name] = np.frombuffer(self._map, dtype=dtype, count=count,
+                                                    offset=self._start + layout['offset']).reshape(shape) \
+                if count else np.zeros(shape, dtype=dtype)
+        return rv
+
+    def __len__(self):
+        """ number of contests """
+        return len(self['contest'])
+
+    def span(self, offsets: str, i: int) -> slice:
+        """ the rows of contest i, offsets: contest_choices, contest_totals or contest_votes """
+        o = self[offsets]
+        return slice(int(o[i]), int(o[i + 1]))
+
+    def records(self, i: int, candidate: callable, vote_type: callable) -> Records:
+        """ the votes of contest i, candidate(text) / vote_type(text) resolve the keys """
+        rows = self.span('contest_votes', i)
+        rv = []
+        for codes, resolve in ((self['vote_candidate'][rows], lambda c: None if c < 0 else candidate(c)),
+                               (self['vote_precinct'][rows], self.precincts.name),
+                               (self['vote_type'][rows], vote_type)):
+            keys, inverse = np.unique(codes, return_inverse=True)
+            rv.append(([resolve(int(k)) for k in keys], inverse.reshape(-1)))
+        (candidates, c), (precincts, p), (vote_types, v) = rv
+        return Records(candidates, precincts, vote_types, c, p, v, self['vote_count'][rows].astype(np.int64))
+
+    def close(self):
+        """ unmap the file, unless arrays taken from it are still in use (then it's unmapped once they're gone) """
+        self._arrays.clear()
+        self.contests = self.candidates = self.precincts = self.vote_types = None
+        try:
+            self._map.close()
+        except BufferError:
+            pass
+
+
+class MappedContest(Contest):
+    """ a Contest of a columnar file, its votes are set in its Race all at once """
+    def __init__(self, election_result: 'ColumnarResult', i: int):
+        columns = election_result.columns
+        name = columns.contests[int(columns['contest'][i])]
+        self._election_result = election_result
+        self._key = int(columns['contest_key'][i])
+        self.precinctsReported = int(columns['contest_reported'][i])
+        self.vote_totals = {}
+        self.totals = Fields()
+        self.candidates = Fields()
+        self.precincts = Fields()
+        if name in Contest._all:
+            self.error(f"Collision [{name}]", category='collision')
+        self.name = self._all.add(name, value=self)
+        source = election_result.source
+        race = Race.add(district=self.region, seat=self.name, sources={source}, columnar=True)
+
+        def candidate(c: int) -> Name:
+            return self.candidates.add(columns.candidates[c])
+
+        def vote_type(v: int) -> Name:
+            return self._vote_types.add(columns.vote_types[v])
+
+        choices = columns.span('contest_choices', i)
+        for c, total in zip(columns['choice_candidate'][choices].tolist(), columns['choice_total'][choices].tolist()):
+            self.totals[candidate(c)] = total
+        totals = columns.span('contest_totals', i)
+        for c, v, votes in zip(columns['total_candidate'][totals].tolist(), columns['total_vote_type'][totals].tolist(),
+                               columns['total_votes'][totals].tolist()):
+            self.vote_totals[(None if c < 0 else candidate(c), vote_type(v))] = votes
+        records = columns.records(i, candidate, vote_type)
+        race.set_records(source, records)
+        self.precincts.update(dict.fromkeys(records.precincts))
+
+
+class ColumnarResult(ElectionResult):
+    """ ColumnarResult.load('detail.gacol'): an ElectionResult whose contests are built from the mapped columns """
+    def __init__(self, columns: ElectionColumns, source=None):
+        self.columns = columns
+        header = columns.header
+        turnout = {k: columns[f'turnout_{k}'].tolist()
+                   for k in ('precinct', 'total_voters', 'ballots_cast', 'voter_turnout', 'percent_reporting')}
+        precincts = [{'@name': columns.precincts[p], '@totalVoters': voters, '@ballotsCast': cast,
+                      '@voterTurnout': voter_turnout, '@percentReporting': reporting}
+                     for p, voters, cast, voter_turnout, reporting in zip(*turnout.values())]
+        self._tables = None     # digest of the string tables, see contest_digest()
+        super().__init__({'Timestamp': header['Timestamp'], 'ElectionName': header['ElectionName'],
+                          'ElectionDate': header['ElectionDate'], 'Region': header['Region'],
+                          'VoterTurnout': {'Precincts': precincts}, 'Contest': []},
+                         source=columns.filename if source is None else source, lazy=True)
+        for i, contest in enumerate(columns['contest'].tolist()):
+            self._pending[Name(columns.contests[contest])] = i
+
+    def _build_contest(self, i: int) -> Contest:
+        c = MappedContest(election_result=self, i=i)
+        self._contests[c.name] = c
+        return c
+
+    def contest_digest(self, name: Name) -> str:
+        """ a pending contest's is of its rows, and of the string tables they index """
+        i = dict.get(self._pending, name)
+        if i is None or name in self._digests:
+            return super().contest_digest(name)
+        columns = self.columns
+        if self._tables is None:
+            h = blake2b(digest_size=16)
+            for table in ('candidates', 'precincts', 'vote_types'):
+                for suffix in ('text', 'offsets'):
+                    h.update(columns[f'{table}_{suffix}'].tobytes())
+            self._tables = h.digest()
+        h = blake2b(self._tables, digest_size=16)
+        for offsets, keys in _CONTEST_ROWS.items():
+            rows = columns.span(offsets, i)
+            for key in keys:
+                h.update(columns[key][rows].tobytes())
+        rv = self._digests[name] = h.hexdigest()
+        return rv
+
+    def contest_counts(self, name: Name) -> dict:
+        i = dict.get(self._pending, name)
+        if i is None:
+            return super().contest_counts(name)
+        columns = self.columns
+        rows = columns.span('contest_votes', i)
+        return {(str(columns.precincts.name(p)), None if c < 0 else str(columns.candidates.name(c)),
+                 str(columns.vote_types.name(v))): n
+                for c, p, v, n in zip(columns['vote_candidate'][rows].tolist(), columns['vote_precinct'][rows].tolist(),
+                                      columns['vote_type'][rows].tolist(), columns['vote_count'][rows].tolist())}
+
+    @classmethod
+    def load(cls, filename: Path, source=None) -> 'ColumnarResult':
+        """ source: of the votes in the races (default: filename), e.g. the xml it was converted from """
+        return cls(ElectionColumns(filename), source=source)
+
+
+def read_header(filename: Path) -> dict:
+    """ the header of a columnar file, without mapping it """
+    with open(filename, 'rb') as f:
+        magic, size = _HEADER.unpack(f.read(_HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"{filename} isn't a columnar election file")
+        return json.loads(f.read(size).decode('utf-8'))
+
+
+def _xml_stat(xml_file: Path) -> dict:
+    stat = xml_file.stat()
+    return {'xml_size': stat.st_size, 'xml_mtime_ns': stat.st_mtime_ns, 'xml_digest': file_digest(xml_file)}
+
+
+def newer(xml_file: Path) -> Path or None:
+    """ :returns the columnar file of xml_file if there is one converted from it as it is now:
+        the same size, and the same mtime or else the same digest (like FileCache)
+    """
+    xml_file = Path(xml_file)
+    columnar = xml_file.with_suffix(SUFFIX)
+    try:
+        header = read_header(columnar)
+        stat = xml_file.stat()
+    except (OSError, ValueError, struct.error):     # missing, or not a columnar file: the xml is read
+        return None
+    if header.get('version') != VERSION or header.get('xml_size') != stat.st_size:
+        return None
+    if header.get('xml_mtime_ns') == stat.st_mtime_ns or header.get('xml_digest') == file_digest(xml_file):
+        return columnar
+    return None
+
+
+def get_args():
+    ap = ArgumentParser(prog='ga.columnar', description='converts SOS detail xml files into columnar files')
+    ap.add_argument('xml', nargs='+', help='SOS detail xml file(s), or directories of them')
+    ap.add_argument('--output', '-o', type=str, default=None,
+                    help=f'output file (one xml only), default: the xml file with the suffix {SUFFIX}')
+    return ap.parse_args()
+
+
+def main():
+    args = get_args()
+    files = [f for arg in args.xml for f in (sorted(Path(arg).expanduser().glob('*.xml'))
+                                             if Path(arg).expanduser().is_dir() else [Path(arg).expanduser()])]
+    if args.output and len(files) != 1:
+        raise ValueError('--output needs exactly one xml file')
+    for xml_file in files:
+        rv = convert(xml_file, output=args.output and Path(args.output).expanduser())
+        columns = ElectionColumns(rv)
+        print(f"{xml_file} -> {rv}: {len(columns)} contests, {len(columns['vote_count']):,} votes, "
+              f"{rv.stat().st_size / 2 ** 20:.1f}MB")
+        columns.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,18 @@
 # define a race - a single seat in an election
-from typing import List
+from typing import Iterable, List
+from functools import partial
+from hashlib import blake2b
+from io import BytesIO
 from pathlib import Path
 from dateutil.parser import parse as parse_date
 from datetime import datetime
 from db import Name, Fields
-from . import property_dict
+from db.candidates import CandidateIndex
+from . import RawElement, property_dict, raw_bytes, raw_dict, stream_xml
 from pprint import pformat
 from util import LogSelf, first, dict_sum, dict_diff, longest
-from race import Race
+from race import Race, races
+from registry import Registry, Scoped
 
 """
 ElectionResult:
@@ -26,12 +31,14 @@ ElectionResult:
              ...
           ... ['Election Day Votes', 'Advanced Voting Votes', 'Absentee by Mail Votes', 'Provisional Votes']
 """
+CACHE_KIND = 'ElectionResult'      # what the streamed xml is cached as (see FileCache.stream_dict)
 
 
 class Contest(LogSelf):
     """ a contest within a county.  Note: statewide results include counties but not county results
     """
-    _all = Fields(key='Contest')     # all Contests by name
+    _all = Scoped('Contest', lambda: Fields(key='Contest'))     # all Contests of the current Registry, by name
+    _candidate_index = Scoped('Contest candidates', lambda: CandidateIndex(Contest._all(), lambda c: c.candidates))
     _vote_types = Fields(key='vote_types', fields={
         Name('day_of', r'(election.)?day.*'),
         Name('advanced', r'advanced.voting.*'),
@@ -54,12 +61,13 @@ class Contest(LogSelf):
         if name in Contest._all:
             self.error(f"Collision [{name}]", category='collision')
         self.name = self._all.add(name, value=self)
+        Race.add(district=self.region, seat=self.name, sources={self._election_result.source})
         kwargs = {k.lower(): v for k, v in kwargs.items()}
 
         def do_votetype(vote_type: str, candidate: Name or None, votes, precincts: List[dict]):
             if type(precincts) is dict:
                 precincts = [precincts]
-            vote_type = self._vote_types[vote_type]
+            vote_type = self._vote_types.add(vote_type)
             self.vote_totals[(candidate, vote_type)] = int(votes)
             # TODO - ER precincts should use race.Race? or just get rid of ER Precincts?
             for precinct in precincts:
@@ -73,7 +81,8 @@ class Contest(LogSelf):
                 #self.precincts[name] = p
 
         if 'votetype' in kwargs:
-            for vt in kwargs['votetype']:
+            vote_types = kwargs['votetype']
+            for vt in [vote_types] if type(vote_types) is dict else vote_types:
                 do_votetype(vote_type=vt['@name'], candidate=None, votes=vt['@votes'], precincts=vt['Precinct'])
         if 'choices' in kwargs:
             choices = kwargs['choices']
@@ -83,7 +92,8 @@ class Contest(LogSelf):
                 name = self.candidates.add(choice['@text'])
                 # party = Name.add(choice['@party'])
                 self.totals[name] = int(choice['@totalVotes'])
-                for vt in choice['VoteType']:
+                vote_types = choice['VoteType']
+                for vt in [vote_types] if type(vote_types) is dict else vote_types:
                     do_votetype(vote_type=vt['@name'], candidate=name, votes=vt['@votes'], precincts=vt['Precinct'])
 
     @property
@@ -109,7 +119,8 @@ class Contest(LogSelf):
     @classmethod
     def candidate(cls, name: str, contest: str = None) -> (str, dict):
         if contest is None:
-            contests = cls._all.values()
+            contests = cls._candidate_index.owners(name)     # only the contests with a matching candidate
+            contests = cls._all.values() if contests is None else contests
         else:
             contests = [cls._all[contest]]
         results = {}
@@ -129,8 +140,10 @@ class Contest(LogSelf):
 
 
 class Precinct(LogSelf):
-    _all = Fields(key="Precinct")
+    _all = Scoped('Precinct', lambda: Fields(key='Precinct'))
     _county = Fields(key="Precinct")    # TODO - why is _county the same Fields?
+    TURNOUT = ('totalVoters', 'ballotsCast', 'voterTurnout', 'percentReporting')
+    DIFF = ('county', *TURNOUT, 'election_date', 'timestamp')
 
     def __init__(self, name: Name or tuple[Name], county: str, election_date: datetime, timestamp: datetime or set,
                  totalVoters, ballotsCast, voterTurnout, percentReporting,
@@ -176,10 +189,13 @@ class Precinct(LogSelf):
                         ballotsCast=self.ballotsCast+other.ballotsCast,
                         voterTurnout=None, percentReporting=None)
 
-    def diff(self, other: 'Precinct') -> dict:
-        rv = {k:None for k in ['county', 'totalVoters', 'ballotsCast', 'election_date', 'timestamp']}
-        for attr in rv.keys():
-            pass
+    def diff(self, other: 'Precinct' or None, attrs: Iterable[str] = None) -> dict:
+        """ :returns {attr: (self's, other's)} of the attrs that differ, other None: a precinct that isn't there """
+        rv = {}
+        for attr in self.DIFF if attrs is None else attrs:
+            mine, theirs = getattr(self, attr), getattr(other, attr, None)
+            if mine != theirs:
+                rv[attr] = (mine, theirs)
         return rv
 
     @classmethod
@@ -200,13 +216,18 @@ class Precinct(LogSelf):
 
 
 class ElectionResult(LogSelf):
-    def __init__(self, xml_dict, source=None):
+    """ lazy: keep each Contest raw until contest() / contests() asks for it, precincts (turnout) and contest names
+        are still read at once.  Votes are only in Race and Precinct once their Contest is built.
+    """
+    lazy = False        # default for load_from_xml()
+
+    def __init__(self, xml_dict, source=None, lazy: bool = False):
         self.Timestamp = parse_date(xml_dict['Timestamp'])
         self.ElectionName = Name(xml_dict['ElectionName'])
         self.ElectionDate = parse_date(xml_dict['ElectionDate'])
         self.Region = xml_dict['Region']
         self._source = source
-        self._errors = {}
+        self._registry = Registry.current()
 
         # do VoterTurnout to init Precincts
         self._precincts = Fields()
@@ -214,9 +235,38 @@ class ElectionResult(LogSelf):
 
         # do Contests to fill Precincts with votes
         self._contests = Fields(f"{self.Region}:contests")
-        for contest in xml_dict['Contest']:
-            c = Contest(election_result=self, **property_dict(**contest), choices=contest['Choice'], voteType=contest['VoteType'])
-            self._contests[c.name] = c
+        self._pending = Fields()    # {Name: raw contest (dict or RawElement)} not built yet
+        self._digests = {}          # {contest name: contest_digest()}
+        contests = xml_dict['Contest']
+        for contest in [contests] if type(contests) is dict else contests:
+            if lazy:
+                text = contest.attrib['text'] if type(contest) is RawElement else contest['@text']
+                self._pending[Name(text)] = contest
+            else:
+                self._build_contest(contest)
+
+    def _build_contest(self, contest: dict or RawElement) -> 'Contest':
+        contest = raw_dict(contest)
+        c = Contest(election_result=self, **property_dict(**contest), choices=contest.get('Choice', ()),
+                    voteType=contest.get('VoteType', ()))
+        self._contests[c.name] = c
+        return c
+
+    @property
+    def source(self):
+        return self._source
+
+    def retract(self):
+        """ forget this result's contests, precincts and votes, before another version of its file is loaded """
+        with self._registry:
+            Race.retract(source=self.source)
+            for registry, items in ((Contest._all(), self._contests.values()),
+                                    (Precinct._all(), self._precincts.values())):
+                for obj in items:
+                    if isinstance(obj, (Contest, Precinct)) and registry.get(obj.name) is obj:
+                        del registry[obj.name]
+        self._pending.clear()
+        self._digests.clear()
 
     @property
     def key(self):
@@ -230,9 +280,66 @@ class ElectionResult(LogSelf):
     def precinct(self, name: Name):
         return self._precincts[name]
 
-    def contest(self, name: Name):
+    def contest(self, name: Name) -> 'Contest':
+        """ the Contest called name (KeyError if there isn't one), built now if it's pending """
+        if self._pending and name not in self._contests:
+            found = self._pending.search(name, best_match=False)[0]
+            if found:
+                with self._registry:
+                    return self._build_contest(self._pending.pop(found))
         return self._contests[name]
 
+    def contests(self, names: Iterable = None) -> list:
+        """ [Contest, ...] every contest (or those of names that exist), building any that are pending """
+        if names is not None:
+            return [c for c in (self._find_contest(name) for name in names) if c is not None]
+        with self._registry:
+            for name in list(self._pending):
+                self._build_contest(self._pending.pop(name))
+        return [c for c in self._contests.values() if isinstance(c, Contest)]
+
+    def _find_contest(self, name: Name) -> 'Contest' or None:
+        try:
+            return self.contest(name)
+        except KeyError:
+            return None
+
+    @property
+    def contest_names(self) -> list:
+        """ the names of every contest, built or not """
+        return [name for name, c in self._contests.items() if isinstance(c, Contest)] + list(self._pending)
+
+    def contest_digest(self, name: Name) -> str:
+        """ a digest of the content of contest name (one of contest_names), kept for the next diff (see ga.diff).
+            Equal digests: the same votes.  A pending contest's is of its raw xml (or dict), a built one's of its votes,
+            so only snapshots loaded the same way (lazy or not) skip their unchanged contests
+        """
+        rv = self._digests.get(name)
+        if rv is None:
+            raw = dict.get(self._pending, name)
+            h = blake2b(digest_size=16)
+            if type(raw) is RawElement:
+                h.update(raw_bytes(raw))
+            elif raw is not None:
+                h.update(repr(raw).encode())
+            else:
+                h.update(repr(sorted(self.contest_counts(name).items(), key=repr)).encode())
+            rv = self._digests[name] = h.hexdigest()
+        return rv
+
+    def contest_counts(self, name: Name) -> dict:
+        """ {(precinct, candidate, vote_type): votes} of contest name, strings (candidate None: the contest's under /
+            over votes).  A pending contest is read from its raw xml, it isn't built
+        """
+        raw = dict.get(self._pending, name)
+        if raw is not None:
+            return _contest_counts(raw_dict(raw))
+        with self._registry:
+            records = races[self.contest(name).name].records([self.source])
+        return {(str(records.precincts[p]), _str(records.candidates[c]), str(records.vote_types[v])): n
+                for c, p, v, n in zip(records.candidate.tolist(), records.precinct.tolist(),
+                                      records.vote_type.tolist(), records.count.tolist())}
+
     def _read_voter_turnout(self, voter_turnout: dict):
         _precinct_list = voter_turnout['Precincts']
         if len(_precinct_list) == 1 and 'Precinct' in _precinct_list:
@@ -254,8 +361,60 @@ class ElectionResult(LogSelf):
             self._precincts[p.name] = p
 
     @classmethod
-    def load_from_xml(cls, filename: Path):
-        from xmltodict import parse as xml_parse
-        with open(filename, 'rb') as f:
-            xml_dict = xml_parse(f)
-        return ElectionResult(xml_dict['ElectionResult'])
+    def load_from_xml(cls, filename: Path, stream: bool = True, cache: 'FileCache' = None, lazy: bool = None):
+        """ stream: parse incrementally, building each Contest as its element closes (memory ~ the largest Contest)
+            otherwise parse the whole file with xmltodict first
+            cache: a db.file_cache.FileCache to replay the parsed xml from (and save it to), lazy streamed loads
+            don't use it: the cache holds every contest parsed, what a lazy load doesn't do
+            lazy: build contests when they're asked for (default: ElectionResult.lazy), streamed contests are
+            kept as xml until then
+        """
+        lazy = cls.lazy if lazy is None else lazy
+        if stream:
+            parse = partial(stream_xml, stream_tag='Contest')
+            xml_dict = cache.stream_dict(filename, parse, stream_key='Contest', kind=CACHE_KIND) \
+                if cache and not lazy else parse(filename, raw=lazy)
+        else:
+            xml_dict = cache.value(filename, _parse_xml, kind='ElectionResult.xmltodict') if cache \
+                else _parse_xml(filename)
+        return ElectionResult(xml_dict, source=filename, lazy=lazy)
+
+
+def _str(name: Name or None) -> str or None:
+    return None if name is None else str(name)
+
+
+def _contest_counts(contest: dict) -> dict:
+    """ ElectionResult.contest_counts() of a contest's dict """
+    rv = {}
+
+    def do_votetype(candidate: str or None, vote_types: list or dict):
+        for vt in [vote_types] if type(vote_types) is dict else vote_types:
+            vote_type = str(Contest._vote_types.add(vt['@name']))
+            precincts = vt['Precinct']
+            for precinct in [precincts] if type(precincts) is dict else precincts:
+                rv[(precinct['@name'].strip(), candidate, vote_type)] = int(precinct['@votes'])
+
+    do_votetype(None, contest.get('VoteType', ()))
+    choices = contest.get('Choice', ())
+    for choice in [choices] if type(choices) is dict else choices:
+        do_votetype(choice['@text'].strip(), choice['VoteType'])
+    return rv
+
+
+def read_xml(filename: Path, cache: 'FileCache' = None, data: bytes = None) -> dict:
+    """ :returns the xml dict ElectionResult() is built from, with every Contest read (a list): plain data, so it can
+        come from a worker process.  It shares the cache of load_from_xml(stream=True)
+        data: the file's bytes, if they were already read (see ingest)
+    """
+    def parse(file: Path) -> dict:
+        return stream_xml(file if data is None else BytesIO(data), stream_tag='Contest')
+    xml_dict = cache.stream_dict(filename, parse, stream_key='Contest', kind=CACHE_KIND) if cache else parse(filename)
+    xml_dict['Contest'] = list(xml_dict['Contest'])
+    return xml_dict
+
+
+def _parse_xml(filename: Path) -> dict:
+    from xmltodict import parse as xml_parse
+    with open(filename, 'rb') as f:
+        return xml_parse(f)['ElectionResult']
@@ -0,0 +1,114 @@
+""" Snapshot diff:
+The SOS republishes a county's (or the state's) detail xml many times, election night and through certification, each
+with a new Timestamp.  diff(old, new) tells what changed between two of them: turnout fields of precincts, and the
+counts of contests, by precinct, candidate and vote type.
+ - each contest has a digest of its content (ElectionResult.contest_digest), kept by its ElectionResult, so contests
+   that didn't change are skipped without being read, parsed or built.  With lazy (or columnar) snapshots the time
+   is that of hashing the raw contests once, and of reading the contests that changed
+ - load each snapshot in its own Registry (load()): contests and precincts of the same region share names
+ - lazy snapshots read their contests from their file when needed, it must not be replaced while it is diffed
+
+ex: python -m ga.diff 2020/fulton/detail-1.xml 2020/fulton/detail-2.xml
+"""
+import json
+from argparse import ArgumentParser
+from datetime import datetime
+from pathlib import Path
+from typing import Iterable, NamedTuple
+from registry import Registry
+from .columnar import ColumnarResult, SUFFIX
+from .contest import ElectionResult, Precinct
+
+
+class Change(NamedTuple):
+    """ one count (or turnout field) that changed, old / new None: it wasn't there """
+    contest: str or None        # None: a precinct's turnout
+    precinct: str
+    candidate: str or None      # None: turnout, or a contest's under / over votes
+    field: str                  # the vote type, or the turnout field
+    old: int or float or None
+    new: int or float or None
+
+
+class SnapshotDiff(NamedTuple):
+    old: datetime               # the snapshots' Timestamps
+    new: datetime
+    turnout: dict               # {precinct: {field: (old, new)}}
+    contests: dict              # {contest: {(precinct, candidate, vote_type): (old, new)}}
+    unchanged: int              # contests skipped, their digests are the same
+
+    def __bool__(self):
+        return bool(self.turnout or self.contests)
+
+    def changes(self) -> Iterable[Change]:
+        for precinct, fields in self.turnout.items():
+            for field, (old, new) in fields.items():
+                yield Change(None, precinct, None, field, old, new)
+        for contest, counts in self.contests.items():
+            for (precinct, candidate, vote_type), (old, new) in counts.items():
+                yield Change(contest, precinct, candidate, vote_type, old, new)
+
+
+def diff(old: ElectionResult, new: ElectionResult) -> SnapshotDiff:
+    """ :returns what changed from old to new """
+    turnout = {}
+    old_precincts, new_precincts = (_precincts(er) for er in (old, new))
+    for name in _union(old_precincts, new_precincts):
+        a, b = old_precincts.get(name), new_precincts.get(name)
+        fields = a.diff(b, attrs=Precinct.TURNOUT) if a is not None else \
+            {k: (None, v) for k, (v, _) in b.diff(None, attrs=Precinct.TURNOUT).items()}
+        if fields:
+            turnout[name] = fields
+
+    contests, unchanged = {}, 0
+    old_names, new_names = ({str(name): name for name in er.contest_names} for er in (old, new))
+    for name in _union(old_names, new_names):
+        a, b = old_names.get(name), new_names.get(name)
+        if a is not None and b is not None and old.contest_digest(a) == new.contest_digest(b):
+            unchanged += 1
+            continue
+        a = old.contest_counts(a) if a is not None else {}
+        b = new.contest_counts(b) if b is not None else {}
+        counts = {key: (a.get(key), b.get(key)) for key in sorted(a.keys() | b.keys(), key=repr)
+                  if a.get(key) != b.get(key)}
+        if counts:
+            contests[name] = counts
+    return SnapshotDiff(old.Timestamp, new.Timestamp, turnout, contests, unchanged)
+
+
+def _union(old: dict, new: dict) -> list:
+    """ the keys of new, then those only in old """
+    return list(new) + [k for k in old if k not in new]
+
+
+def _precincts(er: ElectionResult) -> dict:
+    return {str(name): p for name, p in dict.items(er._precincts) if isinstance(p, Precinct)}
+
+
+def load(filename: Path) -> ElectionResult:
+    """ a lazy ElectionResult of filename (xml, or columnar: ga.columnar), in a Registry of its own """
+    filename = Path(filename).expanduser()
+    with Registry(f'snapshot {filename}'):
+        if filename.suffix == SUFFIX:
+            return ColumnarResult.load(filename)
+        return ElectionResult.load_from_xml(filename, lazy=True)
+
+
+def get_args():
+    ap = ArgumentParser(prog='python -m ga.diff', description='what changed between two SOS detail xml snapshots')
+    ap.add_argument('old', type=str, help='detail xml (or .gacol)')
+    ap.add_argument('new', type=str, help='a later detail xml (or .gacol) of the same election')
+    return ap.parse_args()
+
+
+def main():
+    args = get_args()
+    rv = diff(load(args.old), load(args.new))
+    for change in rv.changes():
+        print(json.dumps(change._asdict()))
+    print(f"{rv.old} -> {rv.new}: {len(rv.turnout)} precincts' turnout and {len(rv.contests)} contests changed, "
+          f"{rv.unchanged} contests unchanged")
+
+
+if __name__ == '__main__':
+    main()
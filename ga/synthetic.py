@@ -0,0 +1,191 @@
+""" Synthetic elections for benchmarks and scale tests:
+generate() writes an SOS detail xml and the tabulator tapes that go with it into PATH/YEAR/REGION (see util.parse_path)
+ - statewide contests cover every precinct, the rest cover a district: a run of neighbouring precincts
+ - votes are split over 4 vote types, the election day votes are split again over each location's tabulators
+ - a few locations share tabulators (a 'P0001-P0002' tape), and a few tapes are wrong by a vote or two (errors)
+manifest.json records what was generated, including the errors a validation should find
+"""
+import json
+import random
+from pathlib import Path
+from xml.sax.saxutils import quoteattr
+from openpyxl import Workbook
+
+VOTE_TYPES = ('Election Day Votes', 'Advanced Voting Votes', 'Absentee by Mail Votes', 'Provisional Votes')
+SIZES = {       # generate() keyword arguments
+    'tiny': dict(precincts=20, contests=8, statewide=3),
+    'county': dict(precincts=380, contests=60, statewide=12),
+    'statewide': dict(precincts=2700, contests=300, statewide=20),
+}
+_OFFICES = ('State Senate', 'State House', 'Superior Court', 'Board of Education', 'County Commission', 'City Council',
+            'Soil and Water', 'Public Service Commission')
+_FIRST = ('Alex', 'Jordan', 'Morgan', 'Taylor', 'Casey', 'Riley', 'Jamie', 'Avery', 'Quinn', 'Parker')
+_LAST = ('Smith', 'Jones', 'Brown', 'Lee', 'Walker', 'Hall', 'Young', 'King', 'Wright', 'Green')
+_PARTIES = ('Rep', 'Dem', 'Lib', 'NP')
+
+
+def _attrs(**kwargs) -> str:
+    return ' '.join(f'{k}={quoteattr(str(v))}' for k, v in kwargs.items())
+
+
+class _Contest:
+    def __init__(self, n: int, name: str, precincts: list, candidates: list):
+        self.key = n + 1
+        self.name = name
+        self.precincts = precincts          # indexes
+        self.candidates = candidates        # (name, party)
+        self.votes = {}                     # {precinct: [[votes of each candidate] for each vote type]}
+        self.under = {}                     # {precinct: undervotes}
+
+
+def generate(path: Path, precincts: int = 20, contests: int = 8, statewide: int = 3, candidates: tuple = (2, 5),
+             tabulators: tuple = (1, 3), shared: float = 0.05, errors: float = 0.02, seed: int = 0,
+             region: str = 'Fulton', year: int = 2020, columns_per_file: int = 20) -> dict:
+    """ write PATH/YEAR/REGION/detail.xml, tapes*.xlsx and manifest.json :returns the manifest
+        candidates, tabulators: (min, max) per contest / per location
+        shared: fraction of locations whose tabulators count 2 precincts
+        errors: fraction of locations with a tape that's off by a vote or two
+    """
+    rnd = random.Random(seed)
+    out = Path(path).expanduser().joinpath(str(year), region.lower())
+    out.mkdir(parents=True, exist_ok=True)
+    names = [f"P{n:04d}" for n in range(precincts)]
+    voters = [rnd.randint(500, 3000) for _ in range(precincts)]
+    cast = [int(v * rnd.uniform(0.4, 0.8)) for v in voters]
+
+    all_contests = []
+    for n in range(contests):
+        if n < statewide:
+            covered = list(range(precincts))
+            name = 'President of the United States' if n == 0 else f"Statewide Office {n}"
+        else:
+            size = max(1, int(precincts * rnd.uniform(0.02, 0.10)))
+            start = rnd.randrange(0, max(1, precincts - size + 1))
+            covered = list(range(start, start + size))
+            name = f"{_OFFICES[n % len(_OFFICES)]} - District {n}"
+        choices = [(f"{_FIRST[(n + c) % len(_FIRST)]} {_LAST[(n * 3 + c) % len(_LAST)]} {n}.{c}",
+                    _PARTIES[c % len(_PARTIES)]) for c in range(rnd.randint(*candidates))]
+        contest = _Contest(n, name, covered, choices)
+        for p in covered:
+            weights = [rnd.random() + 0.1 for _ in choices]
+            under = contest.under[p] = int(cast[p] * rnd.uniform(0, 0.05))
+            by_type = _split(rnd, cast[p] - under, len(VOTE_TYPES))
+            contest.votes[p] = [_split(rnd, votes, len(choices), weights) for votes in by_type]
+        all_contests.append(contest)
+
+    xml_file = out.joinpath('detail.xml')
+    _write_xml(xml_file, region, names, voters, cast, all_contests)
+    tapes, injected = _write_tapes(rnd, out, names, all_contests, tabulators, shared, errors, columns_per_file)
+    manifest = {'seed': seed, 'region': region, 'year': year, 'path': str(out), 'xml': xml_file.name,
+                'precincts': precincts, 'contests': contests, 'statewide': statewide,
+                'precinct_contests': sum(len(c.precincts) for c in all_contests),
+                'choices': sum(len(c.precincts) * len(c.candidates) for c in all_contests),
+                'tape_files': len(tapes), 'tabulators': sum(tapes.values()), 'errors': injected}
+    with open(out.joinpath('manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=1)
+    return manifest
+
+
+def _split(rnd: random.Random, total: int, parts: int, weights: list = None) -> list:
+    """ split total into parts (integers) in proportion to weights (random if None) """
+    weights = weights or [rnd.random() + 0.1 for _ in range(parts)]
+    scale = total / sum(weights)
+    rv = [int(w * scale) for w in weights]
+    rv[rnd.randrange(parts)] += total - sum(rv)
+    return rv
+
+
+def _write_xml(filename: Path, region: str, names: list, voters: list, cast: list, contests: list):
+    with open(filename, 'w', encoding='utf-8') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<ElectionResult>\n')
+        f.write(f'  <Timestamp>11/20/2020 3:52:47 PM EST</Timestamp>\n  <ElectionName>General Election</ElectionName>\n'
+                f'  <ElectionDate>11/3/2020</ElectionDate>\n  <Region>{region}</Region>\n')
+        f.write(f'  <VoterTurnout {_attrs(totalVoters=sum(voters), ballotsCast=sum(cast), voterTurnout="%.2f" % (100 * sum(cast) / sum(voters)))}>\n'
+                f'    <Precincts>\n')
+        for name, v, c in zip(names, voters, cast):
+            f.write(f'      <Precinct {_attrs(name=name, totalVoters=v, ballotsCast=c, voterTurnout="%.2f" % (100 * c / v), percentReporting=4)} />\n')
+        f.write('    </Precincts>\n  </VoterTurnout>\n')
+        for contest in contests:
+            ps = contest.precincts
+            f.write(f'  <Contest {_attrs(key=contest.key, text=contest.name, voteFor=1, isQuestion="false", precinctsReported=len(ps), precinctsParticipating=len(ps))}>\n')
+            for vote_type, votes in (('Undervotes', contest.under), ('Overvotes', {p: 0 for p in ps})):
+                f.write(f'    <VoteType {_attrs(name=vote_type, votes=sum(votes.values()))}>\n')
+                f.writelines(f'      <Precinct {_attrs(name=names[p], votes=votes[p])} />\n' for p in ps)
+                f.write('    </VoteType>\n')
+            for c, (candidate, party) in enumerate(contest.candidates):
+                by_type = [[contest.votes[p][t][c] for p in ps] for t in range(len(VOTE_TYPES))]
+                f.write(f'    <Choice {_attrs(key=c + 1, text=candidate, party=party, totalVotes=sum(map(sum, by_type)))}>\n')
+                for vote_type, votes in zip(VOTE_TYPES, by_type):
+                    f.write(f'      <VoteType {_attrs(name=vote_type, votes=sum(votes))}>\n')
+                    f.writelines(f'        <Precinct {_attrs(name=names[p], votes=n)} />\n' for p, n in zip(ps, votes))
+                    f.write('      </VoteType>\n')
+                f.write('    </Choice>\n')
+            f.write('  </Contest>\n')
+        f.write('</ElectionResult>\n')
+
+
+def _write_tapes(rnd: random.Random, out: Path, names: list, contests: list, tabulators: tuple, shared: float,
+                 errors: float, columns_per_file: int) -> tuple:
+    """ :returns {filename: columns}, [injected errors] """
+    by_precinct = {}
+    for contest in contests:
+        for p in contest.precincts:
+            by_precinct.setdefault(p, []).append(contest)
+    locations, p = [], 0
+    while p < len(names):
+        n = 2 if p + 1 < len(names) and rnd.random() < shared and by_precinct.get(p) == by_precinct.get(p + 1) else 1
+        locations.append(tuple(range(p, p + n)))
+        p += n
+
+    files, injected, columns, signature, tabulator_id = {}, [], [], None, 10000
+
+    def flush():
+        if columns:
+            filename = out.joinpath(f"tapes{len(files):04d}.xlsx")
+            _write_tape(filename, columns)
+            files[filename.name] = len(columns)
+            columns.clear()
+
+    for n, location in enumerate(locations):
+        races = by_precinct.get(location[0], [])
+        if [c.key for c in races] != signature or len(columns) >= columns_per_file:
+            flush()
+            signature = [c.key for c in races]
+        day = {c.name: [sum(c.votes[p][0][i] for p in location) for i in range(len(c.candidates))] for c in races}
+        count = rnd.randint(*tabulators)
+        tapes = [{} for _ in range(count)]
+        for contest in races:
+            for i, votes in enumerate(day[contest.name]):
+                for tape, v in zip(tapes, _split(rnd, votes, count)):
+                    tape.setdefault(contest.name, []).append(v)
+        if races and rnd.random() < errors:
+            contest, t = rnd.choice(races), rnd.randrange(count)
+            i, delta = rnd.randrange(len(contest.candidates)), rnd.choice((-2, -1, 1, 2))
+            delta = max(delta, -tapes[t][contest.name][i])
+            if delta:
+                tapes[t][contest.name][i] += delta
+                injected.append({'location': '-'.join(names[p] for p in location), 'race': contest.name,
+                                 'candidate': contest.candidates[i][0], 'diff': delta})
+        for t, tape in enumerate(tapes):
+            tabulator_id += 1
+            ballots = max([sum(v) for v in tape.values()] or [0])
+            columns.append({'Name': f"ICP {n}.{t}", 'Tabulator ID': tabulator_id,
+                            'Voting Location': '-'.join(names[p] for p in location),
+                            'Protective Counter': ballots + rnd.randint(0, 5000), 'Total Scanned': ballots,
+                            'races': [(c.name, [name for name, _ in c.candidates], tape[c.name]) for c in races]})
+    flush()
+    return files, injected
+
+
+def _write_tape(filename: Path, columns: list):
+    """ one tape per column, every column has the same races (see the signature in _write_tapes) """
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    for label in ('Name', 'Tabulator ID', 'Voting Location', 'Protective Counter', 'Total Scanned'):
+        ws.append([label] + [c[label] for c in columns])
+    for r, (race, candidates, _) in enumerate(columns[0]['races']):
+        ws.append([race])
+        for i, candidate in enumerate(candidates):
+            ws.append([candidate] + [c['races'][r][2][i] for c in columns])
+        ws.append(['Total Votes'] + [sum(c['races'][r][2]) for c in columns])
+    wb.save(filename)
@@ -0,0 +1,147 @@
+""" Pipelined ingest:
+Report.load reads the field files, then parses each xml, then each tape, so the disk (or a network mount) and the cpus
+take turns.  Pipeline overlaps them: files flow through stages, connected by bounded asyncio queues
+    discover -> read -> parse -> build
+ - read: a few threads read each file's bytes, so slow storage always has reads in flight.  A file the FileCache
+   already holds isn't read
+ - parse: an executor (processes or threads) turns the bytes into plain data, what the FileCache holds:
+   the Tabulator kwargs of each column, the xml dict, the yml
+ - build: names are normalized and objects registered (Fields, ElectionResult, Tabulators) by build(), on the event
+   loop's thread, in the current Registry and in the order the files were given, so the result is the same as loading
+   them one after the other.  A file that failed raises when its turn to be built comes
+ - at most `window` files are between discover and build, queued or in a stage, so memory is bounded by that many
+   files (about 3 * queue_size, and those being read or parsed), not the number of files.  Each of them is held
+   whole: its bytes, then everything it's parsed to (every Contest of an xml), so a few very large files still take
+   their size several times over
+"""
+import asyncio
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Iterable, NamedTuple
+import yaml
+from db.file_cache import FileCache
+from ga.contest import read_xml, CACHE_KIND as XML_KIND
+from tabulator import read_tabulator_file, CACHE_KIND as XLSX_KIND
+
+EXECUTORS = {'process': ProcessPoolExecutor, 'thread': ThreadPoolExecutor}
+
+
+def read_yml(file: Path, cache: FileCache = None, data: bytes = None) -> Any:
+    return yaml.safe_load(file.read_bytes() if data is None else data)
+
+
+# {kind: (read(file, cache, data) -> plain data, its FileCache kind)}, other kinds are built without being read
+READERS = {'yml': (read_yml, None), 'xml': (read_xml, XML_KIND), 'xlsx': (read_tabulator_file, XLSX_KIND)}
+
+
+class Item(NamedTuple):
+    n: int                  # the order it's built in
+    kind: str
+    file: Path
+    data: Any = None        # the file's bytes, then what they're parsed to
+    error: BaseException = None
+
+
+def parse(kind: str, file: Path, data: bytes = None, cache: FileCache = None) -> Any:
+    """ runs in the executor: the plain data of file, from data (its bytes) or the cache """
+    read, _ = READERS[kind]
+    return read(file, cache=cache, data=data)
+
+
+class Pipeline:
+    """ Pipeline(executor='process', workers=4).run([('xlsx', file), ...], build) -> number of files built
+        build(kind, file, data): called with each file's parsed data, in order
+        executor: 'process', 'thread' or an Executor (which isn't shut down)
+        workers: of a new executor, and the number of files parsed at once (0: one per cpu)
+        readers: threads reading files
+        queue_size: of each queue between stages
+    """
+    def __init__(self, executor: str or Executor = 'process', workers: int = 0, readers: int = 4,
+                 queue_size: int = 4, cache: FileCache = None):
+        if isinstance(executor, str) and executor not in EXECUTORS:
+            raise ValueError(f"unknown executor {executor}, one of {', '.join(EXECUTORS)}")
+        self.executor = executor
+        self.workers = workers or os.cpu_count()
+        self.readers = readers
+        self.queue_size = queue_size
+        self.cache = cache
+
+    @property
+    def window(self) -> int:
+        """ files between discover and build at most: every queue full, and every reader and worker busy """
+        return 3 * self.queue_size + self.readers + self.workers
+
+    def run(self, files: Iterable[tuple], build: Callable[[str, Path, Any], None]) -> int:
+        return asyncio.run(self._run(list(files), build))
+
+    async def _run(self, files: list, build: Callable) -> int:
+        own = isinstance(self.executor, str)
+        executor = EXECUTORS[self.executor](max_workers=self.workers) if own else self.executor
+        try:
+            with ThreadPoolExecutor(max_workers=self.readers, thread_name_prefix='ingest') as io:
+                return await self._stages(files, build, io, executor)
+        finally:
+            if own:
+                executor.shutdown(cancel_futures=True)
+
+    async def _stages(self, files: list, build: Callable, io: Executor, executor: Executor) -> int:
+        loop = asyncio.get_running_loop()
+        window = asyncio.Semaphore(self.window)
+        to_read, to_parse, to_build = (asyncio.Queue(maxsize=self.queue_size) for _ in range(3))
+
+        async def discover():
+            for n, (kind, file) in enumerate(files):
+                await window.acquire()
+                await to_read.put(Item(n, kind, Path(file)))
+
+        async def read():
+            while True:
+                item = await to_read.get()
+                if item.kind in READERS:
+                    try:
+                        item = item._replace(data=await loop.run_in_executor(io, self._read, item))
+                    except Exception as e:
+                        item = item._replace(error=e)
+                await to_parse.put(item)
+
+        async def parse_items():
+            while True:
+                item = await to_parse.get()
+                if item.kind in READERS and item.error is None:
+                    try:
+                        item = item._replace(data=await loop.run_in_executor(
+                            executor, parse, item.kind, item.file, item.data, self.cache))
+                    except Exception as e:
+                        item = item._replace(error=e)
+                await to_build.put(item)
+
+        async def build_in_order():
+            done, pending = 0, {}
+            while done < len(files):
+                item = await to_build.get()
+                pending[item.n] = item
+                while done in pending:
+                    item = pending.pop(done)
+                    if item.error is not None:
+                        raise item.error
+                    build(item.kind, item.file, item.data)
+                    done += 1
+                    window.release()
+            return done
+
+        stages = [loop.create_task(discover())] + [loop.create_task(read()) for _ in range(self.readers)] + \
+                 [loop.create_task(parse_items()) for _ in range(self.workers)]
+        try:
+            return await build_in_order()
+        finally:
+            for task in stages:
+                task.cancel()
+            await asyncio.gather(*stages, return_exceptions=True)
+
+    def _read(self, item: Item) -> bytes or None:
+        """ runs in a reader thread: the file's bytes, None if the cache has it (it's parsed from there) """
+        _, kind = READERS[item.kind]
+        if self.cache is not None and kind is not None and self.cache.has(item.file, kind):
+            return None
+        return item.file.read_bytes()
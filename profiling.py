@@ -0,0 +1,169 @@
+""" Profiling:
+Profiler.stage() records the wall and cpu seconds and the memory (tracemalloc) of each stage of a run.  While a
+Profiler is counting, the hot paths are wrapped to count their calls, and each stage also records how many it made:
+ - fields_search: Fields.search() calls, fields_scanned: keys compared by those that missed the cache
+ - cache_hits, cache_misses: of the Fields search caches (db.cache)
+ - name_regex: Name.__eq__ comparisons that had to run the regex
+ - deep_set, deep_tally: calls (deep_tally counts its recursion)
+Nothing is wrapped unless a Profiler counts, so the hot paths cost nothing extra otherwise.
+Counts are per process: --jobs workers parse tapes uncounted.
+"""
+import json
+import sys
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+from pathlib import Path
+
+COUNTS = Counter()      # of the installed hooks, since they were installed
+
+
+def _hooks() -> list:
+    """ [(owner, attribute, wrapper factory), ...] """
+    import util
+    from db import Fields, Name
+    from db.cache import SearchCache
+
+    def search(fn):
+        @wraps(fn)
+        def wrapper(self, key, best_match: bool = True):
+            COUNTS['fields_search'] += 1
+            return fn(self, key, best_match)
+        return wrapper
+
+    def candidates(fn):
+        @wraps(fn)
+        def wrapper(self, key):
+            rv = fn(self, key)
+            COUNTS['fields_scanned'] += len(rv)
+            return rv
+        return wrapper
+
+    def cache_get(fn):
+        @wraps(fn)
+        def wrapper(self, key):
+            rv = fn(self, key)
+            COUNTS['cache_misses' if rv is SearchCache.MISSING else 'cache_hits'] += 1
+            return rv
+        return wrapper
+
+    def name_eq(fn):
+        @wraps(fn)
+        def wrapper(self, other):
+            if self is not other and self._pattern is not None \
+                    and not str.__eq__(self, other if isinstance(other, str) else str(other)):
+                COUNTS['name_regex'] += 1
+            return fn(self, other)
+        return wrapper
+
+    def counted(name: str):
+        def factory(fn):
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                COUNTS[name] += 1
+                return fn(*args, **kwargs)
+            return wrapper
+        return factory
+
+    return [(Fields, 'search', search), (Fields, '_candidates', candidates), (SearchCache, 'get', cache_get),
+            (Name, '__eq__', name_eq), (util, 'deep_set', counted('deep_set')),
+            (util, 'deep_tally', counted('deep_tally'))]
+
+
+class _Installed:
+    """ the wrapped hot paths, restored by remove() """
+    def __init__(self):
+        self._restore = []
+        for owner, attr, factory in _hooks():
+            original = owner.__dict__[attr] if isinstance(owner, type) else getattr(owner, attr)
+            wrapper = factory(original)
+            self._set(owner, attr, original, wrapper)
+            if not isinstance(owner, type):
+                # functions imported by name elsewhere (from util import deep_set)
+                for module in list(sys.modules.values()):
+                    if module is not owner and getattr(module, attr, None) is original:
+                        self._set(module, attr, original, wrapper)
+
+    def _set(self, owner, attr: str, original, wrapper):
+        setattr(owner, attr, wrapper)
+        self._restore.append((owner, attr, original))
+
+    def remove(self):
+        for owner, attr, original in reversed(self._restore):
+            setattr(owner, attr, original)
+        self._restore.clear()
+
+
+class Profiler:
+    """ with Profiler() as profiler:
+            with profiler.stage('xml') as counts: ...     (counts: extra values to record for the stage)
+        memory: trace memory (tracemalloc slows everything down), count: count the hot path calls
+    """
+    def __init__(self, memory: bool = True, count: bool = True):
+        self.memory = memory
+        self.count = count
+        self.stages = []
+        self._installed = None
+
+    def __enter__(self) -> 'Profiler':
+        if self.count and self._installed is None:
+            self._installed = _Installed()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self._installed is not None:
+            self._installed.remove()
+            self._installed = None
+        if self.memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    @contextmanager
+    def stage(self, name: str):
+        counts = {}
+        if self.memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+        calls = COUNTS.copy()
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield counts
+        finally:
+            rv = {'stage': name, 'wall_s': round(time.perf_counter() - wall, 4),
+                  'cpu_s': round(time.process_time() - cpu, 4)}
+            if self.memory:
+                current, peak = tracemalloc.get_traced_memory()
+                rv.update(peak_mb=round((peak - before) / 2 ** 20, 2), retained_mb=round((current - before) / 2 ** 20, 2))
+            if self._installed is not None:
+                rv.update((k, v) for k, v in sorted((COUNTS - calls).items()))
+            rv.update(counts)
+            self.stages.append(rv)
+
+    def totals(self) -> dict:
+        """ the sum of every stage's seconds and counts, and the largest peak memory """
+        rv = Counter()
+        for stage in self.stages:
+            rv.update({k: v for k, v in stage.items() if k not in ('stage', 'peak_mb', 'retained_mb')})
+        rv = {k: round(v, 4) if type(v) is float else v for k, v in rv.items()}
+        if self.memory and self.stages:
+            rv['peak_mb'] = max(stage.get('peak_mb', 0) for stage in self.stages)
+        return rv
+
+    def save(self, filename: Path, **kwargs) -> dict:
+        """ write {stages, totals, **kwargs} as json :returns it """
+        rv = dict(kwargs, stages=self.stages, totals=self.totals())
+        with open(Path(filename).expanduser(), 'w') as f:
+            json.dump(rv, f, indent=1)
+        return rv
+
+    def summary(self) -> str:
+        """ a table of the stages: seconds, memory and the main counts """
+        columns = ('fields_search', 'fields_scanned', 'cache_hits', 'name_regex', 'deep_set', 'deep_tally')
+        lines = [f"{'stage':20} {'wall_s':>8} {'cpu_s':>8} {'peak_mb':>8} " + ' '.join(f"{c:>14}" for c in columns)]
+        for s in self.stages + [dict(self.totals(), stage='total')]:
+            lines.append(f"{s['stage']:20} {s['wall_s']:8.3f} {s['cpu_s']:8.3f} {s.get('peak_mb', float('nan')):8.1f} "
+                         + ' '.join(f"{s.get(c, 0):14,d}" for c in columns))
+        return '\n'.join(lines)
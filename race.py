@@ -9,10 +9,14 @@ Goals:
 
 from typing import NamedTuple, Hashable, Iterable
 from db import Fields, Name, SearchResult
-from util import deep_set
+from db.candidates import CandidateIndex
+from registry import Scoped
+from util import deep_set, deep_tally
 #__all__ = ['races', 'Race']
 
-races = Fields(key='Races')
+races = Scoped('races', lambda: Fields(key='Races'))     # races of the current Registry
+candidate_index = Scoped('race candidates', lambda: CandidateIndex(races(), lambda race: race.candidates))
+defaults = Scoped('race defaults', dict)    # {'store' or 'columnar': value} for Race.add() in the current Registry
 
 
 class Race(NamedTuple):
@@ -21,18 +25,33 @@ class Race(NamedTuple):
     sources: set = set()        # files, url, etc - WHO DO I BLAME for this data
     candidates: Fields = Fields()
     state: Name = Name('Georgia')
+    votes: 'VoteStore' = None   # columnar vote storage (db.votes), None: votes nest in candidates
+    columnar = False            # Race.add() creates races with a VoteStore
+    store = None                # Race.add() creates races with store(seat, candidates, district) e.g. db.sql.Archive.votes
 
     @classmethod
-    def add(cls, district: Name, seat: Name, sources: set = None, candidates: Fields = None):
+    def add(cls, district: Name, seat: Name, sources: set = None, candidates: Fields = None, columnar: bool = None,
+            votes=None):
+        """ columnar: a new race keeps its votes in a VoteStore (default: defaults['columnar'] else Race.columnar)
+            votes: the vote store of a new race, default: made by defaults['store'] else Race.store, else a VoteStore
+                   or nested dicts
+        """
         global races
         try:
             r = races[seat]
             if candidates:
                 r.candidates.update(candidates)
             if sources:
-                r.sources.union(sources)
+                r.sources.update(sources)
         except KeyError:
-            r = cls(district, seat, sources, candidates)
+            candidates = Fields() if candidates is None else candidates
+            store = defaults.get('store', cls.store)
+            if votes is None and store is not None:
+                votes = store(seat=seat, candidates=candidates, district=district)
+            elif votes is None and (defaults.get('columnar', cls.columnar) if columnar is None else columnar):
+                from db.votes import VoteStore
+                votes = VoteStore(candidates=candidates)
+            r = cls(district, seat, set(sources or ()), candidates, votes=votes)
             races[seat] = r
         return r
 
@@ -50,7 +69,11 @@ class Race(NamedTuple):
     @classmethod
     def find_candidate(cls, candidate: str, race: str = None) -> SearchResult:
         rv = Fields()
-        search_races = races.values() if not race else [races.search(race, best_match=True).value]
+        if race:
+            search_races = [races.search(race, best_match=True).value]
+        else:
+            search_races = candidate_index.owners(candidate)     # only the races with a matching candidate
+            search_races = races.values() if search_races is None else search_races
         for r in search_races:
             found = r.candidates.search(candidate)[0]
             if not found:
@@ -63,35 +86,122 @@ class Race(NamedTuple):
                   vote_type: str = 'election day'):
         race = cls[seat]
         race.set_votes(candidate=candidate, count=count, source=source, precinct=precinct, vote_type=vote_type)
+        if race.votes is not None:
+            return race.votes.get(candidate, source, precinct)
         return race.candidates[candidate][source][precinct]
 
     def set_votes(self, candidate: str, count: int, source: str, precinct: tuple or str,
                   vote_type: str = 'election day'):
+        if self.votes is not None:
+            self.votes.set(candidate, source, precinct, vote_type, count)
+            return
         deep_set(self.candidates, (candidate, source, precinct, vote_type), count)
-        if isinstance(precinct, tuple):
-            precinct_dict = self.candidates[candidate][source][precinct]
-            for p in precinct:
-                self.candidates[candidate][source][p] = precinct_dict
+
+    def set_records(self, source, records: 'Records') -> int:
+        """ set every count of records (see db.votes.Records) from source :returns the number of counts """
+        if self.votes is not None:
+            return self.votes.set_records(source, records)
+        for c, p, v, count in zip(records.candidate.tolist(), records.precinct.tolist(), records.vote_type.tolist(),
+                                  records.count.tolist()):
+            self.set_votes(candidate=records.candidates[c], count=count, source=source, precinct=records.precincts[p],
+                           vote_type=records.vote_types[v])
+        return len(records.count)
+
+    def remove_source(self, source) -> int:
+        """ forget the votes from source :returns number of candidates/counts removed """
+        self.sources.discard(source)
+        if self.votes is not None:
+            return self.votes.remove_source(source)
+        removed = 0
+        for votes in self.candidates.values():
+            if isinstance(votes, dict) and votes.pop(source, None) is not None:
+                removed += 1
+        return removed
+
+    @classmethod
+    def retract(cls, source) -> int:
+        """ forget the votes from source in every race, before reloading it """
+        return sum(r.remove_source(source) for r in races.values())
 
     def tally(self, source: str, candidate: str = None, precinct: tuple or str = None, vote_type: str = None):
-        def deep_tally(di: dict, keys: tuple):
-            if not isinstance(di, dict):
-                return di
-            for n, k in enumerate(keys):
-                if k is None:
-                    return sum([deep_tally(di[_key], keys[n+1:]) for _key in di])
-                if n == len(keys) - 1:
-                    di = di[k]
-                    return di if not isinstance(di, dict) else deep_tally(di, (None,))
-                if k not in di:
-                    return 0
-                di = di[k]
-            return 0
-        return deep_tally(self.candidates, (candidate, source, precinct, vote_type))
+        if self.votes is not None:
+            return self.votes.tally(source=source, candidate=candidate, precinct=precinct, vote_type=vote_type)
+        if precinct is None or isinstance(precinct, tuple):
+            return deep_tally(self.candidates, (candidate, source, precinct, vote_type))
+        return sum(v[-1] for v in self._votes(candidate, source, precinct, vote_type))
+
+    def tally_by(self, by: str, source: str = None, candidate: str = None, precinct: tuple or str = None,
+                 vote_type: str = None) -> dict:
+        """ :returns {key: sum} for each key of 'by': one of candidate, source, precinct, vote_type
+            ex: race.tally_by('candidate', source=xml_file) -> {candidate: votes, ...}
+        """
+        if self.votes is not None:
+            return self.votes.tally_by(by, source=source, candidate=candidate, precinct=precinct, vote_type=vote_type)
+        keys = (candidate, source, precinct, vote_type)
+        depth = ('candidate', 'source', 'precinct', 'vote_type').index(by)
+        rv = {}
+        if precinct is not None and not isinstance(precinct, tuple):
+            for vote in self._votes(*keys):
+                rv[vote[depth]] = rv.get(vote[depth], 0) + vote[-1]
+            return rv
+        for group, di in _walk(self.candidates, keys[:depth + 1]):
+            rv[group] = rv.get(group, 0) + deep_tally(di, keys[depth + 1:] or (None,))
+        return rv
+
+    def _votes(self, candidate=None, source=None, precinct=None, vote_type=None) -> Iterable[tuple]:
+        """ (candidate, source, precinct, vote_type, count) of every vote matching the given (not None) keys
+            votes of a tape covering several precincts are filed once, under its tuple, which a member precinct finds
+        """
+        for _candidate, by_source in _walk(self.candidates, (candidate,)):
+            for _source, precincts in _walk(by_source, (source,)):
+                if precinct is None:
+                    found = precincts.items() if isinstance(precincts, dict) else ()
+                else:
+                    found = [_precinct(precincts, precinct)] if isinstance(precincts, dict) else ()
+                for _precinct_key, vote_types in found:
+                    if _precinct_key is None:
+                        continue
+                    for _vote_type, count in _walk(vote_types, (vote_type,)):
+                        yield _candidate, _source, _precinct_key, _vote_type, count
+
+    def records(self, sources: Iterable) -> 'Records':
+        """ :returns the votes from sources as flat arrays, see db.votes.Records """
+        if self.votes is not None:
+            return self.votes.records(sources)
+        from db.votes import Records
+        return Records.from_tuples(vote[:1] + vote[2:] for source in set(sources) for vote in self._votes(source=source))
 
     def get_precinct(self, source: str, precinct: Hashable):
         """ build a precinct dict from a race and source"""
+        if self.votes is not None:
+            return self.votes.get_precinct(source, precinct)
         rv = {}
         for candidate in self.candidates:
-            rv[candidate] = self.candidates[candidate][source][precinct]
+            rv[candidate] = _precinct(self.candidates[candidate][source], precinct)[1]
         return rv
+
+
+def _precinct(precincts: dict, precinct: Hashable) -> tuple:
+    """ :returns (key, {vote_type: count}) of precinct, or of the tuple of precincts it belongs to """
+    if precinct in precincts:
+        return precinct, precincts[precinct]
+    if not isinstance(precinct, tuple):
+        for key, vote_types in precincts.items():
+            if isinstance(key, tuple) and precinct in key:
+                return key, vote_types
+    return None, None
+
+
+def _walk(di: dict, keys: tuple, key=None):
+    """ yield (last key, value) for everything at depth len(keys) of nested dicts, None keys match everything """
+    if not keys:
+        yield key, di
+        return
+    if not isinstance(di, dict):
+        return
+    k = keys[0]
+    if k is None:
+        for _key, value in di.items():
+            yield from _walk(value, keys[1:], _key)
+    elif k in di:
+        yield from _walk(di[k], keys[1:], k)
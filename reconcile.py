@@ -0,0 +1,161 @@
+""" Reconcile tabulator tapes with SOS precinct results:
+Every tape vote and every SOS vote (see Race.records) is coded as integers (location group, race candidate, vote type),
+both sides are summed with bincount over one shared key space, and the keys that disagree become the mismatch table.
+ - a location group is the precinct(s) a tape covers, 'SS15A-SS15B' is one group of 2 precincts, and overlapping
+   tapes merge their groups (db.groups)
+ - only races a tape reports, and only the vote types tapes count (election day), are compared
+ - a tape's 'Total Votes' row is compared with the sum of the SOS candidates
+"""
+import numpy as np
+from typing import Hashable, Iterable, NamedTuple
+from db import Name
+from db.groups import LocationGroups
+from db.votes import Interned, Records
+from race import Race, races as all_races
+from tabulator import Tabulator, TOTAL
+
+
+class Mismatch(NamedTuple):
+    location: Hashable      # precinct, or tuple of precincts counted by the same tabulators
+    race: Name
+    candidate: Name
+    vote_type: Name
+    sos: int                # votes in the SOS results
+    tabulator: int          # votes on the tapes
+
+    @property
+    def diff(self) -> int:
+        return self.tabulator - self.sos
+
+    def __str__(self):
+        return f"{self.location} {self.race}: {self.candidate} {self.vote_type} " \
+               f"tabulators {self.tabulator} != SOS {self.sos} ({self.diff:+d})"
+
+
+def location_groups(tabulators: Iterable[Tabulator], groups: LocationGroups = None) -> dict:
+    """ :returns {group key: [Tabulator, ...]} in file order, see Tabulator.by_location """
+    tabulators = sorted(tabulators, key=lambda t: (str(t._file), t._column or 0))
+    groups = Tabulator.location_groups(tabulators) if groups is None else groups
+    rv = {}
+    for tab in tabulators:
+        rv.setdefault(groups.key(tab.locations), []).append(tab)
+    return rv
+
+
+class _Coder:
+    """ codes Records of many races into (group, candidate, vote_type, count) arrays """
+    def __init__(self, groups: LocationGroups, keys: Iterable, vote_types: set):
+        self.groups = list(keys)
+        self._location_groups = groups
+        self._index = {key: i for i, key in enumerate(self.groups)}
+        self.candidates = Interned()        # (seat, candidate)
+        self.races = Interned()             # seat
+        self.candidate_race = []            # race code of each candidate code
+        self.vote_types = Interned()
+        for vote_type in vote_types:
+            self.vote_types.get(vote_type, add=True)
+
+    def candidate(self, seat: Name, candidate) -> int:
+        key = (seat, candidate)
+        rv = self.candidates.get(key)
+        if rv is None:
+            rv = self.candidates.get(key, add=True)
+            self.candidate_race.append(self.races.get(seat, add=True))
+        return rv
+
+    def code(self, seat: Name, records: Records) -> tuple:
+        """ :returns (group, candidate, vote_type, count) arrays of the records that can be compared """
+        group_key, index = self._location_groups.key, self._index
+        group = np.array([index.get(group_key(p), -1) for p in records.precincts], dtype=np.int64)
+        candidate = np.array([-1 if c is None else self.candidate(seat, c) for c in records.candidates], dtype=np.int64)
+        vote_type = np.array([-1 if v is None or self.vote_types.get(v) is None else self.vote_types.get(v)
+                              for v in records.vote_types], dtype=np.int64)
+        if not len(records.count):
+            return (np.zeros(0, dtype=np.int64),) * 4
+        rv = group[records.precinct], candidate[records.candidate], vote_type[records.vote_type], records.count
+        keep = (rv[0] >= 0) & (rv[1] >= 0) & (rv[2] >= 0)
+        return tuple(a[keep] for a in rv)
+
+
+def reconcile(tabulators: Iterable[Tabulator], sos_sources: Iterable, races: Iterable[Race] = None) -> list:
+    """ compare tape votes with the SOS votes of the same location groups, every precinct belongs to one group
+        so nothing is counted twice (see db.groups)
+        sos_sources: Race sources of the SOS results (ElectionResult.source)
+        :returns [Mismatch, ...] ordered by location, race, candidate
+    """
+    tabulators = list(tabulators)
+    location_index = Tabulator.location_groups(tabulators)
+    groups = location_groups(tabulators, location_index)
+    tape_sources = {tab.source for tab in tabulators}
+    sos_sources = set(sos_sources)
+    races = list(all_races.values() if races is None else races)
+    archives = {getattr(race.votes, 'archive', None) for race in races}
+    if len(archives) == 1 and None not in archives:
+        return _reconcile_sql(archives.pop(), tabulators, location_index, groups, sos_sources, races)
+    coder = _Coder(location_index, groups, {tab.vote_type for tab in tabulators})
+    tape, sos = [], []
+    for race in races:
+        if not tape_sources.intersection(race.sources):
+            continue
+        tape.append(coder.code(race.seat, race.records(tape_sources)))
+        g, c, v, n = coder.code(race.seat, race.records(sos_sources))
+        total = coder.candidate(race.seat, TOTAL)
+        candidate = c != total
+        sos.append((g, c, v, n))
+        sos.append((g[candidate], np.full(candidate.sum(), total, dtype=np.int64), v[candidate], n[candidate]))
+    if not tape:
+        return []
+    tape_g, tape_c, tape_v, tape_n = (np.concatenate(a) for a in zip(*tape))
+    sos_g, sos_c, sos_v, sos_n = (np.concatenate(a) for a in zip(*sos))
+
+    n_candidates, n_vote_types = len(coder.candidates), len(coder.vote_types)
+    keys, inverse = np.unique(np.concatenate([(tape_g * n_candidates + tape_c) * n_vote_types + tape_v,
+                                              (sos_g * n_candidates + sos_c) * n_vote_types + sos_v]),
+                              return_inverse=True)
+    n_tape = len(tape_n)
+    tape_sum = np.bincount(inverse[:n_tape], weights=tape_n, minlength=len(keys)).round().astype(np.int64)
+    sos_sum = np.bincount(inverse[n_tape:], weights=sos_n, minlength=len(keys)).round().astype(np.int64)
+    on_tape = np.bincount(inverse[:n_tape], minlength=len(keys)) > 0
+
+    group, candidate, vote_type = keys // n_vote_types // n_candidates, keys // n_vote_types % n_candidates, \
+        keys % n_vote_types
+    # only compare races a tape of that location group reported, and totals only where a tape printed one
+    candidate_race = np.array(coder.candidate_race, dtype=np.int64)
+    n_races = len(coder.races)
+    race_reported = np.isin(group * n_races + candidate_race[candidate],
+                            np.unique(tape_g * n_races + candidate_race[tape_c]))
+    is_total = np.array([c == TOTAL for _, c in coder.candidates.keys], dtype=bool)[candidate]
+    mismatched = race_reported & (on_tape | ~is_total) & (tape_sum != sos_sum)
+
+    return [Mismatch(location=coder.groups[g], race=coder.candidates.keys[c][0], candidate=coder.candidates.keys[c][1],
+                     vote_type=coder.vote_types.keys[v], sos=int(s), tabulator=int(t))
+            for g, c, v, s, t in zip(group[mismatched].tolist(), candidate[mismatched].tolist(),
+                                     vote_type[mismatched].tolist(), sos_sum[mismatched].tolist(),
+                                     tape_sum[mismatched].tolist())]
+
+
+def _reconcile_sql(archive: 'Archive', tabulators: list, location_index: LocationGroups, groups: dict,
+                   sos_sources: set, races: list) -> list:
+    """ reconcile() of races whose votes are in a db.sql.Archive: the sums by location group are SQL queries """
+    tape_sources = {tab.source for tab in tabulators}
+    races = [race for race in races if tape_sources.intersection(race.sources)]
+    vote_types = {tab.vote_type for tab in tabulators}
+
+    def group(location):
+        key = location_index.key(location)
+        return key if key in groups else None
+
+    tape = archive.group_tallies(races, tape_sources, vote_types, group)
+    sos = archive.group_tallies(races, sos_sources, vote_types, group)
+    for (g, seat, vote_type), votes in archive.group_tallies(races, sos_sources, vote_types, group,
+                                                             by_candidate=False, exclude=TOTAL).items():
+        key = (g, seat, TOTAL, vote_type)
+        sos[key] = sos.get(key, 0) + votes
+    # only compare races a tape of that location group reported, and totals only where a tape printed one
+    reported = {(g, seat) for g, seat, _, _ in tape}
+    order = {g: n for n, g in enumerate(groups)}, {race.seat: n for n, race in enumerate(races)}
+    rv = [Mismatch(location=g, race=seat, candidate=candidate, vote_type=vote_type, sos=sos.get(key, 0),
+                   tabulator=tape.get(key, 0))
+          for key in tape.keys() | sos.keys() for g, seat, candidate, vote_type in [key]
+          if (g, seat) in reported and (key in tape or candidate != TOTAL) and tape.get(key, 0) != sos.get(key, 0)]
+    return sorted(rv, key=lambda m: (order[0][m.location], order[1][m.race], str(m.candidate), str(m.vote_type)))
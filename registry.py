@@ -0,0 +1,135 @@
+""" Registries:
+Races, contests, precincts, tabulators, findings and Names are looked up by name in registries, which belong to a
+Registry (an election, or a county of one) rather than to the process:
+
+    with Registry('2020 fulton') as fulton:
+        report = Report(args)           # everything loaded here is only found in fulton
+    with fulton:
+        races['president']              # fulton's race
+    fulton.clear()                      # drop it, other registries are untouched
+
+ - the current Registry is a contextvar, so each thread (and asyncio task) has its own, starting with DEFAULT
+ - a registry is created on first use, by the factory of the Scoped item that stands in for it
+ - named Fields (Fields['vote_types']) that aren't in the current Registry are looked up in its parents,
+   so vocabularies registered at import (into DEFAULT) are shared
+ - each Registry interns its own Names (db.Name), so a pattern set while validating one county isn't seen by another.
+   Pattern changes are counted (epoch) by the Name's Registry and by DEFAULT: a Name can be a key of any Fields
+"""
+import threading
+from contextvars import ContextVar
+from functools import wraps
+from typing import Any, Callable, Hashable, Iterator
+
+_current = ContextVar('registry', default=None)
+_tokens = ContextVar('registry tokens', default=())     # tokens of the entered registries, innermost last
+
+
+class Registry:
+    """ the registries of one election: {key: registry}, see Scoped """
+    def __init__(self, name: str = None, parent: 'Registry' = None):
+        self.name = name
+        self.parent = parent if parent is not None else globals().get('DEFAULT')
+        self._items = {}
+        self._lock = threading.RLock()
+        self.names = {}         # {exact stripped string: Name} interned by db.Name
+        self.epoch = 0          # bumped when one of its Names changes pattern, see epochs()
+
+    def __repr__(self):
+        return f"Registry({self.name!r})"
+
+    def __enter__(self) -> 'Registry':
+        # the tokens are kept in the context, so threads and asyncio tasks entering the same Registry don't mix them
+        _tokens.set(_tokens.get() + (_current.set(self),))
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        tokens = _tokens.get()
+        _tokens.set(tokens[:-1])
+        _current.reset(tokens[-1])
+
+    @staticmethod
+    def current() -> 'Registry':
+        return _current.get() or DEFAULT
+
+    def get(self, key: Hashable, factory: Callable = None) -> Any:
+        """ :returns the registry for key, created by factory() if there isn't one yet (None without a factory) """
+        rv = self._items.get(key)
+        if rv is None and factory is not None:
+            with self._lock:
+                rv = self._items.get(key)
+                if rv is None:
+                    with self:      # a registry that registers itself (Fields(key=..)) does so here
+                        rv = self._items[key] = factory()
+        return rv
+
+    def chain(self) -> Iterator['Registry']:
+        """ self, then its parents """
+        registry = self
+        while registry is not None:
+            yield registry
+            registry = registry.parent
+
+    def epochs(self) -> int:
+        """ changes whenever the epoch of self or of a parent does """
+        return sum(registry.epoch for registry in self.chain())
+
+    def clear(self):
+        """ drop everything registered """
+        with self._lock:
+            self._items.clear()
+            self.names.clear()
+
+
+DEFAULT = Registry('default')
+
+
+class Scoped:
+    """ stands in for the registry `key` of the current Registry:  races = Scoped('races', Fields)
+        races['x'], len(races), races.search(..) use the current one, races() returns it
+    """
+    __slots__ = ['_key', '_factory']
+
+    def __init__(self, key: Hashable, factory: Callable):
+        self._key = key
+        self._factory = factory
+
+    def __call__(self, registry: Registry = None) -> Any:
+        registry = _current.get() or DEFAULT if registry is None else registry
+        rv = registry._items.get(self._key)
+        return rv if rv is not None else registry.get(self._key, self._factory)
+
+    def __getattr__(self, item):
+        return getattr(self(), item)
+
+    def __getitem__(self, item):
+        return self()[item]
+
+    def __setitem__(self, item, value):
+        self()[item] = value
+
+    def __delitem__(self, item):
+        del self()[item]
+
+    def __contains__(self, item) -> bool:
+        return item in self()
+
+    def __iter__(self):
+        return iter(self())
+
+    def __len__(self) -> int:
+        return len(self())
+
+    def __bool__(self) -> bool:
+        return bool(self())
+
+    def __repr__(self):
+        return f"Scoped({self._key!r}: {self()!r})"
+
+
+def within(method: Callable) -> Callable:
+    """ decorator: run an object's method in its registry (self.registry) """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.registry:
+            return method(self, *args, **kwargs)
+    return wrapper
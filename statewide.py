@@ -0,0 +1,212 @@
+""" Statewide validation:
+Every county directory under a root (ROOT/YEAR/COUNTY, see util.parse_path) holds its SOS xml and tabulator tapes.
+Each county is loaded and validated by a worker process, in a Registry of its own, and only its findings and tallies
+come back:  counties are independent, so the wall time is about the sum of the counties / the number of processes.
+ - counties are started largest (xml bytes) first, so one big county doesn't finish alone at the end
+ - a finding's who is prefixed with its county ('fulton/precinct:01A')
+ - tallies are {seat: {candidate: votes}} of the SOS results (all vote types) and of the tapes, summed statewide,
+   so they can be checked against the state's own totals
+ - each tape's fingerprint comes back too, a tape repeated in another county is found once every county is merged
+"""
+import json
+import logging
+import os
+import time
+from argparse import Namespace
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Iterable, NamedTuple
+from db.fingerprint import DUPLICATE, RESCAN, Fingerprint, duplicates
+from registry import Registry, within
+from race import races
+from tabulator import TOTAL
+from util import ErrorKey, LogSelf, parse_path
+from validate import Report, _location, _who, report_level
+from writers import writer_for
+
+
+class County(NamedTuple):
+    year: str
+    county: str
+    path: Path              # the directory with the county's xml and tapes
+
+    @property
+    def name(self) -> str:
+        return f"{self.year}/{self.county}"
+
+
+class Tape(NamedTuple):
+    """ a tape of a county, as a worker sends it back """
+    county: str
+    who: str                # its location (see validate._who)
+    name: str
+    id: str
+    file: str
+    column: int
+    fingerprint: Fingerprint
+
+
+class CountyResult(NamedTuple):
+    """ what a worker sends back, plain (picklable) values only """
+    county: County
+    findings: list          # [(ErrorKey, [message, ...], count), ...]
+    tallies: dict           # {'sos': {seat: {candidate: votes}}, 'tabulators': {...}}
+    tabulators: int
+    seconds: float
+    error: str = None       # the county couldn't be validated
+    tapes: list = ()        # [Tape, ...]
+
+
+def find_counties(root: Path) -> list:
+    """ :returns [County, ...] every directory under root with an xml file and a year/county path """
+    rv = {}
+    for xml_file in sorted(Path(root).expanduser().rglob('*.xml')):
+        info = parse_path(xml_file.parent)
+        if info:
+            key = (info['year'], info['county'].lower())
+            rv.setdefault(key, County(key[0], key[1], xml_file.parent))
+    return list(rv.values())
+
+
+def _size(county: County) -> int:
+    return sum(f.stat().st_size for f in county.path.glob('*.xml'))
+
+
+def _tallies(races: Iterable, sources: set) -> dict:
+    """ {seat: {candidate: votes}} of races, summed over sources (undervotes and tape totals aren't candidates) """
+    rv = {}
+    for race in races:
+        if not sources.intersection(race.sources):
+            continue
+        seat = rv.setdefault(str(race.seat), {})
+        for source in sources.intersection(race.sources):
+            for candidate, votes in race.tally_by('candidate', source=source).items():
+                if candidate is None or candidate is TOTAL:
+                    continue
+                seat[str(candidate)] = seat.get(str(candidate), 0) + votes
+    return rv
+
+
+def _plain(key: ErrorKey) -> ErrorKey:
+    """ key with str (not Name) values, to send between processes """
+    return ErrorKey(*(str(v) if isinstance(v, str) else v for v in key))
+
+
+def validate_county(county: County, args: dict) -> CountyResult:
+    """ load and validate one county (in a worker process) """
+    start = time.perf_counter()
+    args = Namespace(**dict(args, sos_results_xml=str(county.path), tabulator_dir=None, jobs=1))
+    registry = Registry(county.name)
+    try:
+        with registry:
+            report = Report(args, registry=registry)
+            report.validate()
+            errors = report._errors()
+            findings = [(_plain(key), sorted(map(str, errors[key])), errors.count(key)) for key in errors]
+            tallies = {'sos': _tallies(races.values(), {er.source for er in report.results.values()}),
+                       'tabulators': _tallies(races.values(), {tab.source for tab in report.tabulators.values()})}
+            tapes = [Tape(county.name, _who(_location(tab)), str(tab.name), str(tab.id), Path(tab._file).name,
+                          tab._column, tab.fingerprint)
+                     for tabs in report._tabulators_by_file.values() for tab in tabs]
+            return CountyResult(county, findings, tallies, len(report.tabulators), time.perf_counter() - start,
+                                tapes=tapes)
+    except Exception as e:
+        return CountyResult(county, [], {}, 0, time.perf_counter() - start, error=f"{type(e).__name__}: {e}")
+    finally:
+        registry.clear()
+
+
+class Statewide(LogSelf):
+    """ the merged findings and tallies of every county:  Statewide(args).load() then save(filename) """
+    def __init__(self, args, registry: Registry = None):
+        self.args = args
+        self.root = Path(args.sos_results_xml).expanduser().absolute()
+        self.report_level = report_level(args)
+        self.registry = Registry(f"statewide {self.root}") if registry is None else registry
+        self.counties = {}      # {county name: CountyResult without its findings or tapes}
+        self.tallies = {'sos': {}, 'tabulators': {}}
+        self._tapes = {}        # {county name: [Tape, ...]}
+
+    @property
+    def name(self) -> str:
+        return f"statewide.{self.root.name}"
+
+    @within
+    def load(self, counties: Iterable[County] = None, jobs: int = None) -> 'Statewide':
+        """ validate counties (default: every one under root) in jobs processes (0/None: one per cpu) """
+        counties = sorted(find_counties(self.root) if counties is None else counties, key=_size, reverse=True)
+        if not counties:
+            raise ValueError(f"No county directories (YEAR/COUNTY) with an xml file found in [{self.root}]")
+        jobs = jobs if jobs is not None else self.args.jobs
+        jobs = min(jobs or os.cpu_count(), len(counties))
+        args = vars(self.args)
+        if jobs > 1:
+            # a worker per county: nothing a county sets for the process (class defaults, caches) reaches the next one
+            with ProcessPoolExecutor(max_workers=jobs, max_tasks_per_child=1) as pool:
+                for future in as_completed([pool.submit(validate_county, county, args) for county in counties]):
+                    self.merge(future.result())
+        else:
+            for county in counties:
+                self.merge(validate_county(county, args))
+        self.validate_tapes()
+        return self
+
+    @within
+    def validate_tapes(self) -> list:
+        """ find tapes that repeat a tape of another county (each county reports its own, see Report.validate_tapes)
+            :returns [db.fingerprint.Duplicate, ...]
+        """
+        rv = []
+        tapes = [tape for county in sorted(self._tapes) for tape in self._tapes[county]]
+        for d in duplicates(tapes):
+            if d.item.county == d.of.county:
+                continue
+            level = logging.ERROR if d.kind in (DUPLICATE, RESCAN) else logging.WARNING
+            self.log('%s: %s <%s> (%s column %s) repeats %s <%s> (%s/%s column %s), %.0f%% of its races the same',
+                     d.kind, d.item.name, d.item.id, d.item.file, d.item.column, d.of.name, d.of.id, d.of.county,
+                     d.of.file, d.of.column, 100 * d.similarity,
+                     level=level, why=d.kind, what=d.item.name, who=f"{d.item.county}/{d.item.who}")
+            rv.append(d)
+        return rv
+
+    @within
+    def merge(self, result: CountyResult):
+        name = result.county.name
+        self.counties[name] = result._replace(findings=len(result.findings), tapes=())
+        self._tapes[name] = result.tapes
+        if result.error:
+            self.error('%s not validated: %s', name, result.error, why='county failed', who=name)
+        errors = self._errors()
+        for key, messages, count in result.findings:
+            errors.merge(ErrorKey(*key)._replace(who=f"{name}/{key.who}"), messages, count)
+        for kind, seats in result.tallies.items():
+            for seat, candidates in seats.items():
+                total = self.tallies[kind].setdefault(seat, {})
+                for candidate, votes in candidates.items():
+                    total[candidate] = total.get(candidate, 0) + votes
+        logging.info(f"{name}: {len(result.findings)} findings, {result.tabulators} tabulators "
+                     f"in {result.seconds:.1f}s")
+
+    @within
+    def iter_errors(self, report_level: int) -> Iterable[tuple]:
+        return super().iter_errors(report_level)
+
+    @within
+    def errors(self, report_level: int) -> dict:
+        return super().errors(report_level)
+
+    def save(self, filename: Path, report_level: int = None) -> int:
+        """ the findings of every county into filename (see writers), tallies into FILENAME.tallies.json
+            :returns the number of rows written
+        """
+        report_level = report_level if type(report_level) is int else self.report_level
+        filename = Path(filename).expanduser()
+        filename.parent.mkdir(mode=0o770, parents=True, exist_ok=True)
+        with writer_for(filename) as w:
+            w.write(self.name, self.iter_errors(report_level))
+        with open(filename.with_suffix('.tallies.json'), 'w') as f:
+            json.dump({'counties': {name: {'tabulators': r.tabulators, 'findings': r.findings,
+                                           'seconds': round(r.seconds, 3), 'error': r.error}
+                                    for name, r in sorted(self.counties.items())},
+                       **self.tallies}, f, indent=1)
+        return w.rows
@@ -1,61 +1,149 @@
 import re
-from typing import Iterable
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Iterable, NamedTuple
 from db import Name, Fields
 from pathlib import Path
 from db.xls import Xlsx
-from util import parse_path, pop_pattern, LogSelf
-from race import Race
+from db.file_cache import FileCache
+from db.fingerprint import Fingerprint, duplicates
+from db.groups import LocationGroups
+from registry import Scoped
+from util import parse_path, LogSelf
+from race import Race, races as all_races
 import logging
-_SPLIT_RE = re.compile(r'[- ]+')
+_DASH_RE = re.compile(r'\s*-\s*')
 Name.add('write-in', re.compile(r'write[- ]*in\b]', flags=re.IGNORECASE))
-Name.add('total', re.compile(r'total[- ]*votes\b', flags=re.IGNORECASE))
+TOTAL = Name.add('total', re.compile(r'total[- ]*votes\b', flags=re.IGNORECASE))
 log = LogSelf()
 
 
+def location_precincts(location: str) -> tuple:
+    """ the precincts of a tape's Location, without the tabulator's label:
+        'SS15A-SS15B ICP 2' -> ('SS15A', 'SS15B'), '01A - 01B' -> ('01A', '01B'), '01A' -> ('01A',)
+    """
+    words = _DASH_RE.sub('-', str(location).strip()).split(None, 1)
+    return tuple((words or [''])[0].split('-'))
+
+
+class Layout(NamedTuple):
+    """ how the rows of a tape are laid out """
+    fields: dict        # {attribute: label} of each metadata field found
+    rows: tuple         # ((label, row, name), ...) race headers and candidates, in row order
+
+
+class TapeSchema:
+    """ The metadata fields of a tape: (attribute, regex of its row label), compiled once.
+        The first label (in row order) that matches a field is that field, fields are matched in this order.
+        Every other 'ROW:NAME' label is a race header (no votes) or a candidate row.
+        All the columns of a workbook (and most workbooks) share their labels, so layouts are cached by label tuple.
+    """
+    FIELDS = (('name', r'.*\bName\b.*'),
+              ('id', r'.*\bID\b.*'),
+              ('location', r'.*\bLocation\b.*'),
+              ('total_scanned', r'.*\bTotal Scanned\b.*'),
+              ('protective_counter', r'.*\bCounter\b.*'),
+              ('county', r'.*\b(County|Region)\b.*'),
+              ('year', r'.*\byear\b.*'),
+              ('file', r'_file'),
+              ('column', r'_column'))
+    _ROW_RE = re.compile(r'(\d+):(.+)', flags=re.DOTALL)
+
+    def __init__(self, fields: Iterable[tuple] = FIELDS):
+        self.fields = tuple((attr, re.compile(pattern, flags=re.IGNORECASE)) for attr, pattern in fields)
+        self._layouts = {}
+
+    def layout(self, labels: tuple) -> Layout:
+        rv = self._layouts.get(labels)
+        if rv is None:
+            rv = self._layouts[labels] = self._classify(labels)
+        return rv
+
+    def _classify(self, labels: tuple) -> Layout:
+        fields, rows = {}, []
+        for label in labels:
+            attr = next((attr for attr, pattern in self.fields if attr not in fields and pattern.match(label)), None)
+            if attr is not None:
+                fields[attr] = label
+                continue
+            m = self._ROW_RE.fullmatch(label)
+            if m:
+                rows.append((label, int(m[1]), m[2].strip()))
+        return Layout(fields, tuple(rows))
+
+
 class Tabulator(LogSelf):
     """ A printout of tabulated results that should correspond with precinct results"""
-    _all = {}
-    _by_location = {}
+    _all = Scoped('Tabulator', dict)        # {_key: Tabulator} of the current Registry
+    schema = TapeSchema()
 
     def __init__(self, **kwargs):
         """ build a tabulator from kwargs:
          Name, ID, 'Total Scanned', Counter, _file, _column
-         Location - split into: locations=tuple( re.split[- ] )
+         Location - split into: locations=tuple of its precincts, see location_precincts()
         """
-        self.name = pop_pattern(kwargs, r'.*\bName\b.*').strip()
-        self.id = pop_pattern(kwargs, r'.*\bID\b.*')
-        self.locations = tuple(_SPLIT_RE.split(pop_pattern(kwargs, r'.*\bLocation\b.*').strip()))
-        self.total_scanned = pop_pattern(kwargs, r'.*\bTotal Scanned\b.*')
-        self.protective_counter = pop_pattern(kwargs, r'.*\bCounter\b.*')
-        self.vote_type = Fields['vote_types'].get('election day')
-        self.county = pop_pattern(kwargs, r'.*\b(County|Region)\b.*')
-        self._year = pop_pattern(kwargs, r'.*\byear\b.*')
-        self._file = pop_pattern(kwargs, r'_file')
-        self._column = pop_pattern(kwargs, r'_column')
-        self._errors = {}
-
-        # Now that all kwargs other than races have been removed, parse the races
-        #self.races = self.parse_races(kwargs)
+        layout = self.schema.layout(tuple(kwargs))
+        fields = layout.fields
+        self.name = kwargs.get(fields.get('name')).strip()
+        self.id = kwargs.get(fields.get('id'))
+        self.locations = location_precincts(kwargs.get(fields.get('location')))
+        self.total_scanned = kwargs.get(fields.get('total_scanned'))
+        self.protective_counter = kwargs.get(fields.get('protective_counter'))
+        self.vote_type = Fields['vote_types'].search('election day')[0] or 'election day'
+        self.county = kwargs.get(fields.get('county'))
+        self._year = kwargs.get(fields.get('year'))
+        self._file = kwargs.get(fields.get('file'))
+        self._column = kwargs.get(fields.get('column'))
+        self.fingerprint: Fingerprint = None     # of the votes and metadata, set by parse_races
+
+        self.parse_races(kwargs, layout=layout)
 
         cls = self.__class__
         cls._all[self._key] = self
 
     @classmethod
-    def by_location(cls, li: Iterable['Tabulator']) -> dict:
-        """ :returns { location(str): Tabulator,... for each li}"""
-
-        def _add_location(di, location, tabulator):
-            di.setdefault(location, set()).add(tabulator)
+    def location_groups(cls, li: Iterable['Tabulator']) -> LocationGroups:
+        """ :returns the precincts of li, merged into groups where tapes count overlapping precincts """
+        return LocationGroups(tab.locations for tab in li)
 
+    @classmethod
+    def by_location(cls, li: Iterable['Tabulator'], groups: LocationGroups = None) -> dict:
+        """ :returns {group key: {Tabulator, ...}} each tape is filed once, under its location group (see db.groups)
+            ex: {'01A': {tab1}, ('SS15A', 'SS15B', 'SS15C'): {tab2, tab3}} when tab2 counts SS15A-SS15B, tab3 SS15B-SS15C
+        """
+        li = list(li)
+        groups = cls.location_groups(li) if groups is None else groups
         rv = {}
         for tab in li:
-            if len(tab.locations) > 1:
-                _add_location(rv, tab.locations, tab)
-            for loc in tab.locations:
-                _add_location(rv, loc, tab)
+            rv.setdefault(groups.key(tab.locations), set()).add(tab)
         return rv
 
-    def parse_races(self, kwargs: dict):
+    @classmethod
+    def duplicates(cls, li: Iterable['Tabulator'], **kwargs) -> list:
+        """ :returns [db.fingerprint.Duplicate, ...] the tapes of li that repeat an earlier one (a rescan, a copy)
+            kwargs: see db.fingerprint.duplicates
+        """
+        return duplicates(li, **kwargs)
+
+    @classmethod
+    def retract(cls, tabulators: Iterable['Tabulator']) -> set:
+        """ forget tabulators (and their votes) before their file is loaded again
+            :returns the locations they covered (see by_location)
+        """
+        locations, sources = set(), set()
+        for tab in tabulators:
+            if cls._all.get(tab._key) is tab:
+                del cls._all[tab._key]
+            sources.add(tab.source)
+            locations.update(tab.locations)
+            if len(tab.locations) > 1:
+                locations.add(tab.locations)
+        for source in sources:
+            Race.retract(source=source)
+        return locations
+
+    def parse_races(self, kwargs: dict, layout: Layout = None):
         """ kwargs is ordered dict of races, candidates and votes from a tally tape:
         {   '4:President of the US': None,
             '5:Hodge': 123,
@@ -65,35 +153,46 @@ class Tabulator(LogSelf):
             '9:Senate Seat 1': None,
             ... }
         The number is the row from the xlsx just to ensure uniqueness
+        layout: which kwargs are rows (see TapeSchema)
         """
-        contests = Fields('contests')
         # candidates = Fields(f'{self.county}.candidates')
-        accept = re.compile(r'\d+:.+')
-        races, race_name = {}, ''
-        for colA, val in kwargs.items():
-            if not accept.fullmatch(colA):
-                continue
-            row, name = (f.strip() for f in colA.split(':', 1))
-            row = int(row)
+        layout = self.schema.layout(tuple(kwargs)) if layout is None else layout
+        race = None
+        votes = []      # (seat, candidate, count) for the fingerprint
+        for label, row, name in layout.rows:
+            val = kwargs[label]
 
-            # Names of races don't have vote counts, create and initialize the race
+            # Names of races don't have vote counts, find (or create) the race
             if val is None or val == '':
-                race_name = contests.add(key=name)
+                race = Race.add(district=self.county, seat=name, sources={self.source})
+                continue
+            if race is None:
+                self.error("Found votes before any race in %s row: %s %s = '%s'", self._file, row, name, val,
+                           category='bad field')
                 continue
 
             # everything else is a candidate: vote_count (but catch formulas)
             try:
-                Race.add_votes(seat=race_name, candidate=name, count=int(val), precinct=self.locations,
-                               source=self._file, vote_type='day')
+                race.set_votes(candidate=name, count=int(val), precinct=self.locations, source=self.source,
+                               vote_type=self.vote_type)
             except ValueError:
-                self.error(f"Found invalid vote count in {self._file} row: {row} race:{race_name} candidate:{name} = '{val}'", category='bad field')
+                self.error("Found invalid vote count in %s row: %s race:%s candidate:%s = '%s'",
+                           self._file, row, race.seat, name, val, category='bad field')
                 continue
+            votes.append((race.seat, name, int(val)))
+        self.fingerprint = Fingerprint.of(votes, meta=(self.id, self.protective_counter, self.total_scanned))
         return None
 
     @property
-    def races(self):
-        logging.WARNING(f"-----------TODO------------")
-        return {}
+    def source(self) -> tuple:
+        """ whom votes from this tape are blamed on: one column of one file """
+        return self._file, self._column
+
+    @property
+    def races(self) -> dict:
+        """ :returns {seat: {candidate: votes}} from this tape """
+        return {r.seat: r.tally_by('candidate', source=self.source)
+                for r in all_races.values() if self.source in r.sources}
 
     @property
     def _key(self):
@@ -115,7 +214,7 @@ class Tabulator(LogSelf):
         total = race.pop(Name['total votes'])
         if sum(race.values()) != total:
             self.error(f"Total Mismatch: Race[{seat}] Total[{total}] != Cast[{sum(race.values())}", category='bad total')
-        return self._errors
+        return self._errors()
 
     def _validate_races(self, level: int = logging.WARNING):
         # TODO
@@ -126,20 +225,59 @@ class Tabulator(LogSelf):
         return self._validate_races(level)
 
 
-def load_tabulators(path: Path, **kwargs) -> dict:
-    """ :returns {filename: [Tabulator1, Tabulator2, ...], ... }"""
+CACHE_KIND = 'Tabulator'       # what read_tabulator_file() is cached as
+
+
+def _read_columns(file: Path, data: bytes = None) -> list:
+    return Xlsx(filename=file, data=data).column_kwargs()
+
+
+def read_tabulator_file(file: Path, cache: FileCache = None, data: bytes = None) -> list:
+    """ :returns the Tabulator kwargs of each column in file - plain data, so it can come from a worker process
+        cache: replay the columns from a FileCache (or save them to it)
+        data: the file's bytes, if they were already read (see ingest)
+    """
+    read = _read_columns if data is None else partial(_read_columns, data=data)
+    if cache is None:
+        return read(file)
+    return cache.value(file, read, kind=CACHE_KIND)
+
+
+def load_tabulator_file(file: Path, cache: FileCache = None, columns: list = None, **kwargs) -> list:
+    """ :returns [Tabulator, ...] one per column of file
+        columns: what read_tabulator_file(file) returns, if it was already read
+    """
+    kwargs.update(parse_path(file.parent) or {})
+    columns = read_tabulator_file(file, cache=cache) if columns is None else columns
+    return [Tabulator(**kwargs, **vals) for vals in columns]
+
+
+def tabulator_files(path: Path, exclude: Iterable[Path] = ()) -> list:
+    """ :returns the sorted xlsx files in path, except exclude (ex: a report saved there) """
+    exclude = {Path(p).absolute() for p in exclude}
+    return sorted(f for f in path.glob('*.xlsx') if f.absolute() not in exclude)
+
+
+def load_tabulators(path: Path, jobs: int = 1, cache: FileCache = None, exclude: Iterable[Path] = (), **kwargs) -> dict:
+    """ :returns {filename: [Tabulator1, Tabulator2, ...], ... }
+        jobs: number of processes parsing xlsx files (0: one per cpu), Tabulators are still built here, in file order
+        cache: a FileCache of previously parsed files
+        exclude: xlsx files in path which aren't tabulator tapes
+    """
     global log
-    xlsx_files = path.glob('*.xlsx')
+    xlsx_files = tabulator_files(path, exclude=exclude)
     if not xlsx_files:
         raise ValueError(f"No xlsx files found in [{path}]")
     kwargs.update(parse_path(path) or {})
+    jobs = jobs or os.cpu_count()
+    if jobs > 1 and len(xlsx_files) > 1:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(xlsx_files))) as pool:
+            columns = list(pool.map(partial(read_tabulator_file, cache=cache), xlsx_files))
+    else:
+        columns = (read_tabulator_file(file, cache=cache) for file in xlsx_files)
     di = {}
-    for file in xlsx_files:
-        if not file.exists():
-            log.error("glob fail?", category='bad file')
-            continue
-        xlsx = Xlsx(filename=file)
-        di[file.name] = xlsx.load_columns(Tabulator, **kwargs)
+    for file, file_columns in zip(xlsx_files, columns):
+        di[file.name] = [Tabulator(**kwargs, **vals) for vals in file_columns]
     return di
 
 
@@ -155,5 +293,6 @@ def generate_report(tape_path: Path, xml_path: Path):
 """
 Notes:
  - 'SS15A-SS15B ICP 2' is missing from scans - the file is just SS15A-SS15B ICP 1 rescanned
+   (Tabulator.duplicates finds these, see db.fingerprint)
 
 """
\ No newline at end of file
@@ -1,5 +1,5 @@
 from race import Race, races
-from util import deep_tally, deep_set
+from util import deep_tally, deep_set, Diagnostics, LogSelf
 from db import Name, Fields
 import unittest
 candidates_senate = Fields(fields=['Perduped', 'Fluffler', 'Warmschlock', 'Ossofied'], key='senate')
@@ -23,6 +23,54 @@ class TestRace(unittest.TestCase):
         self.assertEqual(candidates_pres.search('Frump')[0], Race.find_candidate('Frump')[0])
         self.assertEqual(Race['EL PRESIDENTE'].district, 'd2')
 
+    def test_columnar(self):
+        votes = [('Perduped', 'sos.xml', '01A', 'day', 10), ('Perduped', 'sos.xml', '01A', 'mail', 5),
+                 ('Ossofied', 'sos.xml', '01A', 'day', 12), ('Ossofied', 'sos.xml', '01B', 'day', 7),
+                 ('Perduped', 'tape.xlsx', ('01A', '01B'), 'day', 3), ('Perduped', 'sos.xml', '01A', 'day', 11)]
+        _races = []
+        for columnar in (False, True):
+            Race.columnar = columnar
+            try:
+                race = Race.add(district=Name('d4'), seat=Name(f'columnar {columnar}'))
+            finally:
+                Race.columnar = False
+            for candidate, source, precinct, vote_type, count in votes:
+                race.set_votes(candidate=candidate, count=count, source=source, precinct=precinct, vote_type=vote_type)
+            _races.append(race)
+        nested, columnar = _races
+
+        self.assertIsNone(nested.votes)
+        self.assertEqual(35, columnar.tally('sos.xml'))
+        self.assertEqual(3, columnar.tally('tape.xlsx', precinct='01B'))        # a tape covering both precincts
+        self.assertEqual(3, nested.tally('tape.xlsx', precinct='01B'))
+        self.assertEqual({('01A', '01B'): 3}, nested.tally_by('precinct', source='tape.xlsx'))   # counted once
+        self.assertEqual(nested.tally_by('precinct'), columnar.tally_by('precinct'))
+        self.assertEqual(nested.tally_by('candidate', precinct='01B'), columnar.tally_by('candidate', precinct='01B'))
+        for kwargs in ({}, {'candidate': 'Perduped'}, {'precinct': '01A'}, {'vote_type': 'day'}):
+            self.assertEqual(nested.tally('sos.xml', **kwargs), columnar.tally('sos.xml', **kwargs))
+        for by in ('candidate', 'precinct', 'vote_type'):
+            self.assertEqual(nested.tally_by(by, source='sos.xml'), columnar.tally_by(by, source='sos.xml'))
+        self.assertEqual({'sos.xml': 35, 'tape.xlsx': 3}, columnar.tally_by('source'))
+        self.assertEqual(nested.get_precinct('sos.xml', '01A'), columnar.get_precinct('sos.xml', '01A'))
+
+    def test_tuple_precincts(self):
+        """ a tape covering two precincts and a single precinct in the same source: columnar answers like nested """
+        votes = [('Perduped', '01A', 'day', 10), ('Perduped', '01A', 'mail', 5), ('Ossofied', '01A', 'day', 12),
+                 ('Ossofied', '01B', 'day', 7), ('Perduped', ('01A', '01B'), 'day', 3)]
+        for i, order in enumerate((votes[4:] + votes[:4], votes)):
+            with self.subTest(order=order):
+                nested, columnar = [Race.add(district=Name('d5'), seat=Name(f'tuple {i} {c}'), columnar=c)
+                                    for c in (False, True)]
+                for race in (nested, columnar):
+                    for candidate, precinct, vote_type, count in order:
+                        race.set_votes(candidate=candidate, count=count, source='mixed.xlsx', precinct=precinct,
+                                       vote_type=vote_type)
+                self.assertEqual(37, columnar.tally('mixed.xlsx'))
+                for kwargs in ({}, {'precinct': '01A'}, {'precinct': '01B'}, {'precinct': ('01A', '01B')},
+                               {'candidate': 'Perduped', 'precinct': '01A'}, {'vote_type': 'mail'}):
+                    self.assertEqual(nested.tally('mixed.xlsx', **kwargs), columnar.tally('mixed.xlsx', **kwargs),
+                                     kwargs)
+
 
 class TestDicts(unittest.TestCase):
     def test_deep_set(self):
@@ -41,5 +89,73 @@ class TestDicts(unittest.TestCase):
             self.assertEqual(a[x][y][z], v)
 
 
+class Findings(LogSelf):
+    pass
+
+
+class TestDiagnostics(unittest.TestCase):
+    def tearDown(self):
+        LogSelf.set_level(0)
+        Findings._errors.clear()
+
+    def test_bounded(self):
+        log = Findings()
+        Findings._errors().samples = 3
+        try:
+            for n in range(100):
+                log.error('mismatch %d', n, why='vote mismatch', what='President', who='precinct:01A')
+            log.error('mismatch', why='vote mismatch', what='President', who='precinct:01B')
+            log.info('missing %s', '01C', why='missing tabulator(s)', who='precinct:01C')
+        finally:
+            del Findings._errors().samples
+        errors = Findings.errors(LogSelf.ERROR)
+        self.assertEqual(2, len(errors))
+        self.assertEqual(4, len(errors[next(k for k in errors if k.who == 'precinct:01A')]))
+        self.assertIn('... and 97 more', errors[next(k for k in errors if k.who == 'precinct:01A')])
+
+        error, info = Findings.diagnostics()
+        self.assertEqual((LogSelf.ERROR, 'vote mismatch', 'President', 101), error[:4])
+        self.assertEqual(3, len(error.samples))     # 3 kept for the bucket, all of 01A
+        self.assertIn('... and 1 more', errors[next(k for k in errors if k.who == 'precinct:01B')])
+        self.assertEqual(2, len(Findings._errors.query(samples=2)[0].samples))
+        self.assertEqual(('missing 01C',), info.samples)
+        self.assertEqual([], Findings.diagnostics(why='bad field'))
+        self.assertEqual(101, Findings._errors.total(level=LogSelf.ERROR))
+
+        Findings.retract(['precinct:01A'])
+        self.assertEqual([(LogSelf.ERROR, 1)], [(b.level, b.count) for b in Findings.diagnostics(LogSelf.WARN)])
+
+    def test_many_keys(self):
+        """ findings of one bucket in many places keep a counter each, and samples messages in all """
+        log = Findings()
+        for n in range(1000):
+            log.error('mismatch %d', n, why='vote mismatch', what='President', who=f'precinct:{n}')
+        errors = Findings._errors()
+        self.assertEqual(1000, len(errors))
+        self.assertEqual(errors.samples, sum(len(messages) for messages in dict.values(errors)))
+        self.assertEqual([1000], [b.count for b in Findings.diagnostics()])
+        Findings.retract([f'precinct:{n}' for n in range(500)])
+        self.assertEqual(500, Findings._errors.total())
+        log.error('again', why='vote mismatch', what='President', who='precinct:again')
+        self.assertLessEqual(sum(len(messages) for messages in dict.values(errors)), errors.samples)
+
+    def test_level(self):
+        class Lazy:
+            def __str__(self):
+                raise AssertionError('formatted a finding that is not recorded')
+        LogSelf.set_level(LogSelf.WARN)
+        Findings().info('not kept %s', Lazy(), why='noise')
+        self.assertEqual(0, Findings._errors.total())
+        self.assertIsInstance(Findings._errors(), Diagnostics)
+
+    def test_custom_level(self):
+        """ a level other than ERROR, WARN, INFO, DEBUG is recorded and logged at that level """
+        LogSelf.set_level(0)
+        with self.assertLogs(level=25) as logs:
+            Findings().log('notice %s', '01A', level=25, why='custom')
+        self.assertEqual(['Level 25:root:notice 01A'], logs.output)
+        self.assertEqual([(25, 1)], [(b.level, b.count) for b in Findings.diagnostics(why='custom')])
+
+
 if __name__ == '__main__':
     unittest.main()
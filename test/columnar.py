@@ -0,0 +1,72 @@
+import os
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from ga.columnar import ColumnarResult, ElectionColumns, convert, newer
+from ga.contest import ElectionResult
+from race import races
+from registry import Registry
+import unittest
+DETAIL_XML = Path(__file__).parent.joinpath('data', 'detail.xml')
+
+
+def summary(er: ElectionResult) -> dict:
+    """ what validation reads of an ElectionResult, as plain values """
+    rv = {'precincts': sorted((str(p.name), p.totalVoters, p.ballotsCast) for p in er._precincts.values())}
+    for c in er.contests():
+        race = races[c.name]
+        rv[str(c.name)] = (sorted((str(k), v) for k, v in c.totals.items()),
+                           sorted((str(k), str(v), n) for (k, v), n in c.vote_totals.items()),
+                           sorted((str(k), v) for k, v in race.tally_by('candidate', source=er.source).items()),
+                           sorted((str(k), v) for k, v in race.tally_by('precinct', source=er.source).items()),
+                           race.tally(source=er.source, precinct='01A', vote_type='day_of'))
+    return rv
+
+
+class TestColumnar(unittest.TestCase):
+    def test_convert(self):
+        with TemporaryDirectory() as tmp:
+            filename = convert(DETAIL_XML, output=Path(tmp, 'detail.gacol'))
+            with Registry('xml') as xml:
+                expected = ElectionResult.load_from_xml(DETAIL_XML, lazy=False)
+                expected = (expected.ElectionName, expected.ElectionDate, expected.Region, summary(expected))
+            with Registry('columnar') as columnar:
+                er = ColumnarResult.load(filename, source=DETAIL_XML)
+                self.assertEqual(len(er.contest_names), len(er._pending), 'contests are built when asked for')
+                self.assertEqual(expected, (er.ElectionName, er.ElectionDate, er.Region, summary(er)))
+                er.retract()
+                self.assertEqual(0, sum(race.tally(source=DETAIL_XML) for race in races.values()))
+                er.columns.close()
+            xml.clear()
+            columnar.clear()
+
+    def test_columns(self):
+        with TemporaryDirectory() as tmp:
+            columns = ElectionColumns(convert(DETAIL_XML, output=Path(tmp, 'detail.gacol')))
+            self.assertFalse(columns['vote_count'].flags.writeable, 'a view of the mapping')
+            self.assertEqual(len(columns), len(columns['contest_votes']) - 1)
+            self.assertIn('01A', [columns.precincts[i] for i in range(len(columns.precincts))])
+            columns.close()
+            with open(Path(tmp, 'not.gacol'), 'wb') as f:
+                f.write(b'<xml>' + bytes(64))
+            self.assertRaises(ValueError, ElectionColumns, Path(tmp, 'not.gacol'))
+
+    def test_newer(self):
+        with TemporaryDirectory() as tmp:
+            xml_file = Path(tmp, 'detail.xml')
+            xml_file.write_bytes(DETAIL_XML.read_bytes())
+            self.assertIsNone(newer(xml_file))
+            columnar = convert(xml_file)
+            self.assertEqual(columnar, newer(xml_file))
+            os.utime(xml_file)
+            self.assertEqual(columnar, newer(xml_file), 'a touched xml has the same digest')
+            xml_file.write_bytes(DETAIL_XML.read_bytes().replace(b'01A', b'01Z'))
+            os.utime(xml_file, ns=(0, 0))
+            self.assertIsNone(newer(xml_file), 'an older xml of the same size, but another content')
+            xml_file.write_bytes(b'<xml/>')
+            self.assertIsNone(newer(xml_file))
+            columnar.write_bytes(b'<xml>' + bytes(64))
+            self.assertIsNone(newer(xml_file), 'not a columnar file')
+
+
+if __name__ == '__main__':
+    unittest.main()
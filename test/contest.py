@@ -0,0 +1,113 @@
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from db.file_cache import FileCache
+from ga import RawElement, raw_dict, stream_xml
+from ga.contest import Contest, ElectionResult
+from db import Fields, Name
+from race import Race, races
+from registry import Registry
+from util import longest
+import unittest
+DETAIL_XML = Path(__file__).parent.joinpath('data', 'detail.xml')
+
+
+class TestElectionResult(unittest.TestCase):
+    @unittest.skipUnless(__import__('importlib').util.find_spec('xmltodict'), 'xmltodict is not installed')
+    def test_stream_xml(self):
+        from xmltodict import parse as xml_parse
+        with open(DETAIL_XML, 'rb') as f:
+            expected = xml_parse(f)['ElectionResult']
+        streamed = stream_xml(DETAIL_XML, stream_tag='Contest')
+        streamed['Contest'] = list(streamed['Contest'])
+        self.assertEqual(expected, streamed)
+
+    def test_load_from_xml(self):
+        er = ElectionResult.load_from_xml(DETAIL_XML)
+        self.assertEqual('Fulton', er.Region)
+        self.assertEqual(130, er.precinct('01B').ballotsCast)
+        race = Race['President of the United States']
+        self.assertEqual(73, race.tally(source=DETAIL_XML, precinct='01B', candidate='Joseph R. Biden'))
+        self.assertEqual(90, race.tally(source=DETAIL_XML, candidate='Donald J. Trump (I) (Rep)'))
+
+    def test_raw(self):
+        streamed = stream_xml(DETAIL_XML, stream_tag='Contest')
+        raw = stream_xml(DETAIL_XML, stream_tag='Contest', raw=True)
+        contests = list(raw.pop('Contest'))
+        self.assertEqual([c['@text'] for c in streamed.pop('Contest')], [c.attrib['text'] for c in contests])
+        self.assertEqual(streamed, raw)
+        self.assertEqual(stream_xml(DETAIL_XML, stream_tag='Contest')['Contest'].__next__(), raw_dict(contests[0]))
+
+    def test_lazy(self):
+        president, biden = 'President of the United States', 'Joseph R. Biden'
+        with Registry('lazy'):
+            er = ElectionResult.load_from_xml(DETAIL_XML, lazy=True)
+            self.assertEqual(130, er.precinct('01B').ballotsCast)
+            self.assertIn(president, er.contest_names)
+            self.assertEqual(0, len(races), 'nothing is built until it is asked for')
+            self.assertEqual(biden, er.contest(president).candidates.search(biden)[0])
+            self.assertEqual([president], [str(r.seat) for r in races.values()])
+            self.assertEqual(73, Race[president].tally(source=DETAIL_XML, precinct='01B', candidate=biden))
+            contests = er.contests()
+            self.assertEqual(len(er.contest_names), len(contests))
+            self.assertTrue(all(isinstance(c, Contest) for c in contests))
+            self.assertEqual(len(contests), len(races))
+            with self.assertRaises(KeyError):
+                er.contest('not a contest')
+
+    def test_lazy_cache(self):
+        """ a lazy load keeps its contests as xml, even with a cache of them parsed """
+        with TemporaryDirectory() as tmp, Registry('lazy cache') as registry:
+            cache = FileCache(tmp)
+            expected = len(ElectionResult.load_from_xml(DETAIL_XML, cache=cache, lazy=False).contests())
+            registry.clear()
+            er = ElectionResult.load_from_xml(DETAIL_XML, cache=cache, lazy=True)
+            self.assertEqual((0, 1), (cache.hits, cache.misses))
+            self.assertEqual(0, len(races))
+            self.assertTrue(all(isinstance(c, RawElement) for c in dict.values(er._pending)))
+            self.assertEqual(expected, len(er.contests()))
+        registry.clear()
+
+
+class TestCandidateIndex(unittest.TestCase):
+    @staticmethod
+    def scan_races(candidate: str):
+        """ Race.find_candidate searching every race """
+        found = Fields()
+        for r in races.values():
+            name = r.candidates.search(candidate)[0]
+            if name:
+                found[name] = r.seat
+        return found.search(candidate, best_match=True)
+
+    @staticmethod
+    def scan_contests(candidate: str):
+        """ Contest.candidate searching every contest """
+        found = {}
+        for c in Contest._all.values():
+            name = c.candidates.search(candidate, best_match=True)[0]
+            if name:
+                found[name] = c
+        return longest(found), found
+
+    def test_same_as_scan(self):
+        with Registry('candidate index') as registry:
+            ElectionResult.load_from_xml(DETAIL_XML, lazy=False)
+            names = {str(name) for r in races.values() for name in r.candidates if isinstance(name, str)}
+            queries = names | {n.split()[-1] for n in names} | {n.upper() for n in names} | {'nobody at all', 'Yes'}
+            for query in sorted(queries):
+                with self.subTest(query=query):
+                    self.assertEqual(self.scan_races(query), Race.find_candidate(query))
+                    self.assertEqual(self.scan_contests(query), Contest.candidate(query))
+
+            seat = Name('Dog Catcher Of Nowhere')
+            race = Race.add(district=Name('nowhere'), seat=seat, candidates=Fields(['Rex Barkington']))
+            self.assertEqual(seat, Race.find_candidate('Rex Barkington Jr').value)      # new races are indexed
+            race.candidates.add('Fido Wagsworth')
+            self.assertEqual(seat, Race.find_candidate('Fido Wagsworth').value)         # so are new candidates
+            del races[seat]
+            self.assertFalse(Race.find_candidate('Rex Barkington Jr'))                  # and removed races dropped
+        registry.clear()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from ga.columnar import convert
+from ga.contest import ElectionResult
+from ga.diff import diff, load
+from registry import Registry
+import unittest
+DETAIL_XML = Path(__file__).parent.joinpath('data', 'detail.xml')
+PRESIDENT = 'President of the United States'
+
+
+def republish(filename: Path) -> Path:
+    """ a later snapshot of detail.xml: one more vote for Biden on election day in 01B, 01B's turnout updated """
+    xml = DETAIL_XML.read_text()
+    head, sep, tail = xml.partition('<Choice key="2" text="Joseph R. Biden"')
+    vote_type, sep2, rest = tail.partition('<Precinct name="01B" votes="')
+    votes, quote, rest = rest.partition('"')
+    xml = head + sep + vote_type + sep2 + str(int(votes) + 1) + quote + rest
+    xml = xml.replace('11/20/2020 3:52:47 PM', '11/21/2020 9:00:00 AM')
+    xml = xml.replace('totalVoters="200" ballotsCast="130"', 'totalVoters="200" ballotsCast="131"')
+    filename.write_text(xml)
+    return filename
+
+
+class TestDiff(unittest.TestCase):
+    def test_diff(self):
+        with TemporaryDirectory() as tmp:
+            new_xml = republish(Path(tmp, 'detail-2.xml'))
+            old, new = load(DETAIL_XML), load(new_xml)
+            rv = diff(old, new)
+            self.assertEqual(1, rv.unchanged)
+            self.assertLess(rv.old, rv.new)
+            self.assertEqual({'01B': {'ballotsCast': (130, 131)}}, rv.turnout)
+            changes = list(rv.changes())
+            self.assertEqual(2, len(changes))
+            count = changes[1]
+            self.assertEqual((PRESIDENT, '01B', 'Joseph R. Biden', 'day_of'), count[:4])
+            self.assertEqual(count.old + 1, count.new)
+            self.assertEqual(len(old.contest_names), len(old._pending), "contests aren't built")
+            self.assertFalse(diff(old, load(DETAIL_XML)), 'the same file')
+
+            for loaded in ([(ElectionResult.load_from_xml, {'lazy': False})] * 2,
+                           [(load, {}), (lambda f: load(convert(f, output=Path(tmp, f"{f.stem}.gacol"))), {})]):
+                with self.subTest(loaded=loaded):
+                    snapshots = []
+                    for filename, (loader, kwargs) in zip((DETAIL_XML, new_xml), loaded):
+                        with Registry(f'diff {filename}'):
+                            snapshots.append(loader(filename, **kwargs))
+                    self.assertEqual(changes, list(diff(*snapshots).changes()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,4 @@
-from db import Name, Fields
+from db import Name, Fields, SearchResult, NOT_FOUND
 import unittest
 
 
@@ -59,8 +59,67 @@ class TestFields(unittest.TestCase):
         self.assertRaises(KeyError, f.__getitem__, 'cheat21')    # getitem throws
 
 
+    def test_index(self):
+        def scan(f, key, best_match=True):
+            # the search Fields did before it was indexed
+            best = NOT_FOUND
+            for k, v in f.items():
+                if k == key.strip():
+                    if len(k) > len(best[0]):
+                        best = SearchResult(k, v)
+                    if not best_match:
+                        break
+            return best
+
+        f = Fields(key=None)
+        for n in range(200):
+            f.add(Name(f'Precinct {n:03d} Ward'), value=n)
+        f.add(Name('total', pattern=r'total[- ]*votes\b'), value='total')
+        f.add(Name('exact only', pattern=None), value='exact')
+        f.add(Name('U.S. Senate'), value='senate')
+        del f['Precinct 007 Ward']
+        f.pop('Precinct 008 Ward')
+
+        queries = ['precinct 005 ward', ' PRECINCT 100 WARD ', 'ward 005', 'Precinct 007 Ward', 'precinct 008 ward',
+                   'Total Votes', 'total-votes', 'exact only', 'EXACT ONLY', 'U S Senate', 'u.s. senate runoff']
+        for q in queries:
+            for best_match in (True, False):
+                self.assertEqual(scan(f, q, best_match), f.search(q, best_match=best_match))
+        self.assertEqual(5, f['precinct 005 ward'])
+        self.assertNotIn('precinct 007 ward', f)
+
+    def test_cache(self):
+        f = Fields(key=None, fields=['Election Day Votes', 'Total Votes', 'Absentee'], cache_size=2)
+        hits, misses = f.cache_info()[:2]
+        self.assertEqual('Total Votes', f.search('total votes')[0])
+        self.assertEqual('Total Votes', f.search(' total votes ')[0])
+        self.assertEqual((hits + 1, misses + 1), f.cache_info()[:2])
+
+        f.search('absentee')
+        f.search('day')
+        self.assertEqual(1, f.cache_info().evictions)                    # bounded by cache_size
+        self.assertEqual(2, f.cache_info().currsize)
+
+        self.assertFalse(f.search('provisional'))
+        f.add('Provisional')                                             # changes invalidate
+        self.assertEqual(0, f.cache_info().currsize)
+        self.assertEqual('Provisional', f.search('provisional')[0])
+
+
 class TestName(unittest.TestCase):
-    pass
+    def test_intern(self):
+        a = Name(' Interned Name ')
+        self.assertIs(a, Name('Interned Name'))
+        self.assertEqual(Name.DEFAULT, a._pattern)                      # not compiled until it's needed
+        self.assertEqual(a, 'the interned name here')
+        self.assertEqual(r'.*\bInterned Name\b.*', a._pattern.pattern)
+
+        custom = Name('Interned Custom', pattern=r'custom.*')
+        self.assertIs(custom, Name('Interned Custom'))                  # no pattern: keep the existing one
+        self.assertEqual(r'custom.*', custom._pattern.pattern)
+        self.assertIs(custom, Name.add('Interned Custom'))
+        self.assertIs(custom, Name.add('Custom Thing'))                 # fuzzy
+        self.assertEqual(Name('Smith (Rep'), 'Jo Smith (Rep')               # unbalanced regex matches literally
 
 
 if __name__ == '__main__':
@@ -0,0 +1,95 @@
+import gzip
+import pickle
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from db.file_cache import FileCache
+import unittest
+
+
+class TestFileCache(unittest.TestCase):
+    def test_value(self):
+        calls = []
+
+        def parse(path: Path):
+            calls.append(path)
+            return path.read_text().split()
+
+        with TemporaryDirectory() as tmp:
+            source = Path(tmp).joinpath('source.txt')
+            source.write_text('a b c')
+            cache = FileCache(Path(tmp).joinpath('cache'))
+            self.assertEqual(['a', 'b', 'c'], cache.value(source, parse, kind='words'))
+            self.assertEqual(['a', 'b', 'c'], cache.value(source, parse, kind='words'))
+            self.assertEqual((1, 1, 1), (len(calls), cache.hits, cache.misses))
+
+            source.write_text('a b c d')                                        # changed content
+            self.assertEqual(['a', 'b', 'c', 'd'], cache.value(source, parse, kind='words'))
+            self.assertEqual(2, len(calls))
+
+            rebuild = FileCache(Path(tmp).joinpath('cache'), rebuild=True)
+            rebuild.value(source, parse, kind='words')
+            self.assertEqual(3, len(calls))
+
+    def test_stream_dict(self):
+        def parse(path: Path):
+            return {'header': path.name, 'rows': iter(path.read_text().splitlines())}
+
+        with TemporaryDirectory() as tmp:
+            source = Path(tmp).joinpath('source.txt')
+            source.write_text('1\n2\n3')
+            cache = FileCache(Path(tmp).joinpath('cache'))
+            parsed = cache.stream_dict(source, parse, stream_key='rows', kind='rows')
+            self.assertEqual(['1', '2', '3'], list(parsed['rows']))
+            cached = cache.stream_dict(source, parse, stream_key='rows', kind='rows')
+            self.assertEqual(1, cache.hits)
+            self.assertEqual('source.txt', cached['header'])
+            self.assertEqual(['1', '2', '3'], list(cached['rows']))
+
+    def test_unreadable(self):
+        """ a cache file that doesn't unpickle (or isn't a header) is a miss """
+        with TemporaryDirectory() as tmp:
+            source = Path(tmp).joinpath('source.txt')
+            source.write_text('a b')
+            cache = FileCache(Path(tmp).joinpath('cache'))
+            cache.value(source, lambda path: path.read_text().split(), kind='words')
+            for data in (b'cnot_a_module\nthing\n.', b'\x80\x05]\x94.', b'not a pickle'):
+                with self.subTest(data=data):
+                    with gzip.open(cache._cache_file(source, 'words'), 'wb') as f:
+                        f.write(data)
+                    self.assertFalse(cache.has(source, 'words'))
+                    self.assertEqual(['a', 'b'], cache.value(source, lambda path: path.read_text().split(),
+                                                             kind='words'))
+                    self.assertTrue(cache.has(source, 'words'))
+
+    def test_damaged(self):
+        """ a cache file cut short or damaged in the middle is a miss, even once its records are being replayed """
+        def parse(path: Path):
+            return {'header': path.name, 'rows': iter(path.read_text().splitlines())}
+
+        with TemporaryDirectory() as tmp:
+            source = Path(tmp).joinpath('source.txt')
+            source.write_text('\n'.join(map(str, range(5000))))
+            expected = source.read_text().splitlines()
+            cache = FileCache(Path(tmp).joinpath('cache'))
+            self.assertEqual(expected, list(cache.stream_dict(source, parse, stream_key='rows', kind='rows')['rows']))
+            cache_file = cache._cache_file(source, 'rows')
+            whole = gzip.decompress(cache_file.read_bytes())
+            middle = whole.index(pickle.dumps('2500', protocol=pickle.HIGHEST_PROTOCOL)[2:])
+            for damaged in (whole[:len(whole) // 2], whole[:middle] + b'garbage' + whole[middle + 7:]):
+                with self.subTest(size=len(damaged)):
+                    cache_file.write_bytes(gzip.compress(damaged))
+                    misses = cache.misses
+                    self.assertEqual(expected, list(cache.stream_dict(source, parse, stream_key='rows', kind='rows')['rows']))
+                    self.assertEqual(misses + 1, cache.misses)
+                    self.assertTrue(cache.has(source, 'rows'), 'written again')
+                    self.assertEqual(expected, list(cache.stream_dict(source, parse, stream_key='rows', kind='rows')['rows']))
+
+            cache.value(source, lambda path: path.read_text().split(), kind='words')
+            with gzip.open(cache._cache_file(source, 'words'), 'rb') as f:
+                header = pickle.load(f)
+            cache._cache_file(source, 'words').write_bytes(gzip.compress(pickle.dumps(header)))     # no records
+            self.assertEqual(expected, cache.value(source, lambda path: path.read_text().split(), kind='words'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+from argparse import ArgumentParser
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from db.file_cache import FileCache
+from ga.synthetic import generate
+from ingest import Pipeline
+from registry import Registry
+from validate import Report
+import unittest
+
+
+def report(path: str, *args) -> tuple:
+    """ :returns (tabulators, findings) of validating path """
+    ap = ArgumentParser()
+    Report.get_args(ap)
+    with Registry(f"ingest {args}") as registry:
+        r = Report(ap.parse_args(['-x', path, '--no-cache', *args]))
+        rv = (sorted(str(k) for k in r.tabulators), sorted((k.who, k.what, k.why) for k, _ in r.validate()))
+    registry.clear()
+    return rv
+
+
+class TestIngest(unittest.TestCase):
+    def test_pipeline(self):
+        """ the same tapes and findings as loading one file after the other """
+        with TemporaryDirectory() as tmp:
+            manifest = generate(Path(tmp), precincts=20, contests=4, statewide=1, errors=0.3, seed=5, region='Ingest')
+            expected = report(manifest['path'])
+            self.assertTrue(expected[1])
+            for args in (['--executor', 'thread', '-j', '3'], ['--executor', 'process', '-j', '2', '--queue_size', '1']):
+                with self.subTest(args=args):
+                    self.assertEqual(expected, report(manifest['path'], '--pipeline', *args))
+
+    def test_order(self):
+        """ files are built in order, at most window of them in flight, a failed file raises in its turn """
+        with TemporaryDirectory() as tmp:
+            files = []
+            for n in range(30):
+                files.append(('yml', Path(tmp, f"{n}.yml")))
+                files[-1][1].write_text(f"n{n}: [{n}]")
+            built = []
+            pipeline = Pipeline(executor='thread', workers=3, readers=2, queue_size=1, cache=FileCache(tmp))
+            self.assertEqual(30, pipeline.run(files, lambda kind, file, data: built.append(data)))
+            self.assertEqual([{f"n{n}": [n]} for n in range(30)], built)
+
+            built.clear()
+            self.assertRaises(FileNotFoundError, pipeline.run, files[:5] + [('yml', Path(tmp, 'missing.yml'))] + files,
+                              lambda kind, file, data: built.append(data))
+            self.assertEqual(5, len(built))
+            self.assertRaises(ValueError, Pipeline, executor='gpu')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import json
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from db import Fields, Name
+from db.cache import SearchCache
+from ga.contest import ElectionResult
+from profiling import Profiler
+from registry import Registry
+import util
+import unittest
+DETAIL_XML = Path(__file__).parent.joinpath('data', 'detail.xml')
+
+
+class TestProfiler(unittest.TestCase):
+    def test_stages(self):
+        originals = Fields.search, Fields._candidates, SearchCache.get, Name.__eq__, util.deep_set, util.deep_tally
+        with Registry('profile') as registry, Profiler() as profiler:
+            with profiler.stage('xml') as counts:
+                er = ElectionResult.load_from_xml(DETAIL_XML, lazy=False)
+                counts['contests'] = len(er._contests)
+            with profiler.stage('search'):
+                Name('vote', pattern=r'(?i)votes?') == 'Votes'
+                Fields['vote_types'].search('Election Day Votes')
+        registry.clear()
+        self.assertEqual(originals, (Fields.search, Fields._candidates, SearchCache.get, Name.__eq__, util.deep_set,
+                                     util.deep_tally), 'the hot paths are restored')
+
+        xml, search = profiler.stages
+        self.assertEqual(('xml', 'search'), (xml['stage'], search['stage']))
+        self.assertGreater(xml['contests'], 0)
+        self.assertGreater(xml['deep_set'], 0)
+        self.assertGreater(xml['peak_mb'], 0)
+        self.assertGreaterEqual(search['name_regex'], 1)
+        self.assertGreaterEqual(search['fields_search'], 1)
+        self.assertNotIn('deep_set', search)
+        self.assertEqual(xml['deep_set'], profiler.totals()['deep_set'])
+        self.assertIn('total', profiler.summary())
+        with TemporaryDirectory() as tmp:
+            profiler.save(Path(tmp, 'profile.json'), xml=str(DETAIL_XML))
+            with open(Path(tmp, 'profile.json')) as f:
+                saved = json.load(f)
+        self.assertEqual(str(DETAIL_XML), saved['xml'])
+        self.assertEqual(['xml', 'search'], [s['stage'] for s in saved['stages']])
+
+    def test_uncounted(self):
+        profiler = Profiler(memory=False, count=False)
+        with profiler, profiler.stage('nothing'):
+            Fields['vote_types'].search('Election Day Votes')
+        self.assertEqual([{'stage': 'nothing'}], [{'stage': s['stage'], **{k: v for k, v in s.items()
+                                                   if k not in ('stage', 'wall_s', 'cpu_s')}} for s in profiler.stages])
+
+
+if __name__ == '__main__':
+    unittest.main()
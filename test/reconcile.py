@@ -0,0 +1,74 @@
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from db.groups import LocationGroups
+from db.sql import Archive
+from ga.contest import ElectionResult
+from race import Race, races
+from reconcile import reconcile, Mismatch
+from tabulator import load_tabulators
+from test.tabulator import write_tape
+import unittest
+DETAIL_XML = Path(__file__).parent.joinpath('data', 'detail.xml')
+PRESIDENT, SENATE = 'President of the United States', 'US Senate (Perdue)'
+TRUMP, BIDEN = 'Donald J. Trump (I) (Rep)', 'Joseph R. Biden'
+
+
+def tape(name: str, location: str) -> dict:
+    return {'Name': name, 'Tabulator ID': name, 'Voting Location': location, 'Protective Counter': 1,
+            'Total Scanned': 1}
+
+
+class TestReconcile(unittest.TestCase):
+    STORES = ({'columnar': False}, {'columnar': True}, {'columnar': False, 'sqlite': True})
+
+    def reconcile(self, columnar: bool, tapes: list = None, votes: dict = None, sqlite: bool = False) -> list:
+        Race.columnar = columnar
+        Race.store = Archive().votes if sqlite else None
+        races.clear()
+        try:
+            with TemporaryDirectory() as tmp:
+                er = ElectionResult.load_from_xml(DETAIL_XML)
+                # 01A matches, 01B is on 2 tabulators, which lost one vote for Biden
+                write_tape(Path(tmp, 'tape.xlsx'),
+                           tapes or [tape('Rec A', '01A'), tape('Rec B.1', '01B'), tape('Rec B.2', '01B')],
+                           votes or {PRESIDENT: {TRUMP: [15, 10, 15], BIDEN: [20, 20, 19], 'Total Votes': [35, 30, 35]},
+                                     SENATE: {'David A. Perdue (I) (Rep)': [15, 25, 0], 'Jon Ossoff': [20, 40, 0]}})
+                self.assertEqual(columnar or sqlite, Race[PRESIDENT].votes is not None)
+                tabs = [t for tabs in load_tabulators(Path(tmp)).values() for t in tabs]
+                return reconcile(tabs, sos_sources=[er.source])
+        finally:
+            Race.columnar = False
+            Race.store = None
+
+    def test_reconcile(self):
+        for store in self.STORES:
+            with self.subTest(**store):
+                mismatches = self.reconcile(**store)
+                self.assertEqual([('01B', PRESIDENT, BIDEN, 40, 39)],
+                                 [(m.location, m.race, m.candidate, m.sos, m.tabulator) for m in mismatches])
+                self.assertIsInstance(mismatches[0], Mismatch)
+                self.assertEqual(-1, mismatches[0].diff)
+
+    def test_overlapping_locations(self):
+        """ 01A has a tape of its own, and shares one with 01B: both precincts are compared as one group """
+        for store in self.STORES:
+            with self.subTest(**store):
+                mismatches = self.reconcile(tapes=[tape('Rec A', '01A'), tape('Rec AB', '01A-01B')],
+                                            votes={PRESIDENT: {TRUMP: [5, 35], BIDEN: [20, 39]}}, **store)
+                self.assertEqual([(('01A', '01B'), PRESIDENT, BIDEN, 60, 59)],
+                                 [(m.location, m.race, m.candidate, m.sos, m.tabulator) for m in mismatches])
+
+    def test_location_groups(self):
+        groups = LocationGroups(['01A', ('01B', '01C'), '01D', ('01C', '01E')])
+        self.assertEqual({'01A': ('01A',), '01D': ('01D',), ('01B', '01C', '01E'): ('01B', '01C', '01E')},
+                         {key: tuple(sorted(members)) for key, members in groups.groups().items()})
+        self.assertEqual(('01B', '01C', '01E'), groups.key('01E'))
+        self.assertEqual(('01B', '01C', '01E'), groups.key(('01C', '01E')))
+        self.assertEqual('01A', groups.key('01A'))
+        self.assertIsNone(groups.key('01F'))
+        self.assertNotIn('01F', groups)
+        self.assertEqual(5, len(groups))
+
+
+if __name__ == '__main__':
+    unittest.main()
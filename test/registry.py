@@ -0,0 +1,133 @@
+import asyncio
+from pathlib import Path
+from threading import Thread
+from ga.contest import Contest, ElectionResult
+from db import Fields, Name
+from race import races
+from registry import DEFAULT, Registry
+from tabulator import Tabulator
+from util import LogSelf
+import unittest
+DETAIL_XML = Path(__file__).parent.joinpath('data', 'detail.xml')
+PRESIDENT = 'President of the United States'
+
+
+class TestRegistry(unittest.TestCase):
+    def test_scoped(self):
+        a, b = Registry('a'), Registry('b')
+        with a:
+            er = ElectionResult.load_from_xml(DETAIL_XML)
+            n_races = len(races)
+            self.assertIn(PRESIDENT, races)
+            self.assertIs(er._contests[PRESIDENT], Contest._all[PRESIDENT])
+            Name.add('only in a')
+        with b:
+            self.assertEqual(0, len(races))
+            self.assertNotIn(PRESIDENT, Contest._all)
+            self.assertFalse(Name.search('only in a'))
+            self.assertIsNotNone(Fields['vote_types'], 'vocabularies registered at import are shared')
+        with a:
+            self.assertEqual(n_races, len(races))
+            er.retract()
+            self.assertNotIn(PRESIDENT, Contest._all)
+        a.clear()
+        with a:
+            self.assertEqual(0, len(races))
+
+    def test_names(self):
+        """ a pattern set in one Registry doesn't change the Name of another, or of a parent """
+        shared = Name('registry shared name')
+        a, b = Registry('names a'), Registry('names b')
+        with a:
+            self.assertIs(shared, Name('registry shared name'))
+            pattern = Name('registry shared name', r'.*\bshared\b.*')
+            self.assertIsNot(shared, pattern)
+            self.assertEqual(pattern, 'shared')
+            self.assertIs(pattern, Name('registry shared name'))
+            epoch = DEFAULT.epoch
+            pattern.set_pattern(r'.*\bname\b.*')
+            self.assertEqual((1, epoch + 1), (a.epoch, DEFAULT.epoch))
+        with b:
+            self.assertIs(shared, Name('registry shared name'))
+            self.assertNotEqual(Name('registry shared name'), 'shared')
+        self.assertNotEqual(shared, 'shared')
+        a.clear()
+        b.clear()
+
+    def test_foreign_name(self):
+        """ a Fields of DEFAULT finds a Name of a county by its new pattern """
+        shared = Fields({'registry alpha': 1})
+        county = Registry('foreign name')
+        with county:
+            gamma = Name('Gamma Ray')
+        shared[gamma] = 2
+        self.assertFalse(shared.search('delta'))
+        with county:
+            gamma.set_pattern(r'.*\b(gamma|delta)\b.*')
+        self.assertEqual((gamma, 2), tuple(shared.search('delta')))
+        self.assertEqual([gamma], [k for k in shared if k == 'delta'])
+        county.clear()
+
+    def test_findings(self):
+        """ findings of an ElectionResult are those of its class, in its Registry """
+        with Registry('findings') as registry:
+            er = ElectionResult.load_from_xml(DETAIL_XML)
+            er.log('a finding', why='registry test', level=LogSelf.ERROR)
+            self.assertIn('registry test', {k.why for k in ElectionResult.errors(LogSelf.ERROR)})
+        self.assertNotIn('registry test', {k.why for k in ElectionResult.errors(LogSelf.ERROR)})
+        registry.clear()
+
+    def test_tasks(self):
+        """ asyncio tasks entering the same Registry in turns each leave it back to their own """
+        shared = Registry('tasks')
+
+        async def task(name: str) -> bool:
+            with Registry(name) as own:
+                with shared:
+                    await asyncio.sleep(0)
+                    await asyncio.sleep(0)
+                return Registry.current() is own
+
+        async def tasks():
+            return await asyncio.gather(*(task(f'task {n}') for n in range(3)))
+        self.assertEqual([True] * 3, asyncio.run(tasks()))
+
+    def test_shared_fields(self):
+        """ threads searching and changing a Fields of DEFAULT at once """
+        shared = Fields({f'shared {n}': n for n in range(20)}, cache_size=4)
+        failed = []
+
+        def search(n: int):
+            try:
+                with Registry(f'shared {n}'):
+                    for i in range(2000):
+                        shared.search(f'shared {i % 20}')
+                        if i % 50 == n:
+                            shared[f'extra {n}'] = i
+            except Exception as e:
+                failed.append(e)
+        threads = [Thread(target=search, args=(n,)) for n in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual([], failed)
+
+    def test_threads(self):
+        counts = {}
+
+        def load(name: str, times: int):
+            with Registry(name):
+                for _ in range(times):
+                    ElectionResult.load_from_xml(DETAIL_XML)
+                counts[name] = (len(races), len(Contest._all), len(Tabulator._all))
+        threads = [Thread(target=load, args=(f'county {n}', n + 1)) for n in range(3)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(1, len(set(counts.values())), counts)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from db import Name
+from db.sql import Archive, SqlVotes
+from ga.contest import ElectionResult
+from race import Race, races
+from registry import Registry
+from test.tabulator import write_tapes
+from validate import Report
+import unittest
+DETAIL_XML = Path(__file__).parent.joinpath('data', 'detail.xml')
+PRESIDENT = 'President of the United States'
+VOTES = [('Perduped', 'sos.xml', '01A', 'day', 10), ('Perduped', 'sos.xml', '01A', 'mail', 5),
+         ('Ossofied', 'sos.xml', '01A', 'day', 12), ('Ossofied', 'sos.xml', '01B', 'day', 7),
+         ('Perduped', 'tape.xlsx', ('01A', '01B'), 'day', 3), ('Perduped', 'sos.xml', '01A', 'day', 11)]
+
+
+def write_county(filename: str, county: int) -> int:
+    """ in a worker process: the votes of a county, its races, candidates and vote types are those of every county """
+    archive = Archive(filename)
+    n = 0
+    for seat in ('president', 'senate', 'house'):
+        votes = archive.votes(seat)
+        for candidate in ('Perduped', 'Ossofied', 'Hodge'):
+            for precinct in ('01A', '02B', ('01A', '02B')):
+                for vote_type in ('day', 'mail'):
+                    votes.set(candidate, f'county {county}.xml', precinct, vote_type, county + 1)
+                    n += 1
+    archive.close()
+    return n
+
+
+class TestArchive(unittest.TestCase):
+    def test_votes(self):
+        """ SqlVotes answers like a VoteStore """
+        with Registry('sql votes') as registry:
+            archive = Archive()
+            stores = [Race.add(district=Name('d5'), seat=Name('sql columnar'), columnar=True),
+                      Race.add(district=Name('d5'), seat=Name('sql archive'), votes=archive.votes('sql archive'))]
+            for race in stores:
+                for candidate, source, precinct, vote_type, count in VOTES:
+                    race.set_votes(candidate=candidate, count=count, source=source, precinct=precinct,
+                                   vote_type=vote_type)
+            columnar, sql = stores
+            self.assertIsInstance(sql.votes, SqlVotes)
+            self.assertEqual(5, len(sql.votes))
+            self.assertEqual(3, sql.tally('tape.xlsx', precinct='01B'))      # a tape covering both precincts
+            for kwargs in ({}, {'candidate': 'Perduped'}, {'precinct': '01A'}, {'vote_type': 'day'},
+                           {'candidate': 'nobody'}, {'precinct': ('01A', '01B')}):
+                self.assertEqual(columnar.tally('sos.xml', **kwargs), sql.tally('sos.xml', **kwargs))
+                self.assertEqual(columnar.tally('tape.xlsx', **kwargs), sql.tally('tape.xlsx', **kwargs))
+            for by in ('candidate', 'precinct', 'vote_type', 'source'):
+                self.assertEqual(columnar.tally_by(by), sql.tally_by(by))
+                self.assertEqual(columnar.tally_by(by, source='sos.xml'), sql.tally_by(by, source='sos.xml'))
+            self.assertEqual(columnar.get_precinct('sos.xml', '01A'), sql.get_precinct('sos.xml', '01A'))
+            self.assertEqual(columnar.records(['sos.xml']).count.sum(), sql.records(['sos.xml']).count.sum())
+            self.assertEqual(4, sql.remove_source('sos.xml'))
+            self.assertEqual(0, sql.tally('sos.xml'))
+        registry.clear()
+
+    def test_archive(self):
+        with TemporaryDirectory() as tmp:
+            filename = Path(tmp, 'archive.sqlite')
+            with Registry('sql load') as load:
+                archive = Archive(filename)
+                Race.store = archive.votes
+                try:
+                    er = ElectionResult.load_from_xml(DETAIL_XML, lazy=False)
+                finally:
+                    Race.store = None
+                expected = {str(seat): {str(k): v for k, v in race.tally_by('candidate', source=er.source).items()}
+                            for seat, race in races.items()}
+                archive.save_election(er)
+                archive.close()
+            load.clear()
+
+            with Registry('sql read') as read:
+                archive = Archive(filename)
+                self.assertEqual([('General Election', 'Fulton', 2)],
+                                 [(e['name'], e['region'], e['contests']) for e in archive.elections()])
+                found = archive.races(sources=[DETAIL_XML])
+                self.assertEqual(len(expected), len(found))
+                self.assertEqual(expected, {str(race.seat): {str(k): v for k, v in race.tally_by(
+                    'candidate', source=str(DETAIL_XML)).items()} for race in found})
+                self.assertGreater(Race[PRESIDENT].tally(source=str(DETAIL_XML), precinct='01A'), 0)
+                archive.close()
+            read.clear()
+
+    def test_processes(self):
+        """ workers adding the same races, candidates and precincts to one archive at once """
+        with TemporaryDirectory() as tmp:
+            filename = str(Path(tmp, 'archive.sqlite'))
+            with ProcessPoolExecutor(max_workers=6) as pool:
+                written = list(pool.map(write_county, [filename] * 12, range(12)))
+            archive = Archive(filename)
+            self.assertEqual(sum(written), archive.query('SELECT COUNT(*) FROM votes').fetchone()[0])
+            self.assertEqual(3, archive.query('SELECT COUNT(*) FROM races').fetchone()[0])
+            self.assertEqual(sum((county + 1) * n for county, n in enumerate(written)), archive.query('SELECT SUM(count) FROM votes').fetchone()[0])
+            archive.close()
+
+    def test_report(self):
+        """ --sqlite keeps the votes of its Report's races in the archive, not those of a later Report """
+        ap = ArgumentParser()
+        Report.get_args(ap)
+        with TemporaryDirectory() as tmp:
+            Path(tmp, 'detail.xml').write_bytes(DETAIL_XML.read_bytes())
+            write_tapes(Path(tmp), files=1)
+            found = []
+            for args in (['--sqlite', str(Path(tmp, 'archive.sqlite'))], []):
+                with Registry(f'sql report {args}') as registry:
+                    report = Report(ap.parse_args(['-x', tmp, '--no-cache', *args]))
+                    found.append(type(races[PRESIDENT].votes))
+                    if report.archive is not None:
+                        report.archive.close()
+                registry.clear()
+            self.assertEqual([SqlVotes, type(None)], found)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import json
+from argparse import ArgumentParser
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from ga.synthetic import generate
+from statewide import Statewide, find_counties
+from validate import Report
+import unittest
+
+
+class TestStatewide(unittest.TestCase):
+    def test_statewide(self):
+        with TemporaryDirectory() as tmp:
+            manifests = {region: generate(Path(tmp), precincts=20, contests=5, statewide=2, errors=0.3, seed=n,
+                                          region=region) for n, region in enumerate(('Fulton', 'Cobb', 'Dekalb'))}
+            self.assertEqual(['2020/cobb', '2020/dekalb', '2020/fulton'], [c.name for c in find_counties(Path(tmp))])
+            ap = ArgumentParser()
+            Report.get_args(ap)
+            for jobs in (1, 2):
+                with self.subTest(jobs=jobs):
+                    state = Statewide(ap.parse_args(['-x', tmp, '--no-cache', '--statewide', '-j', str(jobs)])).load()
+                    self.assertEqual({f'2020/{r.lower()}': m['tabulators'] for r, m in manifests.items()},
+                                     {name: r.tabulators for name, r in state.counties.items()})
+                    mismatches = {k.who.split('/precinct:')[0] for k in state.errors(0) if k.why == 'vote mismatch'}
+                    self.assertEqual({f"2020/{r.lower()}" for r, m in manifests.items() if m['errors']}, mismatches)
+                    # statewide races are summed over the counties
+                    president = state.tallies['sos']['President of the United States']
+                    self.assertEqual(3, len(state.counties))
+                    self.assertGreater(sum(president.values()), 0)
+
+                    state.save(Path(tmp, 'state.jsonl'))
+                    with open(Path(tmp, 'state.tallies.json')) as f:
+                        self.assertEqual(president, json.load(f)['sos']['President of the United States'])
+
+    def test_isolation(self):
+        """ a name pattern of one county doesn't change the results of the others """
+        with TemporaryDirectory() as tmp:
+            manifests = [generate(Path(tmp), precincts=10, contests=3, statewide=1, errors=0, seed=n, region=region)
+                         for n, region in enumerate(('Fulton', 'Cobb', 'Dekalb'))]
+            ap = ArgumentParser()
+            Report.get_args(ap)
+            args = ap.parse_args(['-x', tmp, '--no-cache', '--statewide', '-j', '1'])
+            expected = {name: r.tallies for name, r in Statewide(args).load().counties.items()}
+            fulton = expected.pop('2020/fulton')
+            # in fulton every candidate is the first one of the president
+            Path(manifests[0]['path'], 'fulton_names.yml').write_text("- {key: 'Alex Smith 0.0', pattern: '.*'}\n")
+            for jobs in (1, 2):
+                with self.subTest(jobs=jobs):
+                    found = {name: r.tallies for name, r in Statewide(args).load(jobs=jobs).counties.items()}
+                    self.assertNotEqual(fulton, found.pop('2020/fulton'))
+                    self.assertEqual(expected, found)
+
+    def test_tapes(self):
+        """ a tape of one county in another county's directory """
+        with TemporaryDirectory() as tmp:
+            for n, region in enumerate(('Fulton', 'Cobb')):
+                generate(Path(tmp), precincts=10, contests=3, statewide=1, errors=0, seed=n, region=region)
+            tape = sorted(Path(tmp, '2020', 'fulton').glob('*.xlsx'))[0]
+            Path(tmp, '2020', 'cobb', 'copied.xlsx').write_bytes(tape.read_bytes())
+            ap = ArgumentParser()
+            Report.get_args(ap)
+            state = Statewide(ap.parse_args(['-x', tmp, '--no-cache', '--statewide', '-j', '1'])).load()
+            repeated = {k.who.split('/precinct:')[0] for k in state.errors(0) if k.why == 'duplicate tape'}
+            self.assertEqual({'2020/fulton'}, repeated, '2020/cobb comes first, its copy is the earlier tape')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,27 @@
+from argparse import ArgumentParser
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from ga.synthetic import generate
+from validate import Report
+import unittest
+
+
+class TestSynthetic(unittest.TestCase):
+    def test_generate(self):
+        with TemporaryDirectory() as tmp:
+            manifest = generate(Path(tmp), precincts=30, contests=6, statewide=2, errors=0.3, shared=0.2, seed=3,
+                                region='Synthetic')
+            self.assertEqual(str(Path(tmp, '2020', 'synthetic')), manifest['path'])
+            ap = ArgumentParser()
+            Report.get_args(ap)
+            report = Report(ap.parse_args(['-x', manifest['path'], '--no-cache']))
+            self.assertEqual(manifest['tabulators'], len(report.tabulators))
+            findings = [k for k, _ in report.validate()]
+        self.assertTrue(manifest['errors'])
+        self.assertEqual({(f"precinct:{e['location']}" if '-' not in e['location']
+                           else f"precinct:{tuple(e['location'].split('-'))}", e['race']) for e in manifest['errors']},
+                         {(k.who, k.what) for k in findings if k.why == 'vote mismatch'})
+
+
+if __name__ == '__main__':
+    unittest.main()
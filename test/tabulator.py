@@ -0,0 +1,143 @@
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from openpyxl import Workbook
+import ga.contest      # registers Fields['vote_types']
+from db.xls import Xlsx
+from tabulator import Tabulator, TapeSchema, load_tabulators, location_precincts
+import unittest
+
+
+def write_tape(filename: Path, columns: list, races: dict):
+    """ write a tally tape workbook: a column of labels, then one column per tabulator
+        columns: [{'Name': .., 'Tabulator ID': .., 'Voting Location': .., 'Protective Counter': .., 'Total Scanned': ..}]
+        races: {race: {candidate: [votes for each column]}}
+    """
+    wb = Workbook()
+    ws = wb.active
+    for label in ('Name', 'Tabulator ID', 'Voting Location', 'Protective Counter', 'Total Scanned'):
+        ws.append([label] + [c[label] for c in columns])
+    for race, candidates in races.items():
+        ws.append([race])
+        for candidate, votes in candidates.items():
+            ws.append([candidate] + list(votes))
+    wb.save(filename)
+
+
+def write_tapes(path: Path, files: int = 3, tabulators: int = 3):
+    for f in range(files):
+        columns = [{'Name': f'ICP {f}.{t}', 'Tabulator ID': 1000 + 10 * f + t, 'Voting Location': f'{f:02d}{"AB"[t % 2]}',
+                    'Protective Counter': 50 + t, 'Total Scanned': 100 + t} for t in range(tabulators)]
+        races = {'President of the US': {'Hodge': [40 + t for t in range(tabulators)],
+                                         'Podge': [60 for _ in range(tabulators)],
+                                         'Total Votes': [100 + t for t in range(tabulators)]}}
+        write_tape(path.joinpath(f'tape{f}.xlsx'), columns, races)
+
+
+class TestTabulator(unittest.TestCase):
+    def test_load_columns(self):
+        with TemporaryDirectory() as tmp:
+            write_tapes(Path(tmp), files=1, tabulators=3)
+            xlsx = Xlsx(Path(tmp).joinpath('tape0.xlsx'))
+        self.assertEqual(4, xlsx.max_column)
+        self.assertEqual('Voting Location', xlsx.row_names[2])
+        columns = xlsx.column_kwargs()
+        self.assertEqual([2, 3, 4], [c['_column'] for c in columns])
+        self.assertEqual({'_file', '_column', '0:Name', '1:Tabulator ID', '2:Voting Location', '3:Protective Counter',
+                          '4:Total Scanned', '5:President of the US', '6:Hodge', '7:Podge', '8:Total Votes'},
+                         set(columns[0]))
+        self.assertEqual(('00B', 101, 42), (columns[1]['2:Voting Location'], columns[1]['4:Total Scanned'],
+                                            columns[2]['6:Hodge']))
+
+    def test_schema(self):
+        schema = TapeSchema()
+        labels = ('year', 'county', '_file', '_column', '0:Name', '1:Tabulator ID', '2:Voting Location',
+                  '3:Protective Counter', '4:Total Scanned', '5:President of the US', '6:Hodge', '7:Total Votes')
+        layout = schema.layout(labels)
+        self.assertIs(layout, schema.layout(tuple(labels)))
+        self.assertEqual({'name': '0:Name', 'id': '1:Tabulator ID', 'location': '2:Voting Location',
+                          'total_scanned': '4:Total Scanned', 'protective_counter': '3:Protective Counter',
+                          'county': 'county', 'year': 'year', 'file': '_file', 'column': '_column'}, layout.fields)
+        self.assertEqual((('5:President of the US', 5, 'President of the US'), ('6:Hodge', 6, 'Hodge'),
+                          ('7:Total Votes', 7, 'Total Votes')), layout.rows)
+        with TemporaryDirectory() as tmp:
+            write_tapes(Path(tmp), files=2, tabulators=2)
+            Tabulator.schema = schema = TapeSchema()
+            try:
+                tabs = [t for li in load_tabulators(Path(tmp)).values() for t in li]
+            finally:
+                Tabulator.schema = TapeSchema()
+        self.assertEqual(1, len(schema._layouts), 'every column of every file shares one layout')
+        self.assertEqual([('ICP 0.0', 1000, ('00A',), 100, 50)],
+                         [(t.name, t.id, t.locations, t.total_scanned, t.protective_counter) for t in tabs[:1]])
+
+    def test_parallel_load(self):
+        with TemporaryDirectory() as tmp:
+            path = Path(tmp)
+            write_tapes(path)
+
+            def summary(by_file: dict):
+                return {f: [(t.name, t.id, t.locations, t.total_scanned, t._column) for t in tabs]
+                        for f, tabs in by_file.items()}
+            serial = summary(load_tabulators(path, jobs=1))
+            Tabulator._all.clear()
+            parallel = summary(load_tabulators(path, jobs=2))
+        self.assertEqual(['tape0.xlsx', 'tape1.xlsx', 'tape2.xlsx'], list(parallel))
+        self.assertEqual(serial, parallel)
+
+    def test_locations(self):
+        """ the tabulator's label in Location isn't a precinct, tapes of other precincts stay in groups of their own """
+        self.assertEqual(('SS15A', 'SS15B'), location_precincts('SS15A-SS15B ICP 2'))
+        self.assertEqual(('01A', '01B'), location_precincts(' 01A - 01B '))
+        locations = ['SS15A-SS15B ICP 2', 'SS15B ICP 1', '01A ICP 1', '02B ICP 2']
+        columns = [{'Name': f'ICP {n}', 'Tabulator ID': n, 'Voting Location': location, 'Protective Counter': 50 + n,
+                    'Total Scanned': 100 + n} for n, location in enumerate(locations)]
+        with TemporaryDirectory() as tmp:
+            write_tape(Path(tmp, 'tape.xlsx'), columns, {'President of the US': {'Hodge': [1, 2, 3, 4]}})
+            Tabulator._all.clear()
+            tabs = load_tabulators(Path(tmp))['tape.xlsx']
+        self.assertEqual([('SS15A', 'SS15B'), ('SS15B',), ('01A',), ('02B',)], [t.locations for t in tabs])
+        self.assertEqual({('SS15A', 'SS15B'): {'ICP 0', 'ICP 1'}, '01A': {'ICP 2'}, '02B': {'ICP 3'}},
+                         {k: {t.name for t in v} for k, v in Tabulator.by_location(tabs).items()})
+
+    def test_duplicates(self):
+        """ a tape scanned twice, read differently, copied to another tabulator, or nearly the same as another """
+        meta = [(1, 50, 100), (1, 50, 100), (1, 50, 100), (2, 70, 100), (3, 80, 200), (4, 90, 10), (5, 1, 0), (6, 2, 0)]
+        columns = [{'Name': f'ICP {n}', 'Tabulator ID': i, 'Voting Location': f'{n:02d}A', 'Protective Counter': pc,
+                    'Total Scanned': ts} for n, (i, pc, ts) in enumerate(meta)]
+        races = {f'Race {r}': {'Hodge': [10 + r] * 5 + [1, 0, 0], 'Podge': [20 + r] * 5 + [2, 0, 0]} for r in range(5)}
+        races['Race 0']['Hodge'][2] += 1        # ICP 2: a rescan of ICP 0, read differently
+        races['Race 4']['Podge'][4] += 5        # ICP 4: all but one race the same as ICP 0
+        with TemporaryDirectory() as tmp:
+            write_tape(Path(tmp, 'tape.xlsx'), columns, races)
+            Tabulator._all.clear()
+            tabs = load_tabulators(Path(tmp))['tape.xlsx']
+        found = Tabulator.duplicates(tabs)
+        self.assertEqual([('ICP 1', 'duplicate tape', 'ICP 0'), ('ICP 2', 'rescanned tape', 'ICP 0'),
+                          ('ICP 3', 'identical votes', 'ICP 0'), ('ICP 4', 'near duplicate tape', 'ICP 0')],
+                         [(d.item.name, d.kind, d.of.name) for d in found])
+        self.assertEqual([1.0, 0.8, 1.0, 0.8], [d.similarity for d in found])
+        self.assertEqual([], Tabulator.duplicates(tabs[:1] + tabs[5:]), 'small tapes only match by metadata')
+
+    def test_refresh(self):
+        from argparse import ArgumentParser
+        from validate import Report
+        with TemporaryDirectory() as tmp:
+            path = Path(tmp)
+            write_tapes(path)
+            path.joinpath('detail.xml').write_bytes(Path(__file__).parent.joinpath('data', 'detail.xml').read_bytes())
+            ap = ArgumentParser()
+            Report.get_args(ap)
+            Tabulator._all.clear()
+            report = Report(ap.parse_args(['-x', tmp, '--no-cache']))
+            report.validate()
+            report.save_xlsx(report.output)
+            self.assertEqual(set(), report.refresh(), 'the saved report is not a tape')
+            path.joinpath('tape1.xlsx').unlink()
+            self.assertEqual({'01A', '01B'}, report.refresh())
+            self.assertEqual(6, len(report.tabulators))
+            report.validate(locations={'01A', '01B'})
+            self.assertIn('precinct:01B', {k.who for k in report.errors(0)})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import csv
+import json
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from openpyxl import load_workbook
+from util import LogSelf
+from writers import CHUNK, ReportWriter, writer_for
+import unittest
+
+
+class Findings(LogSelf):
+    pass
+
+
+class TestWriters(unittest.TestCase):
+    def setUp(self):
+        Findings._errors.clear()
+        log = Findings()
+        for n in range(CHUNK + 5):      # more than one chunk
+            log.error(f'mismatch {n}', why='vote mismatch', what='President', who=f'precinct:{n:04d}')
+        log.info('missing', why='missing tabulator(s)', who='precinct:X')
+
+    def save(self, tmp: str, suffix: str, report_level=LogSelf.ERROR) -> Path:
+        filename = Path(tmp, f'report{suffix}')
+        with writer_for(filename) as w:
+            self.assertEqual(CHUNK + 5, w.write('findings', Findings.iter_errors(report_level)))
+        return filename
+
+    def test_formats(self):
+        with TemporaryDirectory() as tmp:
+            ws = load_workbook(self.save(tmp, '.xlsx'), read_only=True)['findings']
+            rows = list(ws.values)
+            self.assertEqual(('level', 'why', 'what', 'when', 'who', 'description(s)'), rows[0])
+            self.assertEqual((LogSelf.ERROR, 'vote mismatch', 'President', None, 'precinct:0000', 'mismatch 0'), rows[1])
+            self.assertEqual(CHUNK + 6, len(rows))
+
+            with open(self.save(tmp, '.csv'), newline='') as f:
+                rows = list(csv.reader(f))
+            self.assertEqual(['report', 'level', 'why', 'what', 'when', 'who', 'description(s)'], rows[0])
+            self.assertEqual(['findings', '40', 'vote mismatch', 'President', '', 'precinct:0001', 'mismatch 1'], rows[2])
+            self.assertEqual(CHUNK + 6, len(rows))
+
+            with open(self.save(tmp, '.jsonl')) as f:
+                rows = [json.loads(line) for line in f]
+            self.assertEqual({'report': 'findings', 'level': 40, 'why': 'vote mismatch', 'what': 'President',
+                              'when': None, 'who': 'precinct:0002', 'descriptions': ['mismatch 2']}, rows[2])
+            self.assertEqual(CHUNK + 5, len(rows))
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            writer_for(Path('report.txt'))
+
+    def test_incomplete_writer(self):
+        """ a writer that doesn't write rows fails when it's made, not at its first chunk """
+        class Incomplete(ReportWriter):
+            suffix = '.txt'
+
+        with self.assertRaises(TypeError):
+            Incomplete(Path('report.txt'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,12 @@
 from typing import Iterable, NamedTuple, Callable
 from datetime import datetime
+from itertools import islice
 from pytz import utc
 from pathlib import Path
 import re
 import logging
 from logging import INFO
+from registry import Scoped
 
 # data path should contain a year (1900 <= even years <= 2098)  and county ex: /foo/bar/2020/fulton/data
 _data_path_re = re.compile(str(Path('').joinpath('.*', r'(?P<year>(19|20)\d[02468])', r'(?P<county>\w+)', '.*')), re.I)
@@ -108,19 +110,147 @@ def deep_tally(di: dict, keys: tuple):
     return 0
 
 
+class Bucket(NamedTuple):
+    """ findings of one (level, why, what), see Diagnostics.query() """
+    level: int
+    why: str
+    what: str
+    count: int              # findings logged, including those whose message wasn't kept
+    samples: tuple          # a few of their messages
+
+
+_NO_MESSAGES = frozenset()     # the messages of a key none of whose messages were kept
+
+
+class Diagnostics(dict):
+    """ {ErrorKey: {message, ...}} that counts every finding but keeps at most `samples` messages per (level, why, what)
+        bucket, with counters by key and by bucket, so repetitive findings cost a counter, not a message each
+        (findings of many places (who) or times (when) are many keys, of one bucket)
+    """
+    samples = 10
+
+    def __init__(self, samples: int = None):
+        super().__init__()
+        if samples is not None:
+            self.samples = samples
+        self._counts = {}       # {ErrorKey: findings}
+        self._buckets = {}      # {(level, why, what): [findings, {ErrorKey, ...}, messages kept]}
+
+    def add(self, key: ErrorKey, msg, args: tuple = ()) -> bool:
+        """ count a finding, msg % args is only formatted if it's kept :returns whether it was """
+        messages = self.get(key)
+        if messages is None:
+            messages = _NO_MESSAGES
+            super().__setitem__(key, messages)
+            bucket = self._buckets.setdefault((key.level, key.why, key.what), [0, set(), 0])
+            bucket[1].add(key)
+        else:
+            bucket = self._buckets[(key.level, key.why, key.what)]
+        self._counts[key] = self._counts.get(key, 0) + 1
+        bucket[0] += 1
+        if bucket[2] >= self.samples:
+            return False
+        if type(messages) is not set:
+            messages = set(messages)
+            super().__setitem__(key, messages)
+        n = len(messages)
+        messages.add(msg % args if args else msg)
+        bucket[2] += len(messages) - n
+        return True
+
+    def merge(self, key: ErrorKey, messages: Iterable[str], count: int = None) -> None:
+        """ add findings counted elsewhere (ex: in another process): count of them, messages are the kept ones """
+        if key not in self:
+            self[key] = _NO_MESSAGES
+        n = 0
+        for msg in messages:
+            self.add(key, msg)
+            n += 1
+        extra = 0 if count is None else count - n
+        if extra > 0:
+            self._counts[key] += extra
+            self._buckets[(key.level, key.why, key.what)][0] += extra
+
+    def count(self, key: ErrorKey) -> int:
+        return self._counts.get(key, len(self.get(key, ())))
+
+    def __setitem__(self, key: ErrorKey, messages: set):
+        self._forget(key)
+        super().__setitem__(key, messages)
+        self._counts[key] = len(messages)
+        bucket = self._buckets.setdefault((key.level, key.why, key.what), [0, set(), 0])
+        bucket[0] += len(messages)
+        bucket[1].add(key)
+        bucket[2] += len(messages)
+
+    def __delitem__(self, key: ErrorKey):
+        self._forget(key)
+        super().__delitem__(key)
+
+    def _forget(self, key: ErrorKey):
+        count = self._counts.pop(key, 0)
+        bucket = self._buckets.get((key.level, key.why, key.what))
+        if bucket is not None and key in bucket[1]:
+            bucket[0] -= count
+            bucket[1].discard(key)
+            bucket[2] -= len(self[key])
+            if not bucket[1]:
+                del self._buckets[(key.level, key.why, key.what)]
+
+    def clear(self):
+        super().clear()
+        self._counts.clear()
+        self._buckets.clear()
+
+    def messages(self, key: ErrorKey) -> set:
+        """ the kept messages of key, plus a note of how many weren't kept """
+        messages = self[key]
+        dropped = self.count(key) - len(messages)
+        return messages | {f'... and {dropped} more'} if dropped > 0 else messages
+
+    def query(self, level: int = None, why: str = None, what: str = None, samples: int = None) -> list:
+        """ :returns [Bucket, ...] at or above level, of category why and object what (None: any), most findings first
+            samples: messages per bucket (default: self.samples)
+        """
+        samples = self.samples if samples is None else samples
+        rv = []
+        for (b_level, b_why, b_what), (count, keys, _) in self._buckets.items():
+            if (level is None or b_level >= level) and (why is None or b_why == why) \
+                    and (what is None or b_what == what):
+                examples = []
+                for key in keys:
+                    examples.extend(islice(self[key], samples - len(examples)))
+                    if len(examples) >= samples:
+                        break
+                rv.append(Bucket(b_level, b_why, b_what, count, tuple(sorted(examples))))
+        return sorted(rv, key=lambda b: (-b.count, -b.level, str(b.why), str(b.what)))
+
+    def total(self, level: int = None, why: str = None) -> int:
+        """ number of findings at or above level, of category why (None: any) """
+        return sum(count for (b_level, b_why, _), (count, *_) in self._buckets.items()
+                   if (level is None or b_level >= level) and (why is None or b_why == why))
+
+
 class LogSelf:
     ERROR = logging.ERROR
     WARN  = logging.WARN
     INFO = logging.INFO
     DEBUG = logging.DEBUG
     EXCEPTION = -1
+    record_level = logging.NOTSET     # findings below this are dropped before their message is formatted
     _classes = set()
-    _errors = {}    # and it will stay empty
+    _errors = Scoped('errors:LogSelf', Diagnostics)
 
     def __init_subclass__(cls, **kwargs):
-        cls._errors = {}    # set(errors) by (level, category)
+        # {ErrorKey: {message, ...}} with counters by (level, why, what), one per class in each Registry
+        cls._errors = Scoped(f'errors:{cls.__module__}.{cls.__qualname__}', Diagnostics)
         LogSelf._classes.add(cls)
 
+    @classmethod
+    def set_level(cls, level: int):
+        """ stop recording (and logging) findings below level, for every LogSelf """
+        LogSelf.record_level = level
+
     @property
     def log_name(self):
         return self.__class__.__name__
@@ -137,16 +267,46 @@ class LogSelf:
     @classmethod
     def errors(cls, report_level: int) -> dict:
         rv = {}
-        for k in filter(lambda t: t.level >= report_level, cls._errors):
-            rv.setdefault(k, set()).update(cls._errors.get(k))
+        errors = cls._errors()
+        for k in filter(lambda t: t.level >= report_level, errors):
+            rv.setdefault(k, set()).update(errors.messages(k))
         return rv
 
+    @classmethod
+    def iter_errors(cls, report_level: int) -> Iterable[tuple]:
+        """ (ErrorKey, {description, ...}), ... like errors(), without copying them """
+        errors = cls._errors()
+        return ((k, errors.messages(k)) for k in errors if k.level >= report_level)
+
+    @classmethod
+    def diagnostics(cls, level: int = None, why: str = None, what: str = None) -> list:
+        """ :returns [Bucket, ...] counts and sample messages by (level, why, what), see Diagnostics.query """
+        return cls._errors().query(level=level, why=why, what=what)
+
+    @classmethod
+    def retract(cls, who: Iterable[str] = None, why: Iterable[str] = None) -> int:
+        """ forget errors logged by who (None: all of them), before checking them again
+            why: only the errors of these categories
+        """
+        who = None if who is None else set(who)
+        why = None if why is None else set(why)
+        errors = cls._errors()
+        keys = [k for k in errors if (who is None or k.who in who) and (why is None or k.why in why)]
+        for k in keys:
+            del errors[k]
+        return len(keys)
+
     def log(self, msg, *args, what: str = None, why: str = None, level: int = logging.INFO,
             when: datetime = None, who: str = None, **kwargs):
+        """ msg % args is only formatted when the finding is kept (see Diagnostics), and logged if logging would """
+        if self.EXCEPTION < level < LogSelf.record_level:
+            return
         who = self.__class__.__name__ if who is None else who
+        why = kwargs.pop('category', why)
         key = ErrorKey(level=level, what=what, why=why, when=when, who=who)
-        errors = self._errors.setdefault(key, set())
-        errors.add(msg)
+        self._errors.add(key, msg, args)
+        if not logging.root.isEnabledFor(logging.ERROR if level <= self.EXCEPTION else level):
+            return
 
         if level == self.ERROR:
             fn = logging.error
@@ -159,10 +319,10 @@ class LogSelf:
         elif level <= self.EXCEPTION:
             fn = logging.exception
         else:
-            fn = logging.log
-            kwargs['level'] = level
+            logging.log(level, msg, *args, **kwargs)
+            return
 
-        fn(msg=msg, *args, **kwargs)
+        fn(msg, *args, **kwargs)
 
     def error(self, msg, *args, what: str = None, why: str = None,
               when: datetime = None, who: str = None, **kwargs):
@@ -172,3 +332,7 @@ class LogSelf:
                 when: datetime = None, who: str = None, **kwargs):
         self.log(msg, level=logging.WARN, *args, what=what, when=when, who=who, why=why, **kwargs)
 
+    def info(self, msg, *args, what: str = None, why: str = None,
+             when: datetime = None, who: str = None, **kwargs):
+        self.log(msg, level=logging.INFO, *args, what=what, when=when, who=who, why=why, **kwargs)
+
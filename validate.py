@@ -24,13 +24,26 @@ Race:
 
 """
 import logging
+import time
+from contextlib import nullcontext
+from pprint import pformat
 from pathlib import Path
 from typing import Iterable, Set
 from argparse import ArgumentParser
+import ga.columnar
 from ga.contest import ElectionResult, Fields
-from tabulator import Tabulator, load_tabulators
-from openpyxl import Workbook
+from tabulator import Tabulator, load_tabulators, load_tabulator_file, tabulator_files
 from util import LogSelf, first, ErrorKey, dict_sum, dict_diff
+from writers import ReportWriter, XlsxWriter, writer_for
+from race import races, defaults as race_defaults
+from reconcile import reconcile, location_groups
+from db.fingerprint import DUPLICATE, RESCAN
+from db.groups import LocationGroups
+from db.sql import Archive
+from db.file_cache import FileCache, DEFAULT_DIR as CACHE_DIR
+from registry import Registry, within
+from profiling import Profiler
+from ingest import EXECUTORS, Pipeline
 
 
 class Report(LogSelf):
@@ -39,40 +52,177 @@ class Report(LogSelf):
     - tabulators are valid (? time, reasonable counts, )
     - SOS (ElectionResult) precinct votes must match tabulators
     - ??
+    Everything is loaded into, and looked up in, registry (default: the current Registry)
     """
-    def __init__(self, args, load=True):
-        if args.errors:
-            args.report_level = logging.ERROR
-        elif args.warnings:
-            args.report_level = logging.WARN
-        elif args.info:
-            args.report_level = logging.INFO
-        self.report_level = args.report_level if type(args.report_level) is int else logging.INFO
+    def __init__(self, args, load=True, registry: Registry = None):
+        self.registry = Registry.current() if registry is None else registry
+        self.report_level = report_level(args)
         self.dir_results = Path(args.sos_results_xml).expanduser().absolute()
         self.dir_tabulator = Path(args.tabulator_dir).expanduser().absolute() if args.tabulator_dir else self.dir_results
         self.dir_top = min(self.dir_results, self.dir_tabulator, key=lambda p: len(str(p)))
         self.tabulators = {}        # {(county, date, name): Tabulator}
         self.results = {}           # {(county, date):       ElectionResult}
+        self.cache = None if args.no_cache else FileCache(args.cache_dir, rebuild=args.rebuild_cache)
+        self.lazy = getattr(args, 'lazy', False)
+        self.profiler: Profiler = None     # records each phase when set (--profile)
+        self.archive = Archive(args.sqlite) if getattr(args, 'sqlite', None) else None
+        self.output = self._output_path(Path(args.output).expanduser())
+        writer_for(self.output)     # an unknown output format fails now, not after validating
         if load:
             self.load(args=args)
 
+    @within
     def load(self, args):
-        results = self.results
-        field_files = self.dir_results.glob('*.yml') if not args.fields_yml else [Path(args.fields_yml).expanduser()]
-        for file in field_files:
-            Fields(key=file.stem, filename=file)
-
-        xml_paths: list = self.dir_results.glob('*.xml') if self.dir_results.is_dir() else [self.dir_results]
-        for xml_file in xml_paths:
-            er = ElectionResult.load_from_xml(filename=xml_file)
-            results[(er.Region, er.ElectionDate)] = er
-            results[xml_file] = er
-
-        self._tabulators_by_file = load_tabulators(self.dir_tabulator)
-        for li in self._tabulators_by_file.values():
-            self.tabulators.update({v._key: v for v in li})
+        if self.archive is not None:
+            race_defaults['store'] = self.archive.votes     # every vote loaded into registry is kept in the archive
+        if getattr(args, 'pipeline', False):
+            self.ingest(args)
+        else:
+            self.load_fields(args)
+            self.load_results()
+            self.load_tabulators(jobs=args.jobs)
+        self.save_archive()
         return None
 
+    def save_archive(self):
+        """ store the results (contests, precincts) and tapes in the archive (--sqlite), their votes already are """
+        if self.archive is None:
+            return
+        for er in set(self.results.values()):
+            self.archive.save_election(er)
+        self.archive.save_tabulators(self.tabulators.values())
+        self.archive.flush()
+
+    @within
+    def load_fields(self, args):
+        with self._stage('fields'):
+            for file in self._field_files(args):
+                Fields(key=file.stem, filename=file)
+
+    @within
+    def load_results(self):
+        with self._stage('xml'):
+            for xml_file in self._xml_files():
+                self._load_xml(xml_file)
+        self._file_stats = self._stat_files()
+
+    @within
+    def load_tabulators(self, jobs: int = 1):
+        with self._stage('xlsx') as counts:
+            self._tabulators_by_file = load_tabulators(self.dir_tabulator, jobs=jobs, cache=self.cache,
+                                                       exclude=[self.output])
+            for li in self._tabulators_by_file.values():
+                self.tabulators.update({v._key: v for v in li})
+            counts['files'] = len(self._tabulators_by_file)
+        self._file_stats = self._stat_files()
+
+    @within
+    def ingest(self, args):
+        """ load_fields, load_results and load_tabulators at once, reading and parsing overlapped (see ingest) """
+        files = [('yml', file) for file in self._field_files(args)]
+        for xml_file in self._xml_files():
+            files.append(('columnar', xml_file) if ga.columnar.newer(xml_file) else ('xml', xml_file))
+        xlsx_files = tabulator_files(self.dir_tabulator, exclude=[self.output])
+        if not xlsx_files:
+            raise ValueError(f"No xlsx files found in [{self.dir_tabulator}]")
+        files.extend(('xlsx', file) for file in xlsx_files)
+        self._tabulators_by_file = {}
+        pipeline = Pipeline(executor=getattr(args, 'executor', 'process'), workers=args.jobs,
+                            queue_size=getattr(args, 'queue_size', 4), cache=self.cache)
+        with self._stage('ingest') as counts:
+            counts['files'] = pipeline.run(files, self._build)
+        self._file_stats = self._stat_files()
+
+    def _build(self, kind: str, file: Path, data):
+        """ register what ingest parsed from file """
+        if kind == 'yml':
+            Fields(key=file.stem, fields=data)
+        elif kind == 'xml':
+            self._add_result(file, ElectionResult(data, source=file, lazy=self.lazy or ElectionResult.lazy))
+        elif kind == 'columnar':
+            self._load_xml(file)
+        else:
+            tabs = self._tabulators_by_file[file.name] = load_tabulator_file(file, columns=data)
+            self.tabulators.update({v._key: v for v in tabs})
+
+    def _stage(self, name: str):
+        """ with self._stage('xml') as counts: ...  profiles the phase if there's a profiler """
+        return nullcontext({}) if self.profiler is None else self.profiler.stage(name)
+
+    def _field_files(self, args) -> list:
+        return sorted(self.dir_results.glob('*.yml')) if not args.fields_yml else [Path(args.fields_yml).expanduser()]
+
+    def _xml_files(self) -> list:
+        return sorted(self.dir_results.glob('*.xml')) if self.dir_results.is_dir() else [self.dir_results]
+
+    def _load_xml(self, xml_file: Path) -> ElectionResult:
+        columnar = ga.columnar.newer(xml_file)
+        if columnar is not None:        # converted by ga.columnar from the xml as it is now
+            er = ga.columnar.ColumnarResult.load(columnar, source=xml_file)
+        else:
+            er = ElectionResult.load_from_xml(filename=xml_file, cache=self.cache,
+                                              lazy=self.lazy or None)     # default: ElectionResult.lazy
+        return self._add_result(xml_file, er)
+
+    def _add_result(self, xml_file: Path, er: ElectionResult) -> ElectionResult:
+        self.results[(er.Region, er.ElectionDate)] = er
+        self.results[xml_file] = er
+        return er
+
+    def _stat_files(self) -> dict:
+        """ :returns {path: (size, mtime)} of every xml and tabulator file """
+        rv = {}
+        for file in self._xml_files() + tabulator_files(self.dir_tabulator, exclude=[self.output]):
+            try:
+                stat = file.stat()
+                rv[file] = (stat.st_size, stat.st_mtime_ns)
+            except FileNotFoundError:
+                pass
+        return rv
+
+    @within
+    def refresh(self) -> set or None:
+        """ reload only the files which were added, changed or removed since load() / the last refresh()
+            :returns the locations that need validating again, None: all of them (an xml changed)
+        """
+        stats = self._stat_files()
+        changed = sorted(f for f in stats.keys() | self._file_stats.keys() if stats.get(f) != self._file_stats.get(f))
+        self._file_stats = stats
+        locations = set()
+        for file in changed:
+            if file.suffix == '.xml':
+                er = self.results.pop(file, None)
+                if er is not None:
+                    er.retract()
+                    self.results.pop((er.Region, er.ElectionDate), None)
+                if file in stats:
+                    self._load_xml(file)
+                locations = None
+                continue
+            old = self._tabulators_by_file.pop(file.name, [])
+            for tab in old:
+                if self.tabulators.get(tab._key) is tab:
+                    del self.tabulators[tab._key]
+            affected = Tabulator.retract(old)
+            if file in stats:
+                new = self._tabulators_by_file[file.name] = load_tabulator_file(file, cache=self.cache)
+                self.tabulators.update({v._key: v for v in new})
+                for tab in new:
+                    affected.update(_locations(tab))
+            if locations is not None:
+                locations.update(affected)
+            self.info(f"reloaded {file.name}", why='changed file', who=str(file))
+        return locations
+
+    def watch(self, filename: Path, interval: float):
+        """ poll for changed files every interval seconds, revalidating and saving the report after each change """
+        while True:
+            time.sleep(interval)
+            locations = self.refresh()
+            if locations is None or locations:
+                self.validate(locations=locations)
+                self.save(filename=filename)
+
     @property
     def name(self):
         er: ElectionResult = first(self.results.values())
@@ -88,82 +238,176 @@ class Report(LogSelf):
         ap.add_argument('--tabulator_dir', '-t', type=str, help='directory of tabulator receipts', default=None)
         ap.add_argument('--sos_results_xml', '-x', type=str, help='Election results xml file/directory', default='.')
         ap.add_argument('--fields_yml', '-f', type=str, help='fields file', default=None)
-        ap.add_argument('--output', '-o', type=str, help='Output file path', default='./report.xlsx')
-
-    def save_xlsx(self, filename: Path, report_level=None, **kwargs):
+        ap.add_argument('--output', '-o', type=str, default='./report.xlsx',
+                        help='Output file path, its suffix picks the format: .xlsx, .csv or .jsonl')
+        ap.add_argument('--watch', type=float, default=None,
+                        help='keep running: every WATCH seconds reload changed files and update the report')
+        ap.add_argument('--jobs', '-j', type=int, default=1,
+                        help='processes loading tabulator files, or counties with --statewide (0: one per cpu)')
+        ap.add_argument('--pipeline', action='store_true',
+                        help='load the files through staged queues: reading, parsing and building them overlap')
+        ap.add_argument('--executor', choices=sorted(EXECUTORS), default='process',
+                        help='what parses the files with --pipeline, JOBS of them at once')
+        ap.add_argument('--queue_size', type=int, default=4,
+                        help='files waiting between each stage of --pipeline (bounds its memory)')
+        ap.add_argument('--lazy', action='store_true',
+                        help="only build the SOS contests that are validated (the tapes' races), "
+                             "the xml isn't cached then")
+        ap.add_argument('--statewide', action='store_true',
+                        help='sos_results_xml is a root of YEAR/COUNTY directories: validate each county in parallel')
+        ap.add_argument('--profile', nargs='?', const='profile.json', default=None,
+                        help='time, memory and hot path call counts of each phase into PROFILE (profile.json)')
+        ap.add_argument('--sqlite', type=str, default=None,
+                        help='keep the results, tapes and votes in this SQLite file, and tally them there')
+        ap.add_argument('--cache_dir', type=str, help='parsed file cache directory', default=str(CACHE_DIR))
+        ap.add_argument('--no_cache', '--no-cache', action='store_true', help="don't use the parsed file cache")
+        ap.add_argument('--rebuild_cache', '--rebuild-cache', action='store_true',
+                        help='parse every file again and replace its cache')
+
+    @within
+    def save(self, filename: Path, report_level=None, writer: ReportWriter = None, **kwargs) -> int:
+        """ stream the findings of self and kwargs ({name: LogSelf}) into filename, a chunk of rows at a time
+            writer: default is the one for filename's suffix (.xlsx, .csv or .jsonl, see writers)
+            :returns the number of rows written
+        """
         report_level = report_level if type(report_level) is int else self.report_level
-        from openpyxl.worksheet.worksheet import Worksheet
-        # save into an excel file with formatting / colors / etc
-        wb = Workbook(iso_dates=True)
-        wb.remove_sheet(wb.active)
-
-        def add_tab(_name, obj: LogSelf, level=report_level):
-            ws: Worksheet = wb.create_sheet(f"{_name}", index=1)
-            errors = obj.errors(report_level)
-            ws.append(ErrorKey._fields + ('description(s)',))
-            for errkey, desc in errors.items():
-                ws.append((*errkey, *list(desc)))
-
         if self not in kwargs.values():
             kwargs[self.name] = self
 
-        for name, v in kwargs.items():
-            add_tab(name, v)
-
-        filename = filename if filename.is_absolute() else self.dir_top.joinpath(filename)
+        filename = self._output_path(filename)
         if not filename.parent.exists():
             filename.parent.mkdir(mode=0o770, parents=True, exist_ok=True)
-        wb.save(filename=filename)
+        with self._stage('save') as counts, writer or writer_for(filename) as w:
+            for name, v in kwargs.items():
+                w.write(name, v.iter_errors(report_level))
+            counts['rows'] = w.rows
+        return w.rows
+
+    def save_xlsx(self, filename: Path, report_level=None, **kwargs) -> int:
+        # save into an excel file, one sheet per report
+        return self.save(filename, report_level=report_level, writer=XlsxWriter(self._output_path(filename)), **kwargs)
+
+    @within
+    def errors(self, report_level: int) -> dict:
+        return super().errors(report_level)
+
+    @within
+    def iter_errors(self, report_level: int) -> Iterable[tuple]:
+        return super().iter_errors(report_level)
+
+    @within
+    def diagnostics(self, level: int = None, why: str = None, what: str = None) -> list:
+        return super().diagnostics(level=level, why=why, what=what)
+
+    @within
+    def retract(self, who: Iterable[str] = None, why: Iterable[str] = None) -> int:
+        return super().retract(who, why=why)
+
+    def _output_path(self, filename: Path) -> Path:
+        return filename if filename.is_absolute() else self.dir_top.joinpath(filename)
 
     def __str__(self):
         # return giant formatted string?... nah
         return f"{self.name}, {len(self.tabulators)}"
 
-    def validate_locations(self, er_precincts, tabulators):
+    def validate_locations(self, er_precincts, tabulators, locations: set = None):
+        """ locations: only check these (None: every precinct) """
         def get_diff(a, b):
             return set(filter(lambda v: type(v) is not tuple, set(a).difference(b)))
-        missing_locations = get_diff(er_precincts, tabulators)
+        if locations is None:
+            missing_locations = get_diff(er_precincts, tabulators)
+        else:
+            missing_locations = get_diff([loc for loc in locations if loc in er_precincts], tabulators)
         for loc in missing_locations:
-            self.info(msg=f'location: {loc} not found in tabulator receipts',
-                      category='missing tabulator(s)', who=f'precinct:{loc}')
+            self.info('location: %s not found in tabulator receipts', loc,
+                      category='missing tabulator(s)', who=_who(loc))
         return missing_locations
 
-    def validate_races(self, er_precincts, tabs_by_loc):
-        # for loc in er_precincts tab = tabs_by_loc[loc]
-        # loc = tab.locations
-        # if len(loc) > 1:
-        #    tab = tabs_by_loc[loc]
-        # results[loc] = sum = {}
-        # [dict_sum(sum, t.races) for t in tab]
+    def validate_tapes(self, tabulators: Iterable[Tabulator], locations: set = None) -> list:
+        """ find tapes that repeat another one (a rescan, a copy) before their votes count twice in a location
+            locations: only report the tapes of these (every tape is still compared)
+            :returns [db.fingerprint.Duplicate, ...]
+        """
+        rv = []
+        for d in Tabulator.duplicates(tabulators):
+            if locations is not None and not locations.intersection(_locations(d.item)):
+                continue
+            level = logging.ERROR if d.kind in (DUPLICATE, RESCAN) else logging.WARNING
+            self.log('%s: %s <%s> (%s column %s) repeats %s <%s> (%s column %s), %.0f%% of its races the same',
+                     d.kind, d.item.name, d.item.id, Path(d.item._file).name, d.item._column, d.of.name, d.of.id,
+                     Path(d.of._file).name, d.of._column, 100 * d.similarity,
+                     level=level, why=d.kind, what=d.item.name, who=_who(_location(d.item)))
+            rv.append(d)
+        return rv
+
+    def validate_races(self, er_precincts, tabs_by_loc, locations: set = None) -> list:
+        """ compare the votes on the tapes with the SOS votes of the precinct(s) each tape covers
+            :returns the mismatch table [reconcile.Mismatch, ...], each is also logged as an error
+        """
         tabs: Set[Tabulator] = set()
-        for set_of_tabs in tabs_by_loc.values():
-            tabs.update(set_of_tabs)
-
-        tab_totals_by_loc = {}
-        for tab in tabs:
-            loc = tab.locations
-            tab_totals_by_loc[loc] = loc_total = {}
-            for tab_at_loc in tabs_by_loc[loc]:
-                dict_sum(loc_total, tab_at_loc.races)
-
-        for locs in tab_totals_by_loc.keys():
-            # sum er_precincts[loc]
-            # compare, and report
-            pass
-
-    def validate(self, report_level=None) -> Iterable:
-        """ Validate all records, and return results as rows
-            row = dict: name, report_level, description, records
+        for group, set_of_tabs in tabs_by_loc.items():
+            if locations is None or locations.intersection(LocationGroups.members(group)) or group in locations:
+                tabs.update(set_of_tabs)
+        self.retract([_who(loc) for loc in location_groups(tabs)], why=['vote mismatch'])
+        # lazy results only build the contests the tapes report
+        tape_sources = {tab.source for tab in tabs}
+        seats = [race.seat for race in races.values() if tape_sources.intersection(race.sources)]
+        for er in set(self.results.values()):
+            er.contests(names=seats)
+
+        mismatches = reconcile(tabs, sos_sources={er.source for er in self.results.values()})
+        for m in mismatches:
+            self.error('vote mismatch: %s', m, category='vote mismatch', what=str(m.race), who=_who(m.location))
+        return mismatches
+
+    @within
+    def validate(self, report_level=None, locations: set = None) -> Iterable:
+        """ Validate all records :returns (ErrorKey, {description, ...}), ... of the findings at or above report_level,
+            read as they're iterated (see iter_errors), nothing is copied
+            locations: only validate these again (see refresh()), None: validate everything
         """
         report_level = self.report_level if report_level is None else report_level
         tabulator_results = {}  # by location, where a location refer to a set of tabulator_results
-        tabulators = Tabulator.by_location(self.tabulators.values())
+        groups = Tabulator.location_groups(self.tabulators.values())
+        tabulators = Tabulator.by_location(self.tabulators.values(), groups)
         er_precincts = first(self.results.values())._precincts
+        self.retract(None if locations is None else [_who(loc) for loc in locations])
+
+        with self._stage('validate_locations'):
+            self.validate_locations(er_precincts, groups, locations=locations)
+        with self._stage('validate_tapes') as counts:
+            tapes = [tab for tabs in self._tabulators_by_file.values() for tab in tabs]    # with those of the same _key
+            counts['duplicates'] = len(self.validate_tapes(tapes, locations=locations))
+        with self._stage('validate_races') as counts:
+            counts['mismatches'] = len(self.validate_races(er_precincts, tabulators, locations=locations))
+
+        return self.iter_errors(report_level=report_level)
+
 
-        self.validate_locations(er_precincts, tabulators)
-        self.validate_races(er_precincts, tabulators)
+def report_level(args) -> int:
+    """ the report level the args ask for (setting args.report_level) """
+    if args.errors:
+        args.report_level = logging.ERROR
+    elif args.warnings:
+        args.report_level = logging.WARN
+    elif args.info:
+        args.report_level = logging.INFO
+    return args.report_level if type(args.report_level) is int else logging.INFO
 
-        return self.errors(report_level=report_level)
+
+def _who(location) -> str:
+    """ who a finding about a location is logged by, so it can be retracted when the location is checked again """
+    return f'precinct:{location}'
+
+
+def _location(tab: Tabulator):
+    """ the precinct a tape counts, or the tuple of a multi-precinct tape """
+    return tab.locations if len(tab.locations) > 1 else tab.locations[0]
+
+
+def _locations(tab: Tabulator) -> set:
+    """ the precincts tab counts, and the tuple of a multi-precinct tape """
+    return set(tab.locations) | ({tab.locations} if len(tab.locations) > 1 else set())
 
 
 def get_args():
@@ -174,12 +418,35 @@ def get_args():
 
 def main():
     args = get_args()
-    report = Report(args=args, load=True)
-    result = report.validate()
+    if args.statewide:
+        from statewide import Statewide
+        LogSelf.set_level(report_level(args))
+        state = Statewide(args).load()
+        state.save(filename=Path(args.output).expanduser())
+        if logging.root.isEnabledFor(logging.INFO):
+            logging.info(f"Counties:\n{pformat(state.counties)}")
+        return
+    report = Report(args=args, load=False, registry=Registry(str(args.sos_results_xml)))
+    LogSelf.set_level(report.report_level)      # findings that won't be reported aren't kept
     report_filename = Path(args.output).expanduser()
-    report.save_xlsx(filename=report_filename)
-    from pprint import pformat
-    logging.info(f"Results:\n{pformat(result)}\n====== End of Results ======")
+    with Profiler() if args.profile else nullcontext() as report.profiler:
+        report.load(args=args)
+        report.validate()
+        report.save(filename=report_filename)
+    if report.profiler:
+        report.profiler.save(Path(args.profile).expanduser(), xml=str(report.dir_results), jobs=args.jobs,
+                             tabulators=len(report.tabulators))
+        print(report.profiler.summary())
+        report.profiler = None
+    if logging.root.isEnabledFor(logging.INFO):
+        buckets = report.diagnostics(level=report.report_level)
+        logging.info("Results: %d findings\n%s\n====== End of Results ======", sum(b.count for b in buckets),
+                     '\n'.join(f"{b.count:>9,} {logging.getLevelName(b.level)} {b.why}: {b.what}" for b in buckets))
+    if args.watch:
+        try:
+            report.watch(filename=report_filename, interval=args.watch)
+        except KeyboardInterrupt:
+            pass
 
 
 if __name__ == '__main__':
@@ -0,0 +1,126 @@
+""" Report writers:
+Findings are streamed to the output file a chunk of rows at a time, so saving a report takes constant memory however
+many findings there are.  The writer is picked by the output file's suffix (see writer_for):
+ - .xlsx: one sheet per report, openpyxl write-only (rows go straight to a temporary file, not a Workbook in memory)
+ - .csv: one table, the first column is the report name
+ - .jsonl: one json object per finding
+"""
+import csv
+import json
+from abc import ABC, abstractmethod
+from datetime import datetime
+from itertools import islice
+from pathlib import Path
+from typing import Iterable
+from util import ErrorKey
+
+CHUNK = 1000        # rows written at a time
+HEADER = ErrorKey._fields + ('description(s)',)
+
+
+def _chunks(rows: Iterable, size: int = CHUNK) -> Iterable[list]:
+    rows = iter(rows)
+    while chunk := list(islice(rows, size)):
+        yield chunk
+
+
+class ReportWriter(ABC):
+    """ with Writer(filename) as w: w.write(name, findings) ... findings: ((ErrorKey, {description, ...}), ...) """
+    suffix = None
+
+    def __init__(self, filename: Path):
+        self.filename = Path(filename)
+        self.rows = 0
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def write(self, name: str, findings: Iterable[tuple]) -> int:
+        """ write one report's findings :returns the number of rows written """
+        n = 0
+        for chunk in _chunks(findings):
+            self._write_rows(name, chunk)
+            n += len(chunk)
+        self.rows += n
+        return n
+
+    @abstractmethod
+    def _write_rows(self, name: str, chunk: list):
+        """ write a chunk of (ErrorKey, {description, ...}) rows of report name """
+
+
+class XlsxWriter(ReportWriter):
+    suffix = '.xlsx'
+
+    def open(self):
+        from openpyxl import Workbook
+        self._wb = Workbook(write_only=True, iso_dates=True)
+        self._ws = None
+
+    def write(self, name: str, findings: Iterable[tuple]) -> int:
+        self._ws = self._wb.create_sheet(f"{name}", index=1)
+        self._ws.append(HEADER)
+        return super().write(name, findings)
+
+    def _write_rows(self, name: str, chunk: list):
+        for errkey, desc in chunk:
+            self._ws.append((*errkey, *list(desc)))
+
+    def close(self):
+        self._wb.save(filename=self.filename)
+        self._wb = self._ws = None
+
+
+class CsvWriter(ReportWriter):
+    suffix = '.csv'
+
+    def open(self):
+        self._file = open(self.filename, 'w', newline='', encoding='utf-8')
+        self._csv = csv.writer(self._file)
+        self._csv.writerow(('report',) + HEADER)
+
+    def _write_rows(self, name: str, chunk: list):
+        self._csv.writerows((name, *_plain(errkey), *sorted(desc)) for errkey, desc in chunk)
+
+    def close(self):
+        self._file.close()
+
+
+class JsonlWriter(ReportWriter):
+    suffix = '.jsonl'
+
+    def open(self):
+        self._file = open(self.filename, 'w', encoding='utf-8')
+
+    def _write_rows(self, name: str, chunk: list):
+        self._file.writelines(json.dumps({'report': name, **dict(zip(ErrorKey._fields, _plain(errkey))),
+                                          'descriptions': sorted(desc)}) + '\n' for errkey, desc in chunk)
+
+    def close(self):
+        self._file.close()
+
+
+WRITERS = {w.suffix: w for w in (XlsxWriter, CsvWriter, JsonlWriter)}
+
+
+def _plain(errkey: ErrorKey) -> tuple:
+    """ errkey with datetimes as iso strings """
+    return tuple(v.isoformat() if isinstance(v, datetime) else v for v in errkey)
+
+
+def writer_for(filename: Path) -> ReportWriter:
+    """ :returns the writer for filename's suffix (ValueError if there isn't one) """
+    suffix = Path(filename).suffix.lower()
+    if suffix not in WRITERS:
+        raise ValueError(f"can't write a report to {filename}, the output must be one of: {', '.join(WRITERS)}")
+    return WRITERS[suffix](filename)